@@ -0,0 +1,130 @@
+"""Token-budgeted data context for the analysis prompt.
+
+The block is independent of the user's query, so it is built once per
+session and sent as a stable prompt prefix.
+"""
+import json, os
+
+from lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', 6000))
+SAMPLE_ROWS = 50
+MAX_SAMPLE_COLUMNS = 15
+MAX_STRATA = 20
+
+_encoding = None
+
+
+def estimate_tokens(text):
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model("gpt-4o")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def _is_categorical(ci, row_count):
+    return "top_values" in ci and 1 < ci.get("unique_count", 0) <= MAX_STRATA < row_count
+
+
+def column_score(ci, row_count):
+    unique = ci.get("unique_count", 0)
+    if "datetime" in ci["type"]:
+        score = 4.0
+    elif "mean" in ci:
+        score = 3.0
+    elif _is_categorical(ci, row_count) or 1 < unique <= 50:
+        score = 3.0
+    elif unique >= 0.9 * row_count:
+        # Identifier-like text says little per token
+        score = 0.5
+    else:
+        score = 2.0
+    return score * (1 - ci.get("null_count", 0) / max(row_count, 1))
+
+
+def rank_columns(columns, row_count):
+    return sorted(columns, key=lambda ci: -column_score(ci, row_count))
+
+
+def describe_column(ci):
+    line = f"\n- {ci['name']} ({ci['type']}): "
+    if "min" in ci and ci.get("min") is not None:
+        line += f"min={ci['min']}, max={ci['max']}, mean={ci.get('mean','N/A')}, median={ci.get('median','N/A')}"
+    if "top_values" in ci:
+        line += f"top values={ci['top_values']}"
+    return line
+
+
+def sample_indices(n, k, strata=None):
+    """Evenly spaced row positions; with ``strata`` every group gets a share
+    proportional to its size (at least one row)."""
+    if n <= k:
+        return np.arange(n)
+    if strata is None:
+        return np.unique(np.linspace(0, n - 1, k).round().astype(np.int64))
+    codes, _ = pd.factorize(np.asarray(strata), use_na_sentinel=False)
+    picks = []
+    for g, size in enumerate(np.bincount(codes)):
+        positions = np.flatnonzero(codes == g)
+        take = max(1, int(round(k * size / n)))
+        picks.append(positions[np.linspace(0, size - 1, min(take, size)).round().astype(np.int64)])
+    return np.unique(np.concatenate(picks))
+
+
+def build_data_context(session, n_rows, frame_fn, budget=PROMPT_TOKEN_BUDGET):
+    """``frame_fn(columns, indices=None)`` returns those columns (and rows)
+    of the session's dataset as a DataFrame."""
+    row_count = session["row_count"]
+    ranked = rank_columns(session["columns"], row_count)
+
+    header = f"""DATA CONTEXT:
+File: {session['filename']}
+Rows: {row_count} | Columns: {session['column_count']}
+Date Range: {json.dumps(session['date_range'])}
+Data Quality: {json.dumps(session['data_quality'])}
+
+COLUMN STATISTICS:"""
+    stats = [describe_column(ci) for ci in ranked]
+    sizes = [estimate_tokens(line) for line in stats]
+    total = estimate_tokens(header) + sum(sizes)
+    omitted = 0
+    # Column statistics get at most half the budget; the rest is for rows
+    while len(stats) > 1 and total > budget // 2:
+        stats.pop()
+        total -= sizes.pop()
+        omitted += 1
+    if omitted:
+        stats.append(f"\n- ({omitted} lower-ranked columns omitted)")
+    base = header + "".join(stats)
+
+    if not n_rows or not ranked:
+        return base
+
+    strata = next((ci["name"] for ci in ranked if _is_categorical(ci, row_count)), None)
+    indices = sample_indices(n_rows, SAMPLE_ROWS, frame_fn([strata])[strata] if strata else None)
+    order = [ci["name"] for ci in session["columns"]]
+    keep = {ci["name"] for ci in ranked[:MAX_SAMPLE_COLUMNS]}
+    cols = [c for c in order if c in keep]
+    sample_df = frame_fn(cols, indices)
+
+    while True:
+        label = f"{len(sample_df)} representative rows" + (f", stratified by {strata}" if strata else "")
+        text = f"{base}\n\nSAMPLE DATA ({label}):\n{sample_df.to_csv(index=False)}"
+        if estimate_tokens(text) <= budget:
+            return text
+        if len(sample_df) > 10:
+            sample_df = sample_df.iloc[::2]
+        elif len(sample_df.columns) > 1:
+            drop = next(ci["name"] for ci in reversed(ranked) if ci["name"] in sample_df.columns)
+            sample_df = sample_df.drop(columns=[drop])
+        else:
+            return text
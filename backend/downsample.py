@@ -0,0 +1,103 @@
+"""Downsampling of large chart series before they are sent to the browser.
+
+Line and area charts use Largest-Triangle-Three-Buckets, which keeps the
+points that shape the curve (peaks, troughs, turns). Scatter plots keep the
+lowest and highest point of each bucket along the x axis so outliers stay
+visible.
+"""
+from lazy import LazyModule
+
+np = LazyModule('numpy')
+
+SAMPLED_CHART_TYPES = {"line", "area", "scatter"}
+
+
+def _numbers(values):
+    out = np.full(len(values), np.nan)
+    for i, v in enumerate(values):
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[i] = v
+    return out
+
+
+def lttb_indices(x, y, n_out):
+    """Indices of the ``n_out`` points of (x, y) chosen by LTTB, always
+    including the first and last point."""
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:max(n_out, 1)])
+    # n_out - 2 buckets over the points between the first and the last
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nxt = slice(edges[i + 1], edges[i + 2])
+            finite = y[nxt][np.isfinite(y[nxt])]
+            avg_x, avg_y = x[nxt].mean(), finite.mean() if len(finite) else np.nan
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        # Twice the area of the triangle (previous pick, candidate, next average)
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(order, y, n_out):
+    """Indices of the lowest and highest ``y`` in each bucket of ``order``
+    (positions sorted along the x axis), plus both ends: at most ``n_out``."""
+    if n_out >= len(order):
+        return np.sort(order)
+    keep = {order[0], order[-1]}
+    for bucket in np.array_split(order, max((n_out - 2) // 2, 1)):
+        values = y[bucket]
+        if np.isnan(values).all():
+            keep.add(bucket[0])
+            continue
+        keep.add(bucket[np.nanargmin(values)])
+        keep.add(bucket[np.nanargmax(values)])
+    return np.array(sorted(keep))
+
+
+def downsample_chart(chart, max_points):
+    """Returns ``chart`` with ``data`` reduced to about ``max_points`` rows
+    when it is a line, area or scatter chart with more than that. A reduced
+    chart also carries ``original_points`` and the ``sampling`` method."""
+    data = chart.get("data") if isinstance(chart, dict) else None
+    if (not max_points or not isinstance(data, list) or len(data) <= max_points
+            or chart.get("chart_type") not in SAMPLED_CHART_TYPES):
+        return chart
+    n = len(data)
+    rows = [row if isinstance(row, dict) else {} for row in data]
+    y_keys = [k for k in chart.get("y_keys") or [] if isinstance(k, str)]
+    if not y_keys:
+        y_keys = [k for k in rows[0] if k != chart.get("x_key")]
+    method = "minmax" if chart["chart_type"] == "scatter" else "lttb"
+    x = _numbers([row.get(chart.get("x_key")) for row in rows])
+    if np.isnan(x).any() or (method == "lttb" and (np.diff(x) < 0).any()):
+        # Category or date labels (or an unordered x): the points are
+        # evenly spaced in the order they are drawn
+        x = np.arange(n, dtype=float)
+
+    # Each series gets an equal share of the budget; the union keeps every
+    # series' extremes
+    budget = max(max_points // max(len(y_keys), 1), 3)
+    order = np.argsort(x, kind="stable")
+    keep = set()
+    for key in y_keys:
+        y = _numbers([row.get(key) for row in rows])
+        if method == "lttb":
+            keep.update(lttb_indices(x, y, budget).tolist())
+        else:
+            keep.update(minmax_indices(order, y, budget).tolist())
+
+    chart = dict(chart)
+    chart["data"] = [data[i] for i in sorted(keep)]
+    chart["original_points"] = n
+    chart["sampling"] = method
+    return chart
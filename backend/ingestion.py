@@ -0,0 +1,290 @@
+"""Upload ingestion: spool to disk, parse in chunks, infer types, dedup."""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib, os, tempfile
+
+from lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+pa = LazyModule('pyarrow')
+
+UPLOAD_READ_BYTES = 1 << 20
+UPLOAD_CHUNK_ROWS = int(os.environ.get('UPLOAD_CHUNK_ROWS', 100_000))
+
+# Type inference runs on a sample of the first chunk and is checked against
+# the whole chunk; the resulting plan (including one datetime format per
+# column, with format='mixed' as the fallback) is reused for every chunk.
+INFER_SAMPLE_ROWS = 1000
+INFER_MIN_RATIO = 0.95
+INFER_WORKERS = int(os.environ.get('INFER_WORKERS', min(8, os.cpu_count() or 1)))
+CATEGORY_MAX_VALUES = 50
+CATEGORY_MAX_RATIO = 0.1
+# Text columns repeating values this much are dictionary-encoded on compaction
+DICTIONARY_MAX_RATIO = 0.5
+BOOLEAN_VALUES = {'true': True, 'false': False, 'yes': True, 'no': False,
+                  'y': True, 'n': False, 't': True, 'f': False}
+# Month-first before day-first, matching the previous dayfirst=False parsing
+DATETIME_FORMATS = (
+    'ISO8601', '%m/%d/%Y', '%m/%d/%Y %H:%M', '%m/%d/%Y %H:%M:%S', '%d/%m/%Y',
+    '%d/%m/%Y %H:%M', '%m-%d-%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y/%m/%d',
+    '%d %b %Y', '%b %d, %Y', '%d %B %Y', '%B %d, %Y', '%b %Y', '%B %Y',
+)
+
+
+async def spool_upload(file, suffix=''):
+    """Copies an upload to a temporary file, hashing it on the way.
+    Returns the path and the SHA-256 hex digest of the content."""
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix='upload-')
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                block = await file.read(UPLOAD_READ_BYTES)
+                if not block:
+                    break
+                digest.update(block)
+                out.write(block)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest()
+
+
+def read_chunks(path, ext, chunk_rows=UPLOAD_CHUNK_ROWS):
+    if ext == 'csv':
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+        return
+    # Excel has no incremental reader in pandas; the sheet is bounded by
+    # the format itself, so it is parsed once and fed through in slices.
+    df = pd.read_excel(path)
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _is_text(dtype):
+    return pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+
+
+def _sample(s, rows):
+    s = s.dropna()
+    return s.sample(rows, random_state=0) if len(s) > rows else s
+
+
+def _parse_ratio(parsed, sample):
+    return parsed.notna().sum() / max(len(sample), 1)
+
+
+def _parse_datetimes(s, fmt):
+    try:
+        return pd.to_datetime(s, format=fmt, errors='coerce')
+    except ValueError:
+        # Mixed UTC offsets only parse as UTC
+        return pd.to_datetime(s, format=fmt, errors='coerce', utc=True)
+
+
+def infer_column_type(s, sample_rows=INFER_SAMPLE_ROWS):
+    sample = _sample(s, sample_rows)
+    if sample.empty:
+        return None
+    text = sample.astype(str).str.strip()
+
+    # Numbers stored as text must all parse; a stray label means a text column
+    if _parse_ratio(pd.to_numeric(text, errors='coerce'), text) == 1:
+        return ('numeric', None)
+
+    if text.str.lower().isin(BOOLEAN_VALUES).all():
+        return ('boolean', None)
+
+    if s.notna().mean() > 0.5:
+        for fmt in DATETIME_FORMATS + ('mixed',):
+            try:
+                if _parse_ratio(_parse_datetimes(text, fmt), text) >= INFER_MIN_RATIO:
+                    return ('datetime', fmt)
+            except (ValueError, TypeError):
+                pass
+
+    if text.nunique() <= CATEGORY_MAX_VALUES and text.nunique() <= len(text) * CATEGORY_MAX_RATIO:
+        return ('categorical', None)
+    return None
+
+
+def infer_column_types(df, sample_rows=INFER_SAMPLE_ROWS):
+    cols = [c for c in df.columns if _is_text(df[c].dtype)]
+    with ThreadPoolExecutor(max_workers=INFER_WORKERS) as pool:
+        kinds = pool.map(lambda c: infer_column_type(df[c], sample_rows), cols)
+    return {c: k for c, k in zip(cols, kinds) if k is not None}
+
+
+def _convert(s, kind, fmt):
+    if kind == 'numeric':
+        return pd.to_numeric(s, errors='coerce')
+    if kind == 'boolean':
+        return s.str.strip().str.lower().map(BOOLEAN_VALUES).astype('boolean')
+    if kind == 'datetime':
+        parsed = _parse_datetimes(s, fmt)
+        # Values in another format than the sampled one get a second chance
+        retry = s.notna() & parsed.isna()
+        if fmt != 'mixed' and retry.any():
+            try:
+                parsed[retry] = _parse_datetimes(s[retry], 'mixed').astype(parsed.dtype)
+            except (ValueError, TypeError):
+                pass
+        return parsed
+    return s.astype('category')
+
+
+def _unparsed(s, converted):
+    return int((s.notna() & converted.isna()).sum())
+
+
+def apply_column_types(df, types):
+    """Converts a chunk to the inferred types. Returns the frame and the
+    number of values per column that did not parse and became null."""
+    if not types:
+        return df, {}
+    df = df.copy()
+    cols = [c for c in types if c in df.columns]
+    with ThreadPoolExecutor(max_workers=INFER_WORKERS) as pool:
+        converted = pool.map(lambda c: _convert(df[c], *types[c]), cols)
+    failed = {}
+    for col, values in zip(cols, converted):
+        n = _unparsed(df[col], values)
+        if n:
+            failed[col] = n
+        df[col] = values
+    return df, failed
+
+
+def settle_column_types(df, types):
+    """Converts the first chunk. A column where any value fails to parse
+    keeps its text, since a sampled type would lose those values in every
+    chunk. Returns the frame and the types kept for the later chunks."""
+    converted, failed = apply_column_types(df, types)
+    for col in failed:
+        converted[col] = df[col]
+    return converted, {c: t for c, t in types.items() if c not in failed}
+
+
+def _compact_column(s):
+    dtype = s.dtype
+    if pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+        return pd.to_numeric(s, downcast='integer')
+    if dtype == np.float64:
+        # Only when every value survives the round trip through float32
+        values = s.to_numpy()
+        narrow = values.astype(np.float32)
+        if np.array_equal(narrow.astype(np.float64), values, equal_nan=True):
+            return pd.Series(narrow, index=s.index, name=s.name)
+        return s
+    if _is_text(dtype) and not isinstance(dtype, pd.CategoricalDtype):
+        if pd.api.types.is_object_dtype(dtype):
+            if pd.api.types.infer_dtype(s, skipna=True) not in ('string', 'empty'):
+                return s
+            s = s.astype(pd.StringDtype('pyarrow', na_value=np.nan))
+        if len(s) and s.nunique() <= len(s) * DICTIONARY_MAX_RATIO:
+            return s.astype('category')
+    return s
+
+
+def compact_frame(df):
+    """Smallest lossless dtypes for a parsed chunk: integers downcast,
+    float64 to float32 where exact, Arrow-backed strings, and repetitive
+    text as categoricals (stored as dictionary-encoded columns)."""
+    return pd.DataFrame({col: _compact_column(df[col]) for col in df.columns}, index=df.index)
+
+
+def memory_bytes(df):
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+
+class SchemaMismatch(ValueError):
+    pass
+
+
+def _stored_kind(type_):
+    if pa.types.is_timestamp(type_):
+        return 'datetime'
+    if pa.types.is_boolean(type_):
+        return 'boolean'
+    if pa.types.is_integer(type_) or pa.types.is_floating(type_):
+        return 'numeric'
+    if pa.types.is_string(type_) or pa.types.is_large_string(type_) or pa.types.is_dictionary(type_):
+        return 'text'
+    return None
+
+
+def _has_kind(dtype, kind):
+    if kind == 'datetime':
+        return pd.api.types.is_datetime64_any_dtype(dtype)
+    if kind == 'boolean':
+        return pd.api.types.is_bool_dtype(dtype)
+    if kind == 'numeric':
+        return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+    return _is_text(dtype)
+
+
+def conform_chunk(df, schema, types=None):
+    """Converts a chunk of appended rows to a stored dataset's schema,
+    using the upload's datetime formats where known. Returns the frame and
+    the values per column that did not parse, like apply_column_types.
+    Raises SchemaMismatch when the columns differ or a column's values do
+    not fit its type."""
+    missing = [c for c in schema.names if c not in df.columns]
+    unexpected = [str(c) for c in df.columns if c not in schema.names]
+    if missing or unexpected:
+        raise SchemaMismatch(f"Columns do not match the session: missing {missing}, unexpected {unexpected}")
+    df = df[schema.names].copy()
+    unparsed = {}
+    for field in schema:
+        kind = _stored_kind(field.type)
+        s = df[field.name]
+        if kind is None or _has_kind(s.dtype, kind):
+            continue
+        text = s.where(s.isna(), s.astype(str))
+        if kind == 'text':
+            df[field.name] = text
+            continue
+        fmt = (types or {}).get(field.name, (None, 'mixed'))[1] if kind == 'datetime' else None
+        converted = _convert(text, kind, fmt or 'mixed')
+        failed = _unparsed(s, converted)
+        if failed > (1 - INFER_MIN_RATIO) * max(int(s.notna().sum()), 1):
+            raise SchemaMismatch(f"Column '{field.name}' does not match its stored type {field.type}")
+        if failed:
+            unparsed[field.name] = failed
+        df[field.name] = converted
+    return df, unparsed
+
+
+def row_hashes(df):
+    # Numbers hash as float64 and timestamps at one unit, so a row hashes
+    # the same before and after its column is widened or read back from Arrow
+    cols = {}
+    for col in df.columns:
+        s = df[col]
+        if _has_kind(s.dtype, 'numeric'):
+            s = pd.Series(s.to_numpy(dtype='float64', na_value=np.nan))
+        elif pd.api.types.is_datetime64_dtype(s.dtype):
+            s = s.astype('datetime64[us]')
+        cols[col] = s.reset_index(drop=True)
+    return pd.util.hash_pandas_object(pd.DataFrame(cols), index=False).to_numpy()
+
+
+class RowDeduper:
+    """Drops rows already seen in this or an earlier chunk, remembering only
+    a sorted array of 64-bit row hashes. ``seen`` resumes a stored index."""
+
+    def __init__(self, seen=None):
+        self.seen = np.empty(0, dtype=np.uint64) if seen is None else seen
+        self.removed = 0
+
+    def filter(self, df):
+        if df.empty:
+            return df
+        hashes = row_hashes(df)
+        dup = pd.Series(hashes).duplicated().to_numpy().copy()
+        if len(self.seen):
+            pos = np.minimum(np.searchsorted(self.seen, hashes), len(self.seen) - 1)
+            dup |= self.seen[pos] == hashes
+        self.seen = np.sort(np.concatenate([self.seen, hashes[~dup]]))
+        self.removed += int(dup.sum())
+        return df[~dup]
@@ -0,0 +1,109 @@
+"""Background upload jobs: status, per-stage progress and cancellation."""
+from datetime import datetime, timezone
+import multiprocessing, threading, time
+
+from cache import TTLCache
+
+TERMINAL = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Progress:
+    """Passed to the ingest worker. ``state`` is a plain dict for thread
+    workers or a manager dict proxy for process workers; calling the object
+    records the stage and row count and raises JobCancelled once the job
+    has been cancelled."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def __call__(self, stage, rows=None):
+        if self.state.get("cancelled"):
+            raise JobCancelled()
+        update = {"stage": stage}
+        if rows is not None:
+            update["rows"] = rows
+        self.state.update(update)
+
+
+class UploadJob:
+    def __init__(self, job_id, filename, size, state):
+        self.id = job_id
+        self.filename = filename
+        self.size = size
+        self.state = state
+        self.status = None
+        self.error = None
+        self.session = None
+        self.task = None
+        self.created_at = datetime.now(timezone.utc)
+        self.finished_at = None
+        self.started = time.monotonic()
+
+    @property
+    def progress(self):
+        return Progress(self.state)
+
+    def finish(self, status, session=None, error=None):
+        self.status, self.session, self.error = status, session, error
+        self.finished_at = datetime.now(timezone.utc)
+
+    def to_dict(self):
+        state = self.state.copy()
+        if self.status in TERMINAL:
+            status = stage = self.status
+        else:
+            stage = state.get("stage")
+            status = "cancelling" if state.get("cancelled") else "running" if stage else "queued"
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "bytes": self.size,
+            "status": status,
+            "stage": stage or status,
+            "rows_parsed": state.get("rows", 0),
+            "elapsed_seconds": round(time.monotonic() - self.started, 3),
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error,
+            "session": self.session,
+        }
+
+
+class JobRegistry:
+    """In-process job table. Finished jobs are kept for ``ttl`` seconds so
+    clients can still read the outcome."""
+
+    def __init__(self, ttl=3600, maxsize=1024):
+        self.ttl = ttl
+        self._jobs = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def _shared_dict(self):
+        with self._lock:
+            if self._manager is None:
+                self._manager = multiprocessing.Manager()
+            return self._manager.dict()
+
+    def create(self, job_id, filename, size, shared=False):
+        # Worker processes can only see progress state held by a manager
+        job = UploadJob(job_id, filename, size, self._shared_dict() if shared else {})
+        # Running jobs must outlive any client that stops polling
+        self._jobs.set(job_id, job, ttl=24 * 3600)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def finish(self, job, status, session=None, error=None):
+        job.finish(status, session, error)
+        self._jobs.set(job.id, job, ttl=self.ttl)
+
+    def shutdown(self):
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
@@ -0,0 +1,29 @@
+"""Module references that import on first attribute access.
+
+pandas, NumPy and PyArrow take most of a cold start, and nothing on the
+startup path needs them; the data modules bind them through ``LazyModule``
+so ``import server`` stays cheap and the first request (or the warm-up)
+pays for the import instead."""
+import importlib
+
+
+class LazyModule:
+    """Stands in for ``import <name>``. The import itself runs under the
+    interpreter's module lock, so concurrent first uses are safe."""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self.__dict__['_name']}'>"
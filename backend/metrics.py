@@ -0,0 +1,149 @@
+"""In-process metrics in the Prometheus text format, plus per-request stage
+timing for the Server-Timing header."""
+from contextlib import contextmanager
+import bisect, threading, time
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KiB .. 1 GiB
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs):
+        self.metrics.append(Counter(*args, **kwargs))
+        return self.metrics[-1]
+
+    def histogram(self, *args, **kwargs):
+        self.metrics.append(Histogram(*args, **kwargs))
+        return self.metrics[-1]
+
+    def render(self):
+        return "\n".join(line for m in self.metrics for line in m.render()) + "\n"
+
+
+REGISTRY = Registry()
+OPERATION_SECONDS = REGISTRY.histogram("analyst_operation_duration_seconds", "End-to-end time of an operation", ["operation"])
+STAGE_SECONDS = REGISTRY.histogram("analyst_stage_duration_seconds", "Time spent in one stage of an operation", ["operation", "stage"])
+PAYLOAD_BYTES = REGISTRY.histogram("analyst_payload_bytes", "Size of uploads, prompts, responses and reports", ["operation", "kind"], SIZE_BUCKETS)
+ROWS_INGESTED = REGISTRY.counter("analyst_rows_ingested_total", "Rows written to session datasets")
+LLM_TOKENS = REGISTRY.counter("analyst_llm_tokens_total", "Tokens reported by the OpenAI usage field", ["model", "kind"])
+LLM_REQUESTS = REGISTRY.counter("analyst_llm_requests_total", "OpenAI completions by outcome", ["model", "outcome"])
+CACHE_REQUESTS = REGISTRY.counter("analyst_cache_requests_total", "Cache lookups by cache and result", ["cache", "result"])
+RETENTION_SESSIONS = REGISTRY.counter("analyst_retention_sessions_total", "Sessions expired, evicted, frozen to cold storage or rehydrated", ["action"])
+
+
+def record_usage(model, usage):
+    if usage is None:
+        return
+    LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="prompt")
+    LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, kind="completion")
+
+
+class StageTimer:
+    """Durations of the named stages of one operation. ``stages`` is a plain
+    dict so timings taken in a worker process can be sent back and merged."""
+
+    def __init__(self, operation=None):
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def merge(self, stages):
+        for name, seconds in (stages or {}).items():
+            self.add(name, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def iterate(self, name, iterable):
+        # Charges the time spent producing each item to ``name``
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def observe(self):
+        total = time.perf_counter() - self.started
+        OPERATION_SECONDS.observe(total, operation=self.operation)
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, operation=self.operation, stage=name)
+        return total
+
+    def header(self):
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
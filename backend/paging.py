@@ -0,0 +1,205 @@
+"""Paged reads of a session dataset: projection, filters, sort and keyset
+cursors, evaluated with Arrow compute on the memory-mapped table.
+
+A cursor records the row position (and sort value) of the last row served,
+so the next page starts from there instead of re-reading skipped rows.
+"""
+import base64, json
+
+from lazy import LazyModule
+
+np = LazyModule('numpy')
+pa = LazyModule('pyarrow')
+pc = LazyModule('pyarrow.compute')
+
+MAX_PAGE_ROWS = 10_000
+SCAN_BATCH_ROWS = 65_536
+
+# Arrow compute function per comparison operator
+FILTER_OPS = {
+    "eq": "equal", "ne": "not_equal", "gt": "greater", "ge": "greater_equal",
+    "lt": "less", "le": "less_equal",
+}
+
+
+class PageError(ValueError):
+    pass
+
+
+def encode_token(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload, default=str).encode()).decode().rstrip("=")
+
+
+def decode_token(token):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise PageError("Invalid cursor")
+    if not isinstance(payload, dict):
+        raise PageError("Invalid cursor")
+    return payload
+
+
+def encode_cursor(row, value=None, sort=None):
+    payload = {"r": int(row)}
+    if sort is not None:
+        payload["s"] = sort
+        payload["v"] = value
+    return encode_token(payload)
+
+
+def decode_cursor(cursor):
+    payload = decode_token(cursor)
+    try:
+        return int(payload["r"]), payload.get("v"), payload.get("s")
+    except (ValueError, KeyError, TypeError):
+        raise PageError("Invalid cursor")
+
+
+def _plain(col):
+    # Compute kernels work on the values, not dictionary indices
+    return col.cast(col.type.value_type) if pa.types.is_dictionary(col.type) else col
+
+
+def _scalar(value, type_):
+    if pa.types.is_dictionary(type_):
+        type_ = type_.value_type
+    try:
+        return pa.scalar(value).cast(type_)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        raise PageError(f"Value {value!r} does not fit column type {type_}")
+
+
+def parse_filters(specs, schema):
+    """``specs`` are ``column:op[:value]`` strings; ``in`` takes
+    ``|``-separated values, ``null``/``notnull`` take none."""
+    filters = []
+    for spec in specs or []:
+        column, _, rest = spec.partition(":")
+        op, _, value = rest.partition(":")
+        if column not in schema.names:
+            raise PageError(f"Unknown filter column '{column}'")
+        type_ = schema.field(column).type
+        if op in FILTER_OPS:
+            filters.append((column, op, _scalar(value, type_)))
+        elif op == "in":
+            values = [_scalar(v, type_) for v in value.split("|")]
+            filters.append((column, op, pa.array([v.as_py() for v in values], values[0].type)))
+        elif op == "contains":
+            filters.append((column, op, value))
+        elif op in ("null", "notnull"):
+            filters.append((column, op, None))
+        else:
+            raise PageError(f"Unsupported filter op '{op}'")
+    return filters
+
+
+def _mask(batch, filters):
+    mask = None
+    for column, op, value in filters:
+        col = _plain(batch.column(column))
+        if op in FILTER_OPS:
+            m = getattr(pc, FILTER_OPS[op])(col, value)
+        elif op == "in":
+            m = pc.is_in(col, value_set=value)
+        elif op == "contains":
+            m = pc.match_substring(pc.cast(col, pa.string()), value, ignore_case=True)
+        elif op == "null":
+            m = pc.is_null(col)
+        else:
+            m = pc.is_valid(col)
+        m = pc.fill_null(m, False)
+        mask = m if mask is None else pc.and_(mask, m)
+    return mask
+
+
+def _scan_positions(table, filters, start, need):
+    # Unsorted pages follow file order, so the scan stops once it has
+    # ``need`` matching rows
+    picked = []
+    offset = start
+    for batch in table.slice(start).to_batches(max_chunksize=SCAN_BATCH_ROWS):
+        if filters:
+            positions = np.flatnonzero(_mask(batch, filters).to_numpy(zero_copy_only=False)) + offset
+        else:
+            positions = np.arange(offset, offset + batch.num_rows)
+        picked.append(positions[:need])
+        need -= len(picked[-1])
+        offset += batch.num_rows
+        if need <= 0:
+            break
+    return np.concatenate(picked) if picked else np.empty(0, dtype=np.int64)
+
+
+def _keyset_mask(col, rows, last_row, last_value, descending):
+    after_row = pc.greater(rows, pa.scalar(last_row, pa.int64()))
+    if last_value is None:
+        # Nulls sort last; past a null only later nulls remain
+        return pc.and_(pc.is_null(col), after_row)
+    beyond = pc.less(col, last_value) if descending else pc.greater(col, last_value)
+    tie = pc.and_(pc.equal(col, last_value), after_row)
+    return pc.or_kleene(pc.or_kleene(beyond, tie), pc.is_null(col))
+
+
+def _sorted_positions(table, filters, sort, descending, cursor, need):
+    rows = pa.array(np.arange(table.num_rows, dtype=np.int64))
+    mask = _mask(table, filters) if filters else None
+    if cursor is not None:
+        last_row, last_value = cursor
+        if last_value is not None:
+            last_value = _scalar(last_value, table.schema.field(sort).type)
+        km = _keyset_mask(_plain(table.column(sort)), rows, last_row, last_value, descending)
+        mask = km if mask is None else pc.and_(mask, km)
+    keys = pa.table({"v": _plain(table.column(sort)), "r": rows})
+    if mask is not None:
+        keys = keys.filter(mask)
+
+    # Top-k over the non-null values, then nulls in file order
+    valid = pc.is_valid(keys.column("v"))
+    present, missing = keys.filter(valid), keys.filter(pc.invert(valid))
+    k = min(need, present.num_rows)
+    positions = np.empty(0, dtype=np.int64)
+    if k:
+        order = "descending" if descending else "ascending"
+        top = pc.select_k_unstable(present, k, [("v", order), ("r", "ascending")])
+        positions = present.column("r").take(top).to_numpy()
+    if len(positions) < need:
+        positions = np.concatenate([positions, missing.column("r").slice(0, need - len(positions)).to_numpy()])
+    return positions
+
+
+def select_rows(table, filters=(), sort=None, descending=False, cursor=None, offset=0, limit=100):
+    """Returns ``(positions, next_cursor)``: the row positions of one page in
+    output order and the cursor for the page after it (None at the end).
+    ``limit=None`` selects every remaining row."""
+    if sort is not None and sort not in table.schema.names:
+        raise PageError(f"Unknown sort column '{sort}'")
+    limit = table.num_rows if limit is None else limit
+    need = offset + limit + 1
+    if cursor:
+        last_row, last_value, cursor_sort = decode_cursor(cursor)
+        if cursor_sort != sort:
+            raise PageError("Cursor does not match the requested sort")
+
+    if sort is None:
+        positions = _scan_positions(table, filters, last_row + 1 if cursor else 0, need)
+    else:
+        positions = _sorted_positions(table, filters, sort, descending,
+                                      (last_row, last_value) if cursor else None, need)
+    positions = positions[offset:]
+    more = len(positions) > limit
+    positions = positions[:limit]
+
+    next_cursor = None
+    if more and len(positions):
+        last = int(positions[-1])
+        next_cursor = encode_cursor(last) if sort is None else encode_cursor(last, table.column(sort)[last].as_py(), sort)
+    return positions, next_cursor
+
+
+def iter_pages(table, positions, columns=None, batch_rows=SCAN_BATCH_ROWS):
+    """Yields the selected rows as tables of at most ``batch_rows`` rows."""
+    if columns is not None:
+        table = table.select(columns)
+    for start in range(0, len(positions), batch_rows):
+        yield table.take(pa.array(positions[start:start + batch_rows], pa.int64()))
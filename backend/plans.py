@@ -0,0 +1,317 @@
+"""Declarative chart plans.
+
+Instead of writing chart numbers itself, the model describes how to compute
+them (filters, group-by keys, a time bucket, aggregations, sort and top-N).
+The plan is checked against the session's column metadata and then run
+vectorized over the full dataset.
+"""
+import math
+
+from lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+from downsample import SAMPLED_CHART_TYPES
+
+MAX_PLAN_POINTS = 1000
+# Line, area and scatter charts are downsampled after the plan runs, so
+# they may start from many more points than a bar chart can show
+MAX_SAMPLED_POINTS = 100_000
+MAX_SERIES = 10
+
+AGGREGATIONS = {"sum", "mean", "median", "min", "max", "std", "count", "nunique"}
+NUMERIC_AGGREGATIONS = {"sum", "mean", "median", "std"}
+ORDERED_AGGREGATIONS = {"min", "max"}
+FILTER_OPS = {"==", "!=", ">", ">=", "<", "<=", "in", "not_in", "between", "contains", "is_null", "not_null"}
+FREQUENCIES = {"day": "D", "week": "W", "month": "M", "quarter": "Q", "year": "Y"}
+
+
+class PlanError(ValueError):
+    pass
+
+
+def column_kind(type_name):
+    try:
+        dtype = pd.api.types.pandas_dtype(type_name)
+    except TypeError:
+        return 'other'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'boolean'
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'numeric'
+    return 'other'
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _coerce(value, kind, column):
+    try:
+        if kind == 'numeric':
+            return float(value)
+        if kind == 'datetime':
+            return pd.Timestamp(value)
+    except (TypeError, ValueError):
+        raise PlanError(f"Filter value {value!r} does not fit {kind} column '{column}'")
+    return value
+
+
+def validate_plan(plan, columns_info):
+    """Returns a normalized copy of ``plan``; raises PlanError when it
+    refers to unknown columns or asks for an operation the column's type
+    does not support."""
+    if not isinstance(plan, dict):
+        raise PlanError("Plan must be an object")
+    kinds = {ci["name"]: column_kind(ci["type"]) for ci in columns_info}
+
+    def check_column(name, role):
+        if name not in kinds:
+            raise PlanError(f"Unknown {role} column '{name}'")
+        return kinds[name]
+
+    filters = []
+    for f in _as_list(plan.get("filters")):
+        if not isinstance(f, dict):
+            raise PlanError("Each filter must be an object")
+        column, op = f.get("column"), f.get("op", "==")
+        kind = check_column(column, "filter")
+        if op not in FILTER_OPS:
+            raise PlanError(f"Unsupported filter op '{op}'")
+        value = f.get("value")
+        if op in ("in", "not_in"):
+            value = [_coerce(v, kind, column) for v in _as_list(value)]
+        elif op == "between":
+            value = _as_list(value)
+            if len(value) != 2:
+                raise PlanError("'between' needs a [low, high] value")
+            value = [_coerce(v, kind, column) for v in value]
+        elif op == "contains":
+            value = str(value)
+        elif op not in ("is_null", "not_null"):
+            if value is None:
+                raise PlanError(f"Filter on '{column}' needs a value")
+            value = _coerce(value, kind, column)
+        filters.append({"column": column, "op": op, "value": value})
+
+    group_by = _as_list(plan.get("group_by"))
+    for column in group_by:
+        check_column(column, "group_by")
+
+    time = plan.get("time")
+    if time:
+        if not isinstance(time, dict):
+            raise PlanError("'time' must be an object")
+        if check_column(time.get("column"), "time") != 'datetime':
+            raise PlanError(f"Time column '{time.get('column')}' is not a datetime column")
+        freq = time.get("freq", "month")
+        if freq not in FREQUENCIES:
+            raise PlanError(f"Unsupported time frequency '{freq}'")
+        time = {"column": time["column"], "freq": freq}
+
+    metrics = []
+    for m in _as_list(plan.get("metrics")):
+        if not isinstance(m, dict):
+            raise PlanError("Each metric must be an object")
+        column, agg = m.get("column"), m.get("agg", "sum")
+        if agg not in AGGREGATIONS:
+            raise PlanError(f"Unsupported aggregation '{agg}'")
+        if column is None:
+            if agg != "count":
+                raise PlanError(f"Aggregation '{agg}' needs a column")
+        else:
+            kind = check_column(column, "metric")
+            if agg in NUMERIC_AGGREGATIONS and kind not in ('numeric', 'boolean'):
+                raise PlanError(f"Cannot {agg} non-numeric column '{column}'")
+            if agg in ORDERED_AGGREGATIONS and kind == 'other':
+                raise PlanError(f"Cannot take {agg} of text column '{column}'")
+        metrics.append({"column": column, "agg": agg, "as": str(m.get("as") or (f"{agg}_{column}" if column else "count"))})
+    if not metrics:
+        metrics = [{"column": None, "agg": "count", "as": "count"}]
+    names = [m["as"] for m in metrics]
+    if len(set(names)) != len(names):
+        raise PlanError("Metric names must be unique")
+    keys = set(group_by) | ({time["column"]} if time else set())
+    for name in names:
+        if name in keys:
+            raise PlanError(f"Metric name '{name}' is already a grouping column")
+
+    if time and group_by:
+        if len(group_by) > 1 or len(metrics) > 1:
+            raise PlanError("A time series split by group supports one group_by column and one metric")
+
+    sort = plan.get("sort") or {}
+    if not isinstance(sort, dict):
+        raise PlanError("'sort' must be an object")
+    limit = plan.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise PlanError("'limit' must be an integer")
+        if limit < 1:
+            raise PlanError("'limit' must be positive")
+
+    return {"filters": filters, "group_by": group_by, "time": time, "metrics": metrics,
+            "sort": {"by": sort.get("by"), "desc": bool(sort.get("desc", True))}, "limit": limit}
+
+
+def plan_columns(plan):
+    columns = [f["column"] for f in plan["filters"]] + plan["group_by"]
+    if plan["time"]:
+        columns.append(plan["time"]["column"])
+    columns += [m["column"] for m in plan["metrics"] if m["column"]]
+    return list(dict.fromkeys(columns))
+
+
+def _match_tz(value, s):
+    # Filter dates are compared in the column's own zone, or as naive dates
+    if isinstance(value, list):
+        return [_match_tz(v, s) for v in value]
+    if not isinstance(value, pd.Timestamp) or not pd.api.types.is_datetime64_any_dtype(s.dtype):
+        return value
+    tz = getattr(s.dtype, 'tz', None)
+    if tz is None:
+        return value if value.tzinfo is None else value.tz_convert(None)
+    return value.tz_localize(tz) if value.tzinfo is None else value.tz_convert(tz)
+
+
+def _filter_mask(df, f):
+    s, op = df[f["column"]], f["op"]
+    value = _match_tz(f["value"], s)
+    if op == "==":
+        return s == value
+    if op == "!=":
+        return s != value
+    if op == ">":
+        return s > value
+    if op == ">=":
+        return s >= value
+    if op == "<":
+        return s < value
+    if op == "<=":
+        return s <= value
+    if op == "in":
+        return s.isin(value)
+    if op == "not_in":
+        return ~s.isin(value)
+    if op == "between":
+        return s.between(*value)
+    if op == "contains":
+        return s.astype(str).str.contains(value, case=False, regex=False)
+    if op == "is_null":
+        return s.isna()
+    return s.notna()
+
+
+def _period_labels(periods, freq):
+    if freq == "week":
+        return periods.start_time.strftime('%Y-%m-%d')
+    return periods.astype(str)
+
+
+def _aggregate(df, keys, metrics):
+    # Compact float32 columns are aggregated in float64 so sums keep their precision
+    narrow = {m["column"] for m in metrics if m["column"] is not None and df[m["column"]].dtype == np.float32}
+    if narrow:
+        df = df.assign(**{c: df[c].astype(np.float64) for c in narrow})
+    grouped = df.groupby(keys, observed=True, sort=False, dropna=True)
+    out = {}
+    for m in metrics:
+        if m["column"] is None:
+            out[m["as"]] = grouped.size()
+        else:
+            out[m["as"]] = grouped[m["column"]].agg(m["agg"])
+    return pd.DataFrame(out)
+
+
+def _record_value(v):
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float) and (math.isnan(v) or math.isinf(v)):
+        return None
+    if isinstance(v, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(v).isoformat()
+    if v is pd.NaT or v is pd.NA:
+        return None
+    return v
+
+
+def _records(df):
+    return [{k: _record_value(v) for k, v in row.items()} for row in df.to_dict(orient='records')]
+
+
+def execute_plan(plan, n_rows, frame_fn, chart_type=None):
+    """Runs a validated plan. ``frame_fn(columns)`` returns those columns of
+    the full dataset as a DataFrame. Returns the chart fields ``x_key``,
+    ``y_keys`` and ``data`` plus how many rows matched the filters."""
+    columns = plan_columns(plan)
+    df = frame_fn(columns) if columns else pd.DataFrame(index=pd.RangeIndex(n_rows))
+
+    if plan["filters"]:
+        mask = np.ones(len(df), dtype=bool)
+        for f in plan["filters"]:
+            mask &= _filter_mask(df, f).fillna(False).to_numpy(dtype=bool)
+        df = df[mask]
+    matched = len(df)
+
+    metrics = plan["metrics"]
+    y_keys = [m["as"] for m in metrics]
+    time, group_by, sort = plan["time"], plan["group_by"], plan["sort"]
+    max_points = MAX_SAMPLED_POINTS if chart_type in SAMPLED_CHART_TYPES else MAX_PLAN_POINTS
+
+    if time:
+        x_key = time["column"]
+        stamps = pd.to_datetime(df[x_key])
+        if getattr(stamps.dt, "tz", None) is not None:
+            stamps = stamps.dt.tz_localize(None)
+        period = stamps.dt.to_period(FREQUENCIES[time["freq"]]).rename(x_key)
+        keys = [period] + [df[c] for c in group_by]
+        if x_key not in [m["column"] for m in metrics]:
+            df = df.drop(columns=[x_key])
+        result = _aggregate(df, keys, metrics).sort_index()
+        if group_by:
+            # One series per group value, keeping the largest groups
+            wide = result[y_keys[0]].unstack(group_by[0])
+            order = wide.abs().sum().sort_values(ascending=False).index[:plan["limit"] or MAX_SERIES]
+            wide = wide[order]
+            wide.columns = [str(c) for c in wide.columns]
+            y_keys = list(wide.columns)
+            result = wide
+        result = result.iloc[-max_points:]
+        result.index = _period_labels(result.index, time["freq"])
+        result = result.rename_axis(x_key).reset_index()
+        if not group_by and plan["limit"]:
+            result = result.tail(plan["limit"])
+    elif group_by:
+        result = _aggregate(df, group_by, metrics).reset_index()
+        if len(group_by) > 1:
+            x_key = " / ".join(group_by)
+            result.insert(0, x_key, result[group_by].astype(str).agg(" / ".join, axis=1))
+            result = result.drop(columns=group_by)
+        else:
+            x_key = group_by[0]
+        by = sort["by"] if sort["by"] in result.columns else y_keys[0]
+        result = result.sort_values(by, ascending=not sort["desc"], kind="stable")
+        result = result.head(min(plan["limit"] or max_points, max_points))
+    else:
+        # No grouping: one bar per metric over the filtered rows
+        x_key = "name"
+        totals = _aggregate(df.assign(_all=0), ["_all"], metrics)
+        values = [totals[m["as"]].iloc[0] if len(totals) else (0 if m["agg"] in ("count", "nunique") else None)
+                  for m in metrics]
+        result = pd.DataFrame({"name": y_keys, "value": pd.Series(values, dtype=object)})
+        y_keys = ["value"]
+
+    if chart_type == "pie" and x_key != "name":
+        result = result[[x_key, y_keys[0]]].rename(columns={x_key: "name", y_keys[0]: "value"})
+        x_key, y_keys = "name", ["value"]
+    if x_key in result.columns and not pd.api.types.is_numeric_dtype(result[x_key]):
+        result[x_key] = result[x_key].astype(str)
+
+    return {"x_key": x_key, "y_keys": y_keys, "data": _records(result), "rows_matched": int(matched)}
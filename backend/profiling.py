@@ -0,0 +1,364 @@
+"""Column profiling that can be fed one chunk at a time and merged.
+
+By default every column is summarised with mergeable sketches (HyperLogLog
+for distinct counts, a KLL-style compactor for quantiles, space-saving for
+top values), so memory stays bounded however many rows go through. With
+``exact=True`` each column keeps full value counts instead.
+"""
+import math, os
+
+from lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+PROFILE_EXACT = os.environ.get('PROFILE_EXACT', '').lower() in ('1', 'true', 'yes')
+
+
+def _num(v, integer=False):
+    if v is None:
+        return None
+    v = float(v)
+    if math.isnan(v) or math.isinf(v):
+        return None
+    return int(v) if integer else v
+
+
+def _kind(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_numeric_dtype(dtype):
+        return 'numeric'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    return 'other'
+
+
+def _hash_values(values):
+    return pd.util.hash_array(np.asarray(values))
+
+
+def _sorted_unique(a):
+    a = np.sort(a)
+    return a[np.concatenate(([True], a[1:] != a[:-1]))] if len(a) else a
+
+
+def _clz64(x):
+    # frexp's exponent is the bit length; float rounding only matters for
+    # values within 2**-53 of a power of two
+    return (64 - np.frexp(x.astype(np.float64))[1]).astype(np.uint8)
+
+
+class HyperLogLog:
+    """Distinct counter; exact (sorted hash set) until ``2**p`` distinct
+    values have been seen, then 2**p one-byte registers."""
+
+    def __init__(self, p=14):
+        self.p = p
+        self.exact = np.empty(0, dtype=np.uint64)
+        self.registers = None
+
+    def add_hashes(self, hashes):
+        if self.registers is None:
+            if len(self.exact) + len(hashes) <= 4 << self.p:
+                self.exact = _sorted_unique(np.concatenate([self.exact, hashes]))
+                if len(self.exact) <= 1 << self.p:
+                    return
+            self._densify()
+        self._update(hashes)
+
+    def _densify(self):
+        self.registers = np.zeros(1 << self.p, dtype=np.uint8)
+        self._update(self.exact)
+        self.exact = np.empty(0, dtype=np.uint64)
+
+    def _update(self, hashes):
+        p = np.uint64(self.p)
+        idx = (hashes >> (np.uint64(64) - p)).astype(np.intp)
+        rank = np.minimum(_clz64(hashes << p) + 1, 64 - self.p + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def merge(self, other):
+        if other.registers is None:
+            self.add_hashes(other.exact)
+            return self
+        if self.registers is None:
+            self._densify()
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        if self.registers is None:
+            return len(self.exact)
+        m = float(len(self.registers))
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class QuantileSketch:
+    """KLL-style compactor stack: level ``i`` holds items of weight ``2**i``
+    and is halved into level ``i + 1`` whenever it grows past ``k`` items."""
+
+    def __init__(self, k=2048, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+        return self
+
+    def merge(self, other):
+        for i, items in enumerate(other.levels):
+            if i == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[i] = np.concatenate([self.levels[i], items])
+        self._compact()
+        return self
+
+    def _compact(self):
+        i = 0
+        while i < len(self.levels):
+            items = self.levels[i]
+            if len(items) > self.k:
+                items = np.sort(items)
+                keep = len(items) % 2
+                self.levels[i] = items[len(items) - keep:]
+                promoted = items[int(self._rng.integers(2)):len(items) - keep:2]
+                if i + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[i + 1] = np.concatenate([self.levels[i + 1], promoted])
+            i += 1
+
+    def quantile(self, q):
+        if len(self.levels) == 1:
+            return float(np.quantile(self.levels[0], q)) if len(self.levels[0]) else None
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(lv), 2.0 ** i) for i, lv in enumerate(self.levels)])
+        if not len(items):
+            return None
+        order = np.argsort(items, kind='stable')
+        cum = np.cumsum(weights[order])
+        return float(items[order][min(np.searchsorted(cum, q * cum[-1]), len(items) - 1)])
+
+
+class TopK:
+    """Space-saving summary: at most ``capacity`` tracked values, each with
+    an overestimate bound; ``floor`` is the most any untracked value could
+    have been seen."""
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype='float64')
+        self.errors = pd.Series(dtype='float64')
+        self.floor = 0.0
+
+    def update(self, vc):
+        vc = vc.astype('float64')
+        return self._merge_counts(vc, pd.Series(0.0, index=vc.index), 0.0)
+
+    def merge(self, other):
+        return self._merge_counts(other.counts, other.errors, other.floor)
+
+    def _merge_counts(self, counts, errors, floor):
+        if len(counts) > self.capacity:
+            counts = counts.sort_values(ascending=False, kind='stable')
+            floor = max(floor, counts.iloc[self.capacity])
+            counts = counts.iloc[:self.capacity]
+            errors = errors.reindex(counts.index)
+        idx = self.counts.index.union(counts.index)
+        merged = self.counts.reindex(idx, fill_value=self.floor) + counts.reindex(idx, fill_value=floor)
+        merged_err = self.errors.reindex(idx, fill_value=self.floor) + errors.reindex(idx, fill_value=floor)
+        new_floor = self.floor + floor
+        merged = merged.sort_values(ascending=False, kind='stable')
+        if len(merged) > self.capacity:
+            new_floor = max(new_floor, merged.iloc[self.capacity])
+            merged = merged.iloc[:self.capacity]
+        self.counts, self.errors, self.floor = merged, merged_err.reindex(merged.index), new_floor
+        return self
+
+    def top(self, n):
+        # Report the guaranteed count (estimate minus its error bound)
+        guaranteed = (self.counts - self.errors).sort_values(ascending=False, kind='stable')
+        return {str(k): int(v) for k, v in guaranteed.head(n).items()}
+
+
+class SketchColumn:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.distinct = HyperLogLog()
+        self.quantiles = QuantileSketch()
+        self.top = TopK()
+
+    def add_moments(self, n, mean, m2, mn, mx):
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+        self.min = mn if self.min is None else min(self.min, mn)
+        self.max = mx if self.max is None else max(self.max, mx)
+
+    def update(self, s, kind, values=None):
+        s = s.dropna()
+        if kind == 'numeric':
+            self.distinct.add_hashes(_hash_values(values))
+            self.quantiles.update(values)
+        elif kind == 'datetime':
+            # asi8 is the epoch value, also for tz-aware columns, whose
+            # to_numpy() is an object array of Timestamps
+            self.distinct.add_hashes(_hash_values(s.array.asi8))
+            if len(s):
+                self.add_moments(len(s), 0.0, 0.0, s.min(), s.max())
+        else:
+            # HLL is idempotent, so hashing the distinct keys is enough
+            vc = s.astype(str).value_counts()
+            self.distinct.add_hashes(_hash_values(vc.index.to_numpy(dtype=object)))
+            self.top.update(vc)
+
+    def merge(self, other):
+        self.add_moments(other.n, other.mean, other.m2, other.min, other.max)
+        self.distinct.merge(other.distinct)
+        self.quantiles.merge(other.quantiles)
+        self.top.merge(other.top)
+        return self
+
+    def describe(self, info, kind, integer):
+        info["unique_count"] = self.distinct.count()
+        if kind == 'numeric':
+            if self.n == 0:
+                info.update(min=None, max=None, mean=None, median=None, std=None)
+                return info
+            std = math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else None
+            info.update(min=_num(self.min, integer), max=_num(self.max, integer), mean=_num(self.mean),
+                        median=_num(self.quantiles.quantile(0.5)), std=_num(std))
+        elif kind == 'datetime':
+            info["min"] = str(self.min if self.min is not None else pd.NaT)
+            info["max"] = str(self.max if self.max is not None else pd.NaT)
+        else:
+            info["top_values"] = self.top.top(5)
+        return info
+
+
+class ExactColumn:
+    def __init__(self):
+        self.counts = None
+
+    def update(self, s, kind, values=None):
+        vc = s.value_counts(dropna=True)
+        # Categoricals also list the categories absent from this chunk
+        vc = vc[vc > 0]
+        self.counts = vc if self.counts is None else self.counts.add(vc, fill_value=0)
+
+    def merge(self, other):
+        if other.counts is not None:
+            self.counts = other.counts if self.counts is None else self.counts.add(other.counts, fill_value=0)
+        return self
+
+    def describe(self, info, kind, integer):
+        vc = self.counts if self.counts is not None else pd.Series(dtype='float64')
+        info["unique_count"] = int(len(vc))
+        if kind == 'numeric':
+            vc = vc.groupby(vc.index.astype('float64')).sum().sort_index()
+            values = vc.index.to_numpy(dtype='float64')
+            weights = vc.to_numpy(dtype='float64')
+            n = weights.sum()
+            if n == 0:
+                info.update(min=None, max=None, mean=None, median=None, std=None)
+                return info
+            mean = float((values * weights).sum() / n)
+            cum = np.cumsum(weights)
+            lo = values[np.searchsorted(cum, (n - 1) // 2 + 1)]
+            hi = values[np.searchsorted(cum, n // 2 + 1)]
+            std = math.sqrt(float((weights * (values - mean) ** 2).sum()) / (n - 1)) if n > 1 else None
+            info.update(min=_num(values[0], integer), max=_num(values[-1], integer), mean=_num(mean),
+                        median=_num((lo + hi) / 2), std=_num(std))
+        elif kind == 'datetime':
+            idx = vc.index
+            info["min"] = str(idx.min()) if len(idx) else str(pd.NaT)
+            info["max"] = str(idx.max()) if len(idx) else str(pd.NaT)
+        else:
+            if not pd.api.types.is_string_dtype(vc.index):
+                vc = vc.groupby(vc.index.astype(str)).sum()
+            top = vc.sort_values(ascending=False, kind='stable').head(5)
+            info["top_values"] = {str(k): int(v) for k, v in top.items()}
+        return info
+
+
+class ProfileAccumulator:
+    """Profiles a frame chunk by chunk. Null counts and numeric moments are
+    computed for the whole chunk at once; partial accumulators merge."""
+
+    def __init__(self, exact=PROFILE_EXACT):
+        self.exact = exact
+        self.rows = 0
+        self.nulls = {}
+        self.dtypes = {}
+        self.states = {}
+
+    def _state(self, col):
+        if col not in self.states:
+            self.states[col] = ExactColumn() if self.exact else SketchColumn()
+            self.nulls[col] = 0
+        return self.states[col]
+
+    def update(self, df):
+        self.rows += len(df)
+        nulls = df.isna().sum()
+        num_cols = [c for c in df.columns if _kind(df[c].dtype) == 'numeric']
+        block = None
+        if num_cols and not self.exact:
+            block = df[num_cols].to_numpy(dtype='float64', na_value=np.nan)
+            present = ~np.isnan(block)
+            n = present.sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sums = np.nansum(block, axis=0)
+                means = np.where(n > 0, sums / np.maximum(n, 1), 0.0)
+                m2 = np.nansum((block - means) ** 2, axis=0)
+            mins = np.where(n > 0, np.nanmin(np.where(present, block, np.inf), axis=0), np.nan)
+            maxs = np.where(n > 0, np.nanmax(np.where(present, block, -np.inf), axis=0), np.nan)
+        for col in df.columns:
+            state = self._state(col)
+            self.nulls[col] += int(nulls[col])
+            self.dtypes.setdefault(col, df[col].dtype)
+            kind = _kind(df[col].dtype)
+            values = None
+            if block is not None and kind == 'numeric':
+                j = num_cols.index(col)
+                values = block[present[:, j], j]
+                state.add_moments(int(n[j]), float(means[j]), float(m2[j]), float(mins[j]), float(maxs[j]))
+            state.update(df[col], kind, values)
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        for col, state in other.states.items():
+            self._state(col).merge(state)
+            self.nulls[col] += other.nulls[col]
+            self.dtypes.setdefault(col, other.dtypes[col])
+        return self
+
+    def finalize(self, dtypes=None):
+        dtypes = {**self.dtypes, **(dtypes or {})}
+        columns = []
+        for col, state in self.states.items():
+            dtype = dtypes[col]
+            info = {"name": col, "type": str(dtype), "null_count": int(self.nulls[col])}
+            columns.append(state.describe(info, _kind(dtype), pd.api.types.is_integer_dtype(dtype)))
+
+        date_range = None
+        date_cols = [c for c in self.states if _kind(dtypes[c]) == 'datetime']
+        if date_cols:
+            info = next(ci for ci in columns if ci["name"] == date_cols[0])
+            date_range = {"column": date_cols[0], "start": info["min"], "end": info["max"]}
+
+        quality = {"total_nulls": int(sum(self.nulls.values()))}
+        return columns, date_range, quality
@@ -0,0 +1,62 @@
+"""Client-side rate limiting and retry for calls to the OpenAI API."""
+import asyncio, random, time
+
+
+class TokenBucket:
+    """Allows ``rate`` units per second with bursts of up to ``capacity``.
+    A rate of 0 disables the limit."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        if not self.rate:
+            return
+        # A request larger than the bucket waits for a full bucket instead
+        # of forever
+        amount = min(amount, self.capacity)
+        # Waiters queue on the lock, so they are served in arrival order
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    # Full jitter: uniform in [0, min(cap, base * 2**attempt)]
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after(exc):
+    # Honour a Retry-After header (in seconds) on HTTP errors that carry one
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+async def with_retries(call, retryable, attempts=4, base=0.5, cap=30.0, on_retry=None):
+    """Awaits ``call()``, retrying with exponential backoff while
+    ``retryable(exc)`` holds and attempts remain."""
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == attempts - 1 or not retryable(e):
+                raise
+            delay = max(backoff_delay(attempt, base, cap), retry_after(e))
+            if on_retry is not None:
+                on_retry(e, attempt + 1, delay)
+            await asyncio.sleep(delay)
@@ -0,0 +1,168 @@
+"""PDF layout of the analysis reports, built with ReportLab."""
+from datetime import datetime, timezone
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors as rl_colors
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
+from reportlab.lib.units import inch
+
+from downsample import downsample_chart
+
+REPORT_TABLE_ROWS = 25
+
+
+def report_styles():
+    styles = getSampleStyleSheet()
+    return {
+        "title": ParagraphStyle('Title2', parent=styles['Title'], fontSize=22, textColor=rl_colors.HexColor('#0284C7'), spaceAfter=20),
+        "heading": ParagraphStyle('H2', parent=styles['Heading2'], fontSize=13, textColor=rl_colors.HexColor('#0369A1'), spaceBefore=14, spaceAfter=8),
+        "body": ParagraphStyle('Body2', parent=styles['Normal'], fontSize=10, textColor=rl_colors.HexColor('#1E293B'), leading=14),
+        "insight": ParagraphStyle('Insight2', parent=styles['Normal'], fontSize=11, textColor=rl_colors.HexColor('#0F172A'), backColor=rl_colors.HexColor('#E0F2FE'), borderPadding=10, leading=16),
+        "meta": ParagraphStyle('Meta', parent=styles['Normal'], fontSize=9, textColor=rl_colors.HexColor('#64748B')),
+    }
+
+
+def _new_document(path):
+    return SimpleDocTemplate(str(path), pagesize=A4, topMargin=0.75*inch, bottomMargin=0.75*inch, leftMargin=0.75*inch, rightMargin=0.75*inch)
+
+
+def header_flowables(title, s):
+    yield Paragraph(title, s["title"])
+    yield Paragraph(f"Generated: {datetime.now(timezone.utc).strftime('%B %d, %Y at %H:%M UTC')}", s["meta"])
+    yield Spacer(1, 20)
+
+
+def session_flowables(session, s):
+    yield Paragraph("Data Overview", s["heading"])
+    yield Paragraph(f"<b>File:</b> {session['filename'] or 'N/A'}", s["body"])
+    yield Paragraph(f"<b>Dimensions:</b> {session['row_count'] or 0} rows x {session['column_count'] or 0} columns", s["body"])
+    dr = session['date_range']
+    if dr:
+        yield Paragraph(f"<b>Date Range:</b> {dr.get('start', '')} to {dr.get('end', '')}", s["body"])
+    yield Spacer(1, 10)
+
+
+def findings_flowables(resp, s):
+    yield Paragraph("Analysis Findings", s["heading"])
+    for i, finding in enumerate(resp.get("analysis_summary", []), 1):
+        yield Paragraph(f"{i}. {finding}", s["body"])
+    yield Spacer(1, 10)
+
+    viz = resp.get("visualization", {})
+    if viz.get("data"):
+        yield Paragraph(f"Visualization: {viz.get('title', 'Chart')}", s["heading"])
+        yield Paragraph(f"<i>Chart Type: {viz.get('chart_type', 'bar')} - {viz.get('reason', '')}</i>", s["meta"])
+        # Series are sampled across their whole range, other charts keep
+        # their first (largest) rows
+        chart_data = downsample_chart(viz, REPORT_TABLE_ROWS)["data"][:REPORT_TABLE_ROWS]
+        if chart_data and len(chart_data) > 0:
+            headers = list(chart_data[0].keys())
+            tdata = [headers] + [[str(row.get(h, ''))[:30] for h in headers] for row in chart_data]
+            t = Table(tdata, repeatRows=1)
+            t.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), rl_colors.HexColor('#0284C7')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), rl_colors.white),
+                ('FONTSIZE', (0, 0), (-1, -1), 8),
+                ('GRID', (0, 0), (-1, -1), 0.5, rl_colors.HexColor('#CBD5E1')),
+                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [rl_colors.HexColor('#F8FAFC'), rl_colors.white]),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ]))
+            yield t
+        yield Spacer(1, 10)
+
+    forecast = resp.get("forecast", {})
+    if forecast.get("available"):
+        yield Paragraph("Forecast", s["heading"])
+        yield Paragraph(f"<b>Horizon:</b> {forecast.get('time_horizon', 'N/A')} | <b>Confidence:</b> {forecast.get('confidence', 'N/A')}", s["body"])
+        if forecast.get("data"):
+            fh = ["Period", "Forecast", "Lower", "Upper"]
+            fd = [fh] + [[str(fp.get("period", "")), str(fp.get("value", "")), str(fp.get("lower", "")), str(fp.get("upper", ""))] for fp in forecast["data"]]
+            ft = Table(fd, repeatRows=1)
+            ft.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), rl_colors.HexColor('#059669')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), rl_colors.white),
+                ('FONTSIZE', (0, 0), (-1, -1), 8),
+                ('GRID', (0, 0), (-1, -1), 0.5, rl_colors.HexColor('#CBD5E1')),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ]))
+            yield ft
+        if forecast.get("signals"):
+            yield Spacer(1, 5)
+            yield Paragraph("<b>External Signals Applied:</b>", s["body"])
+            for sig in forecast["signals"]:
+                impact_color = '#059669' if sig.get('impact') == 'positive' else '#DC2626' if sig.get('impact') == 'negative' else '#64748B'
+                yield Paragraph(f"<font color='{impact_color}'>{sig.get('name', '')}</font>: {sig.get('value', '')} - <i>{sig.get('source', '')}</i>", s["body"])
+        yield Spacer(1, 10)
+
+    yield Paragraph("Agent Insight", s["heading"])
+    yield Paragraph(resp.get("agent_insight", "N/A"), s["insight"])
+    yield Spacer(1, 10)
+
+    if resp.get("recommendations"):
+        yield Paragraph("Recommendations", s["heading"])
+        for i, rec in enumerate(resp.get("recommendations", []), 1):
+            yield Paragraph(f"{i}. {rec}", s["body"])
+
+
+def report_flowables(query_text, resp, session, s):
+    yield from header_flowables("AI Data Analyst Report", s)
+    yield Paragraph("Executive Summary", s["heading"])
+    yield Paragraph(f"<b>Query:</b> {resp.get('query_understood', query_text or '')}", s["body"])
+    yield Paragraph(f"<b>Analysis Type:</b> {resp.get('analysis_type', 'N/A').title()}", s["body"])
+    yield Spacer(1, 10)
+    if session:
+        yield from session_flowables(session, s)
+    yield from findings_flowables(resp, s)
+
+
+def session_report_flowables(session, queries, s):
+    yield from header_flowables("AI Data Analyst Session Report", s)
+    if session:
+        yield from session_flowables(session, s)
+    for i, (query_text, resp) in enumerate(queries, 1):
+        yield PageBreak()
+        yield Paragraph(f"Query {i}: {resp.get('query_understood', query_text or '')}", s["heading"])
+        yield Paragraph(f"<b>Analysis Type:</b> {resp.get('analysis_type', 'N/A').title()}", s["body"])
+        yield Spacer(1, 10)
+        yield from findings_flowables(resp or {}, s)
+
+
+class LazyStory(list):
+    """A story list that ReportLab drains from the front while it is topped
+    up from a generator, so only a few flowables exist at any time."""
+
+    def __init__(self, flowables, lookahead=32):
+        super().__init__()
+        self._source = iter(flowables)
+        self._lookahead = lookahead
+        self._fill()
+
+    def _fill(self):
+        while self._source is not None and list.__len__(self) < self._lookahead:
+            try:
+                list.append(self, next(self._source))
+            except StopIteration:
+                self._source = None
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self._fill()
+        return list.__getitem__(self, index)
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._fill()
+
+
+def render_report_pdf(path, query_text, resp, session):
+    s = report_styles()
+    _new_document(path).build(LazyStory(report_flowables(query_text, resp, session, s)))
+
+
+def render_session_report_pdf(path, session, queries):
+    s = report_styles()
+    _new_document(path).build(LazyStory(session_report_flowables(session, queries, s)))
@@ -0,0 +1,56 @@
+"""PDF report rendering and the on-disk cache of rendered reports."""
+from pathlib import Path
+import hashlib, json, os, uuid
+
+# Bump when the layout changes so cached PDFs are rendered again
+REPORT_VERSION = "2"
+
+
+def report_digest(*parts):
+    payload = json.dumps([REPORT_VERSION, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def render_report_pdf(path, query_text, resp, session):
+    # ReportLab is imported by the first render rather than at startup
+    import report_pdf
+    report_pdf.render_report_pdf(path, query_text, resp, session)
+
+
+def render_session_report_pdf(path, session, queries):
+    import report_pdf
+    report_pdf.render_session_report_pdf(path, session, queries)
+
+
+class ReportCache:
+    """Rendered PDFs on disk, one file per ``<key>-<digest>.pdf``; storing a
+    new digest for a key removes the older files."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key, digest):
+        return self.root / f"{key}-{digest}.pdf"
+
+    def get(self, key, digest):
+        path = self.path_for(key, digest)
+        return path if path.exists() else None
+
+    def put(self, key, digest, render, *args):
+        path = self.path_for(key, digest)
+        tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            render(tmp, *args)
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        for old in self.root.glob(f"{key}-*.pdf"):
+            if old != path:
+                old.unlink(missing_ok=True)
+        return path
+
+    def delete(self, key):
+        for path in self.root.glob(f"{key}-*.pdf"):
+            path.unlink(missing_ok=True)
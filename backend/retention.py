@@ -0,0 +1,92 @@
+"""Session retention: expiry after a TTL, a storage quota enforced by evicting
+the least recently used sessions, and moving idle datasets to cold storage."""
+from collections import Counter
+from datetime import timedelta
+
+
+class RetentionPolicy:
+    """``ttl`` and ``cold_after`` are in seconds, the quotas in bytes; 0
+    turns a rule off. ``hot_quota`` caps the uncompressed datasets, moving
+    the least recently used ones to cold storage; ``quota`` caps hot and
+    cold storage together, deleting the least recently used sessions."""
+
+    def __init__(self, ttl=0, cold_after=0, hot_quota=0, quota=0):
+        self.ttl = ttl
+        self.cold_after = cold_after
+        self.hot_quota = hot_quota
+        self.quota = quota
+
+    def to_dict(self):
+        return {"ttl_seconds": self.ttl, "cold_after_seconds": self.cold_after,
+                "hot_quota_bytes": self.hot_quota, "quota_bytes": self.quota}
+
+
+class StorageTally:
+    """Hot and cold bytes across sessions. Hard-linked files (identical
+    uploads) are counted once and only freed with their last session."""
+
+    def __init__(self, usage):
+        self.usage = usage
+        self.refs = Counter(file_id for hot, _ in usage.values() for file_id, _ in hot)
+        sizes = {file_id: size for hot, _ in usage.values() for file_id, size in hot}
+        self.hot_bytes = sum(sizes.values())
+        self.cold_bytes = sum(cold for _, cold in usage.values())
+
+    @property
+    def total_bytes(self):
+        return self.hot_bytes + self.cold_bytes
+
+    def drop_hot(self, session_id):
+        hot, _ = self.usage[session_id]
+        for file_id, size in hot:
+            self.refs[file_id] -= 1
+            if self.refs[file_id] == 0:
+                self.hot_bytes -= size
+        self.usage[session_id] = ([], self.usage[session_id][1])
+
+    def remove(self, session_id):
+        self.drop_hot(session_id)
+        self.cold_bytes -= self.usage.pop(session_id)[1]
+
+
+def plan_retention(sessions, usage, policy, now):
+    """Decides what a retention pass does. ``sessions`` holds ``(id,
+    last_used)`` pairs, ``usage`` maps ids to ``DatasetStore.usage``.
+    Returns ``(expire, evict, freeze)`` lists of session ids. The most
+    recently used session is never evicted or frozen for a quota."""
+    sessions = sorted(sessions, key=lambda s: s[1])
+    tally = StorageTally({sid: usage.get(sid, ([], 0)) for sid, _ in sessions})
+    expire, evict, freeze = [], [], []
+
+    if policy.ttl:
+        cutoff = now - timedelta(seconds=policy.ttl)
+        expire = [sid for sid, last_used in sessions if last_used < cutoff]
+        for sid in expire:
+            tally.remove(sid)
+        sessions = [s for s in sessions if s[1] >= cutoff]
+
+    # Least recently used first, keeping the newest
+    candidates = [sid for sid, _ in sessions[:-1]]
+    if policy.quota:
+        while candidates and tally.total_bytes > policy.quota:
+            sid = candidates.pop(0)
+            evict.append(sid)
+            tally.remove(sid)
+
+    def is_hot(sid):
+        return bool(tally.usage[sid][0])
+
+    if policy.cold_after:
+        cutoff = now - timedelta(seconds=policy.cold_after)
+        for sid, last_used in sessions:
+            if sid not in evict and last_used < cutoff and is_hot(sid):
+                freeze.append(sid)
+                tally.drop_hot(sid)
+    if policy.hot_quota:
+        for sid in candidates:
+            if tally.hot_bytes <= policy.hot_quota:
+                break
+            if is_hot(sid):
+                freeze.append(sid)
+                tally.drop_hot(sid)
+    return expire, evict, freeze
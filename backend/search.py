@@ -0,0 +1,176 @@
+"""Full-text search over stored analyses: the query text, ``agent_insight``
+and ``analysis_summary``.
+
+SQLite keeps an FTS5 index over a side table filled by triggers on
+query_records. The side table has its own integer key because VACUUM may
+renumber the implicit rowids of query_records. Postgres uses a generated,
+weighted tsvector column with a GIN index. Results are ranked (BM25 or
+ts_rank_cd) and paged with a keyset cursor on ``(score, key)``, where a
+lower score is a better match.
+"""
+import re
+
+from sqlalchemy import DateTime, text
+
+SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS = "<mark>", "</mark>", "…"
+SNIPPET_TOKENS = 16
+# Relative weight of a hit in the query text, the insight and the summary
+BM25_WEIGHTS = (3.0, 2.0, 1.0)
+TS_CONFIG = "english"
+
+SQLITE_SETUP = [
+    """CREATE TABLE IF NOT EXISTS query_search (
+        docid INTEGER PRIMARY KEY,
+        id VARCHAR NOT NULL UNIQUE,
+        query TEXT,
+        insight TEXT,
+        summary TEXT
+    )""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS query_search_fts USING fts5(
+        query, insight, summary, content='query_search', content_rowid='docid', tokenize='porter unicode61'
+    )""",
+    # Keep the external-content index in step with query_search
+    """CREATE TRIGGER IF NOT EXISTS query_search_ai AFTER INSERT ON query_search BEGIN
+        INSERT INTO query_search_fts(rowid, query, insight, summary) VALUES (new.docid, new.query, new.insight, new.summary);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS query_search_ad AFTER DELETE ON query_search BEGIN
+        INSERT INTO query_search_fts(query_search_fts, rowid, query, insight, summary)
+        VALUES ('delete', old.docid, old.query, old.insight, old.summary);
+    END""",
+    # ...and query_search in step with query_records
+    """CREATE TRIGGER IF NOT EXISTS query_records_search_ai AFTER INSERT ON query_records BEGIN
+        INSERT INTO query_search(id, query, insight, summary) SELECT {document};
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS query_records_search_ad AFTER DELETE ON query_records BEGIN
+        DELETE FROM query_search WHERE id = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS query_records_search_au AFTER UPDATE OF query, response ON query_records BEGIN
+        DELETE FROM query_search WHERE id = old.id;
+        INSERT INTO query_search(id, query, insight, summary) SELECT {document};
+    END""",
+]
+# The searchable fields of a query_records row ``r``
+SQLITE_DOCUMENT = """{r}.id, {r}.query,
+    CASE WHEN json_valid({r}.response) THEN json_extract({r}.response, '$.agent_insight') END,
+    CASE WHEN json_valid({r}.response)
+         THEN (SELECT group_concat(value, ' ') FROM json_each({r}.response, '$.analysis_summary')) END"""
+
+POSTGRES_SETUP = [
+    f"""ALTER TABLE query_records ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('{TS_CONFIG}', coalesce(query, '')), 'A') ||
+        setweight(to_tsvector('{TS_CONFIG}', coalesce(response->>'agent_insight', '')), 'B') ||
+        setweight(to_tsvector('{TS_CONFIG}', coalesce((response->'analysis_summary')::text, '')), 'C')
+    ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_query_records_search ON query_records USING GIN (search_vector)",
+]
+
+
+class SearchError(ValueError):
+    pass
+
+
+def init_search(engine):
+    """Creates the search index, indexing existing rows the first time."""
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'query_search'")).first()
+            for statement in SQLITE_SETUP:
+                conn.execute(text(statement.format(document=SQLITE_DOCUMENT.format(r="new"))))
+            if not exists:
+                conn.execute(text("INSERT INTO query_search(id, query, insight, summary) SELECT "
+                                  + SQLITE_DOCUMENT.format(r="r") + " FROM query_records r"))
+        elif engine.dialect.name == "postgresql":
+            for statement in POSTGRES_SETUP:
+                conn.execute(text(statement))
+
+
+def fts5_match(terms):
+    # Each word becomes a quoted FTS5 string, so user input cannot use the
+    # query syntax; the last word also matches as a prefix
+    words = re.findall(r"\w+", terms)
+    if not words:
+        return None
+    quoted = ['"' + w.replace('"', '""') + '"' for w in words]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _search_sqlite(conn, terms, session_id, limit, after):
+    match = fts5_match(terms)
+    if match is None:
+        raise SearchError("Search text has no words")
+    params = {"match": match, "weights": "bm25({}, {}, {})".format(*BM25_WEIGHTS), "limit": limit,
+              "start": SNIPPET_START, "end": SNIPPET_END, "ellipsis": SNIPPET_ELLIPSIS, "tokens": SNIPPET_TOKENS}
+    where = ["query_search_fts MATCH :match", "query_search_fts.rank MATCH :weights"]
+    scope = ""
+    if session_id:
+        scope = "JOIN query_search s ON s.docid = query_search_fts.rowid JOIN query_records r ON r.id = s.id"
+        where.append("r.session_id = :session_id")
+        params["session_id"] = session_id
+    if after:
+        where.append("(query_search_fts.rank > :score OR (query_search_fts.rank = :score AND query_search_fts.rowid > :key))")
+        params.update(score=after["s"], key=after["k"])
+    # Rank inside the index first; the joins and snippets then only touch
+    # the page returned
+    sql = f"""
+        WITH hits AS (
+            SELECT query_search_fts.rowid AS key, query_search_fts.rank AS score
+            FROM query_search_fts {scope}
+            WHERE {' AND '.join(where)}
+            ORDER BY query_search_fts.rank, query_search_fts.rowid
+            LIMIT :limit
+        )
+        SELECT s.id, r.session_id, r.timestamp, h.score, h.key,
+               snippet(query_search_fts, -1, :start, :end, :ellipsis, :tokens) AS snippet
+        FROM hits h
+        JOIN query_search_fts ON query_search_fts.rowid = h.key
+        JOIN query_search s ON s.docid = h.key
+        JOIN query_records r ON r.id = s.id
+        WHERE query_search_fts MATCH :match
+        ORDER BY h.score, h.key"""
+    return conn.execute(text(sql).columns(timestamp=DateTime), params).mappings().all()
+
+
+def _search_postgres(conn, terms, session_id, limit, after):
+    if not re.search(r"\w", terms):
+        raise SearchError("Search text has no words")
+    params = {"terms": terms, "limit": limit,
+              "options": f"StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, FragmentDelimiter={SNIPPET_ELLIPSIS}, "
+                         f"MaxWords={SNIPPET_TOKENS}, MinWords={SNIPPET_TOKENS // 3}, MaxFragments=2"}
+    where = ["r.search_vector @@ tsq"]
+    if session_id:
+        where.append("r.session_id = :session_id")
+        params["session_id"] = session_id
+    if after:
+        where.append("(-ts_rank_cd(r.search_vector, tsq), r.id) > (:score, :key)")
+        params.update(score=after["s"], key=after["k"])
+    # Headlines are costly, so they are only built for the page returned
+    sql = f"""
+        WITH hits AS (
+            SELECT r.id, r.session_id, r.timestamp, -ts_rank_cd(r.search_vector, tsq) AS score, r.id AS key
+            FROM query_records r, websearch_to_tsquery('{TS_CONFIG}', :terms) tsq
+            WHERE {' AND '.join(where)}
+            ORDER BY score, r.id
+            LIMIT :limit
+        )
+        SELECT h.id, h.session_id, h.timestamp, h.score, h.key,
+               ts_headline('{TS_CONFIG}', concat_ws(' ', r.query, r.response->>'agent_insight',
+                   CASE json_typeof(r.response->'analysis_summary')
+                       WHEN 'array' THEN (SELECT string_agg(value, ' ') FROM json_array_elements_text(r.response->'analysis_summary'))
+                       ELSE r.response->>'analysis_summary' END),
+                   websearch_to_tsquery('{TS_CONFIG}', :terms), :options) AS snippet
+        FROM hits h JOIN query_records r ON r.id = h.id
+        ORDER BY h.score, h.key"""
+    return conn.execute(text(sql).columns(timestamp=DateTime), params).mappings().all()
+
+
+def search_queries(conn, dialect, terms, session_id=None, limit=20, after=None):
+    """Returns up to ``limit`` matches, best first, each with ``id``,
+    ``session_id``, ``timestamp``, ``snippet``, ``score`` and ``key``;
+    ``after`` is the ``{"s": score, "k": key}`` of the previous page's last
+    match."""
+    if dialect == "sqlite":
+        return _search_sqlite(conn, terms, session_id, limit, after)
+    if dialect == "postgresql":
+        return _search_postgres(conn, terms, session_id, limit, after)
+    raise SearchError(f"Full-text search is not available on {dialect}")
@@ -1,24 +1,42 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Query, Request, Depends
+from fastapi.responses import StreamingResponse, Response, FileResponse, PlainTextResponse, JSONResponse
 from starlette.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, Text, JSON
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, insert, inspect, text, cast, Column, String, Integer, DateTime, Text, JSON, Index, and_, or_
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, deferred, Session
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from typing import List, Optional
 from pathlib import Path
-from datetime import datetime, timezone
-import os, uuid, json, io, logging, math, re
-import pandas as pd
-import numpy as np
-from openai import OpenAI
-
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors as rl_colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.units import inch
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from collections import Counter
+from functools import partial
+import os, uuid, json, io, logging, math, re, asyncio, hashlib, importlib, time
+
+from lazy import LazyModule
+from storage import DatasetStore
+from profiling import ProfileAccumulator
+from cache import TTLCache
+from context import build_data_context, estimate_tokens
+from plans import PlanError, validate_plan, execute_plan
+from downsample import downsample_chart
+from paging import MAX_PAGE_ROWS, PageError, encode_token, decode_token, parse_filters, select_rows, iter_pages
+from reports import ReportCache, report_digest, render_report_pdf, render_session_report_pdf
+from ratelimit import TokenBucket, with_retries
+from metrics import REGISTRY, StageTimer, PAYLOAD_BYTES, ROWS_INGESTED, LLM_REQUESTS, CACHE_REQUESTS, RETENTION_SESSIONS, record_usage
+from retention import RetentionPolicy, plan_retention
+from search import SearchError, init_search, search_queries
+from jobs import JobRegistry, JobCancelled, TERMINAL
+from streaming import SectionParser, iter_sections, sse_event
+from ingestion import (UPLOAD_CHUNK_ROWS, spool_upload, read_chunks, infer_column_types, apply_column_types, settle_column_types, conform_chunk,
+                       compact_frame, memory_bytes, row_hashes, RowDeduper, SchemaMismatch)
+
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+pa = LazyModule('pyarrow')
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -28,17 +46,66 @@ DATABASE_URL = os.environ.get('DATABASE_URL')
 if not DATABASE_URL:
     # Default to SQLite for easy local development
     DATABASE_URL = f"sqlite:///{ROOT_DIR}/data_analyst.db"
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DATABASE_URL)
+IS_SQLITE = DATABASE_URL.startswith('sqlite')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+engine_args = {"pool_pre_ping": True}
+if ':memory:' not in DATABASE_URL:
+    engine_args.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+if IS_SQLITE:
+    engine_args["connect_args"] = {"check_same_thread": False}
+engine = create_engine(DATABASE_URL, **engine_args)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run alongside the single writer
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Dataset payloads live on disk as Arrow IPC files keyed by session id,
+# idle ones as compressed copies in the cold directory
+DATASET_DIR = Path(os.environ.get('DATASET_DIR', ROOT_DIR / 'datasets'))
+DATASET_COLD_DIR = os.environ.get('DATASET_COLD_DIR') or DATASET_DIR / 'cold'
+dataset_store = DatasetStore(DATASET_DIR, DATASET_COLD_DIR)
+REPORT_DIR = Path(os.environ.get('REPORT_DIR', ROOT_DIR / 'reports'))
+report_cache = ReportCache(REPORT_DIR)
+REPORT_PRERENDER = os.environ.get('REPORT_PRERENDER', 'true').lower() in ('1', 'true', 'yes')
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+# Schema setup runs at startup unless a deploy step has already done it
+SCHEMA_SETUP = os.environ.get('SCHEMA_SETUP', 'true').lower() in ('1', 'true', 'yes')
+# Import the data libraries, the OpenAI SDK and ReportLab in the background after startup
+WARMUP = os.environ.get('WARMUP', 'true').lower() in ('1', 'true', 'yes')
+
+# Retention, run every RETENTION_INTERVAL seconds (0 disables it); see
+# retention.RetentionPolicy. Database compaction runs every COMPACT_INTERVAL.
+retention_policy = RetentionPolicy(
+    ttl=int(os.environ.get('SESSION_TTL', 0)),
+    cold_after=int(os.environ.get('DATASET_COLD_AFTER', 7 * 24 * 3600)),
+    hot_quota=int(os.environ.get('DATASET_HOT_QUOTA_BYTES', 0)),
+    quota=int(os.environ.get('STORAGE_QUOTA_BYTES', 0)),
+)
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))
+COMPACT_INTERVAL = int(os.environ.get('COMPACT_INTERVAL', 24 * 3600))
+# Last-access times are written at most this often per session
+ACCESS_TOUCH_SECONDS = 60
+
 
 # SQLAlchemy Models
 class FileSession(Base):
     __tablename__ = "file_sessions"
-    
+    __table_args__ = (Index("ix_file_sessions_uploaded_at", "uploaded_at", "id"),)
+
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     filename = Column(String, nullable=False)
     uploaded_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -47,23 +114,99 @@ class FileSession(Base):
     columns = Column(JSON, nullable=False)
     date_range = Column(JSON, nullable=True)
     data_quality = Column(JSON, nullable=True)
-    data = Column(JSON, nullable=False)
+    # "<ext>-<sha256>" of the uploaded file while the dataset still matches
+    # it; identical uploads reuse the stored dataset and profile
+    content_hash = Column(String, nullable=True, index=True)
+    # Last time the rows were opened, for expiry and LRU eviction
+    last_accessed_at = Column(DateTime, nullable=True, index=True)
+    # Legacy inline payload, moved into dataset_store on first use; deferred
+    # so metadata queries never load it
+    data = deferred(Column(JSON, nullable=True))
 
 
 class QueryRecord(Base):
     __tablename__ = "query_records"
-    
+    __table_args__ = (Index("ix_query_records_session_timestamp", "session_id", "timestamp"),)
+
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    session_id = Column(String, nullable=False, index=True)
+    session_id = Column(String, nullable=False)
     query = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     response = Column(JSON, nullable=True)
 
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+class LLMCacheEntry(Base):
+    __tablename__ = "llm_cache"
+
+    key = Column(String, primary_key=True)
+    session_id = Column(String, nullable=False, index=True)
+    response = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+def init_schema():
+    """Creates missing tables, columns and indexes. Runs from the lifespan
+    hook, or as a deploy step (``python -c "import server; server.init_schema()"``)
+    with SCHEMA_SETUP=false."""
+    Base.metadata.create_all(bind=engine)
+    # ...and the columns added since, which create_all does not do either
+    existing = {c["name"] for c in inspect(engine).get_columns("file_sessions")}
+    for name in ("content_hash", "last_accessed_at"):
+        if name not in existing:
+            ddl = FileSession.__table__.c[name].type.compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE file_sessions ADD COLUMN {name} {ddl}"))
+    # create_all skips the indexes of tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    init_search(engine)
+
+
+# Modules left out of the import path so a replica starts serving sooner
+WARMUP_MODULES = ("numpy", "pandas", "pyarrow", "pyarrow.compute", "openai", "report_pdf")
+startup = {"schema": False, "warm": False, "warmup_task": None}
+
+
+def import_deferred_modules():
+    for name in WARMUP_MODULES:
+        importlib.import_module(name)
+
+
+async def warm_up():
+    started = time.perf_counter()
+    try:
+        await run_in_threadpool(import_deferred_modules)
+        startup["warm"] = True
+        logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+
+
+def start_warm_up():
+    task = startup["warmup_task"]
+    if task is None or (task.done() and not startup["warm"]):
+        startup["warmup_task"] = spawn(warm_up())
+    return startup["warmup_task"]
+
 
-app = FastAPI(title="AI Data Analyst Agent", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app):
+    if SCHEMA_SETUP:
+        await run_in_threadpool(init_schema)
+    startup["schema"] = True
+    if WARMUP:
+        start_warm_up()
+    scheduler = spawn(retention_loop()) if RETENTION_INTERVAL else None
+    yield
+    if scheduler is not None:
+        scheduler.cancel()
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+    upload_jobs.shutdown()
+
+
+app = FastAPI(title="AI Data Analyst Agent", version="1.0.0", lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -78,16 +221,81 @@ def get_openai_client():
         api_key = os.environ.get('OPENAI_API_KEY')
         if not api_key:
             raise HTTPException(status_code=500, detail="OPENAI_API_KEY not configured")
-        openai_client = OpenAI(api_key=api_key)
+        from openai import AsyncOpenAI
+        # Retries are handled by llm_create so they share the rate limiter
+        openai_client = AsyncOpenAI(api_key=api_key, max_retries=0)
     return openai_client
 
 
+# Worker pool for CPU-bound steps (parsing, profiling, prompt and PDF
+# rendering); DB calls use Starlette's threadpool instead.
+WORKER_POOL = os.environ.get('WORKER_POOL', 'thread')
+WORKER_POOL_SIZE = int(os.environ.get('WORKER_POOL_SIZE', min(32, (os.cpu_count() or 1) + 4)))
+executor = None
+def get_executor():
+    global executor
+    if executor is None:
+        if WORKER_POOL == 'process':
+            executor = ProcessPoolExecutor(max_workers=WORKER_POOL_SIZE)
+        else:
+            executor = ThreadPoolExecutor(max_workers=WORKER_POOL_SIZE, thread_name_prefix='worker')
+    return executor
+
+
+async def run_blocking(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(fn, *args))
+
+
+async def run_to_completion(awaitable):
+    # Work handed to a thread keeps running when the awaiting task is
+    # cancelled; wait for it, so cleanup runs after it and not before
+    future = asyncio.ensure_future(awaitable)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
+
+
+background_tasks = set()
+def spawn(coro):
+    # Keep a reference so fire-and-forget tasks are not garbage collected
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+# Per-resource concurrency limits
+limits = {
+    "llm": asyncio.Semaphore(int(os.environ.get('LLM_CONCURRENCY', 16))),
+    "upload": asyncio.Semaphore(int(os.environ.get('UPLOAD_CONCURRENCY', 4))),
+    "report": asyncio.Semaphore(int(os.environ.get('REPORT_CONCURRENCY', 4))),
+}
+
+
+# Client-side limits on OpenAI calls: requests and prompt tokens per minute
+# (0 disables either) and retries of rate-limited or failed calls
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get('LLM_REQUESTS_PER_MINUTE', 500))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get('LLM_TOKENS_PER_MINUTE', 0))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 3))
+llm_request_bucket = TokenBucket(LLM_REQUESTS_PER_MINUTE / 60, LLM_REQUESTS_PER_MINUTE / 60 * 5)
+llm_token_bucket = TokenBucket(LLM_TOKENS_PER_MINUTE / 60, LLM_TOKENS_PER_MINUTE)
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', 50))
+
+
 # --- Pydantic Models ---
 class QueryRequest(BaseModel):
     session_id: str
     query: str
 
 
+class BatchQueryRequest(BaseModel):
+    session_id: str
+    queries: List[str]
+
+
 # --- Helpers ---
 def clean_val(obj):
     if isinstance(obj, (np.integer,)):
@@ -111,38 +319,8 @@ def clean_val(obj):
 
 
 def profile_dataframe(df):
-    columns = []
-    for col in df.columns:
-        info = {
-            "name": col,
-            "type": str(df[col].dtype),
-            "null_count": int(df[col].isnull().sum()),
-            "unique_count": int(df[col].nunique()),
-        }
-        if pd.api.types.is_numeric_dtype(df[col]):
-            info["min"] = clean_val(df[col].min())
-            info["max"] = clean_val(df[col].max())
-            info["mean"] = clean_val(df[col].mean())
-            info["median"] = clean_val(df[col].median())
-            info["std"] = clean_val(df[col].std())
-        elif pd.api.types.is_datetime64_any_dtype(df[col]):
-            info["min"] = str(df[col].min())
-            info["max"] = str(df[col].max())
-        else:
-            top = df[col].value_counts().head(5).to_dict()
-            info["top_values"] = {str(k): int(v) for k, v in top.items()}
-        columns.append(info)
-
-    date_range = None
-    date_cols = df.select_dtypes(include=['datetime64']).columns
-    if len(date_cols) > 0:
-        dc = date_cols[0]
-        date_range = {"column": dc, "start": str(df[dc].min()), "end": str(df[dc].max())}
-
-    quality = {
-        "total_nulls": int(df.isnull().sum().sum()),
-        "duplicates_found": int(df.duplicated().sum())
-    }
+    columns, date_range, quality = ProfileAccumulator().update(df).finalize()
+    quality["duplicates_found"] = int(pd.util.hash_pandas_object(df, index=False).duplicated().sum())
     return columns, date_range, quality
 
 
@@ -156,6 +334,152 @@ def df_to_records(df, max_rows=5000):
     return [{k: clean_val(v) for k, v in r.items()} for r in records]
 
 
+def as_utc(value):
+    # SQLite hands DateTime columns back without a timezone
+    return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
+
+def open_session_payload(db, session):
+    """Makes the session's rows readable: brings a frozen dataset back from
+    cold storage or moves a legacy inline payload to disk, and records the
+    access for retention."""
+    now = datetime.now(timezone.utc)
+    last = as_utc(session.last_accessed_at)
+    if last is None or (now - last).total_seconds() > ACCESS_TOUCH_SECONDS:
+        db.query(FileSession).filter(FileSession.id == session.id).update({"last_accessed_at": now}, synchronize_session=False)
+        db.commit()
+    if dataset_store.thaw(session.id):
+        RETENTION_SESSIONS.inc(action="rehydrated")
+    migrate_legacy_payload(db, session)
+
+
+def migrate_legacy_payload(db, session):
+    # Sessions created before dataset_store kept their rows inline; move
+    # them to an Arrow file the first time the rows are needed
+    if dataset_store.exists(session.id):
+        return
+    df = pd.DataFrame(db.query(FileSession.data).filter(FileSession.id == session.id).scalar() or [])
+    for ci in session.columns or []:
+        if ci["name"] in df.columns and "datetime" in str(ci.get("type", "")):
+            df[ci["name"]] = pd.to_datetime(df[ci["name"]], errors="coerce")
+    dataset_store.save(session.id, df)
+    db.query(FileSession).filter(FileSession.id == session.id).update({"data": None}, synchronize_session=False)
+    db.commit()
+
+
+class MemoryTally:
+    """Runs the compaction stage and adds up the in-memory size of the rows
+    kept, with pandas' default parse dtypes and with the compact ones."""
+
+    def __init__(self):
+        self.default_bytes = 0
+        self.compact_bytes = 0
+
+    def compact(self, raw, chunk):
+        # The raw chunk still holds rows the dedup step dropped
+        if len(raw):
+            self.default_bytes += round(memory_bytes(raw) * len(chunk) / len(raw))
+        chunk = compact_frame(chunk)
+        self.compact_bytes += memory_bytes(chunk)
+        return chunk
+
+    def report(self, quality=None):
+        default = (quality or {}).get("memory_default_bytes", 0) + self.default_bytes
+        compact = (quality or {}).get("memory_compact_bytes", 0) + self.compact_bytes
+        return {"memory_default_bytes": default, "memory_compact_bytes": compact, "memory_saved_bytes": default - compact}
+
+
+def ingest_upload(path, ext, session_id, progress=None):
+    # ``progress(stage, rows)`` reports to an upload job and raises
+    # JobCancelled to stop it; the writer then discards the partial file
+    progress = progress or (lambda stage, rows=None: None)
+    timer = StageTimer()
+    deduper = RowDeduper()
+    profiler = ProfileAccumulator()
+    memory = MemoryTally()
+    types = None
+    coerced = Counter()
+    with dataset_store.writer(session_id) as writer:
+        for raw in timer.iterate("parse", read_chunks(path, ext)):
+            if types is None:
+                with timer.stage("infer"):
+                    types = infer_column_types(raw)
+                with timer.stage("convert"):
+                    chunk, types = settle_column_types(raw, types)
+            else:
+                with timer.stage("convert"):
+                    chunk, failed = apply_column_types(raw, types)
+                coerced.update(failed)
+            with timer.stage("dedup"):
+                chunk = deduper.filter(chunk)
+            with timer.stage("compact"):
+                chunk = memory.compact(raw, chunk)
+            with timer.stage("profile"):
+                profiler.update(chunk)
+            with timer.stage("write"):
+                writer.write(chunk)
+            progress("parsing", profiler.rows)
+        progress("profiling")
+    with timer.stage("profile"):
+        dtypes = writer.schema.empty_table().to_pandas().dtypes.to_dict()
+        columns_info, date_range, quality = profiler.finalize(dtypes)
+    quality["duplicates_found"] = 0
+    quality["duplicates_removed"] = deduper.removed
+    # Values of later chunks that did not fit the column's type and became null
+    quality["coerced_values"] = dict(coerced)
+    quality.update(memory.report())
+    with timer.stage("write"):
+        dataset_store.save_state(session_id, types or {}, deduper.seen, profiler)
+    return profiler.rows, len(columns_info), columns_info, date_range, quality, timer.stages
+
+
+def rebuild_append_state(session_id):
+    # Sessions stored before the append state was kept: one pass over the
+    # dataset recovers the row-hash index and the profile
+    profiler = ProfileAccumulator()
+    hashes = []
+    for batch in dataset_store.read_table(session_id).to_batches(max_chunksize=UPLOAD_CHUNK_ROWS):
+        df = batch.to_pandas()
+        hashes.append(row_hashes(df))
+        profiler.update(df)
+    return {}, np.unique(np.concatenate(hashes)) if hashes else np.empty(0, dtype=np.uint64), profiler
+
+
+def ingest_append(path, ext, session_id, quality):
+    """Adds the new, distinct rows of an upload to a session's dataset and
+    folds them into its stored profile."""
+    timer = StageTimer()
+    with timer.stage("load_state"):
+        types, seen, profiler = dataset_store.load_state(session_id) or rebuild_append_state(session_id)
+    deduper = RowDeduper(seen)
+    delta = ProfileAccumulator(exact=profiler.exact)
+    memory = MemoryTally()
+    coerced = Counter((quality or {}).get("coerced_values") or {})
+    with dataset_store.appender(session_id) as writer:
+        for raw in timer.iterate("parse", read_chunks(path, ext)):
+            with timer.stage("convert"):
+                chunk, failed = conform_chunk(raw, writer.schema, types)
+            coerced.update(failed)
+            with timer.stage("dedup"):
+                chunk = deduper.filter(chunk)
+            with timer.stage("compact"):
+                chunk = memory.compact(raw, chunk)
+            with timer.stage("profile"):
+                delta.update(chunk)
+            with timer.stage("write"):
+                writer.write(chunk)
+    with timer.stage("profile"):
+        profiler.merge(delta)
+        dtypes = writer.schema.empty_table().to_pandas().dtypes.to_dict()
+        columns_info, date_range, merged = profiler.finalize(dtypes)
+    with timer.stage("write"):
+        dataset_store.save_state(session_id, types, deduper.seen, profiler)
+    quality = {**(quality or {}), **merged, **memory.report(quality)}
+    quality["duplicates_removed"] = (quality.get("duplicates_removed") or 0) + deduper.removed
+    quality["coerced_values"] = dict(coerced)
+    return delta.rows, deduper.removed, profiler.rows, columns_info, date_range, quality, timer.stages
+
+
 # --- LLM System Prompt ---
 ANALYSIS_SYSTEM_PROMPT = """You are an elite AI Data Analyst Agent. You analyze structured data and provide actionable insights with professional precision.
 
@@ -168,9 +492,14 @@ When given data context and a user query, respond with ONLY valid JSON (no markd
     "chart_type": "line|bar|pie|scatter|area",
     "reason": "Why this chart type",
     "title": "Chart title",
-    "x_key": "Key for x-axis in data objects",
-    "y_keys": ["key1", "key2"],
-    "data": [{"name": "Label", "value": 123}]
+    "plan": {
+      "filters": [{"column": "Column name", "op": "==|!=|>|>=|<|<=|in|not_in|between|contains|is_null|not_null", "value": "x"}],
+      "group_by": ["Column name"],
+      "time": {"column": "Datetime column name", "freq": "day|week|month|quarter|year"},
+      "metrics": [{"column": "Column name", "agg": "sum|mean|median|min|max|std|count|nunique", "as": "sales"}],
+      "sort": {"by": "sales", "desc": true},
+      "limit": 10
+    }
   },
   "analysis_summary": ["Finding 1", "Finding 2", "Finding 3"],
   "forecast": {
@@ -186,11 +515,11 @@ When given data context and a user query, respond with ONLY valid JSON (no markd
 
 CRITICAL RULES:
 - Return ONLY valid JSON. No markdown code fences. No text outside JSON.
-- Chart data MUST be an array of objects with consistent keys.
-- For line/bar/area: use descriptive key names like "month", "sales", "revenue".
-- For pie charts: use "name" and "value" keys.
-- x_key should match a key in data objects for x-axis labels.
-- y_keys should list the numeric value keys to plot.
+- Do NOT compute chart numbers yourself. visualization.plan describes how to compute them and is run over the full dataset, not just the sample rows.
+- Plan columns must be exact column names from the data context. All plan fields are optional; omit the ones you do not need.
+- "time" buckets a datetime column for trends; combine it with at most one group_by column and one metric to get one series per group.
+- Without "time" or "group_by" each metric becomes one bar. A metric with "agg": "count" and no column counts rows.
+- "limit" keeps the top N groups after sorting (or the number of series for a split time series).
 - Numbers must be actual numbers, not strings.
 - Include 3-5 analysis findings.
 - If the query involves future predictions, set forecast.available=true and include realistic projections with confidence intervals and macroeconomic signals.
@@ -200,6 +529,93 @@ CRITICAL RULES:
 """
 
 
+LLM_MODEL = "gpt-4o"
+LLM_TEMPERATURE = 0.3
+# Line, area and scatter charts with more points are downsampled
+CHART_MAX_POINTS = int(os.environ.get('CHART_MAX_POINTS', 1000))
+
+
+# --- LLM response cache ---
+# Keyed by the session's profile, the normalized query and the model
+# settings; entries live in an in-process LRU backed by the llm_cache table.
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))
+llm_cache = TTLCache(maxsize=int(os.environ.get('LLM_CACHE_SIZE', 1024)), ttl=LLM_CACHE_TTL)
+PROMPT_VERSION = hashlib.sha256(ANALYSIS_SYSTEM_PROMPT.encode()).hexdigest()[:16]
+
+
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', query).strip().rstrip('?.!').strip().lower()
+
+
+def dataset_fingerprint(session):
+    meta = {k: session[k] for k in ("filename", "row_count", "column_count", "columns", "date_range", "data_quality")}
+    return hashlib.sha256(json.dumps(meta, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def query_cache_key(session, query):
+    parts = [dataset_fingerprint(session), normalize_query(query), LLM_MODEL, str(LLM_TEMPERATURE), PROMPT_VERSION,
+             str(CHART_MAX_POINTS)]
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+def cache_lookup_db(key):
+    db = SessionLocal()
+    try:
+        entry = db.query(LLMCacheEntry).filter(LLMCacheEntry.key == key).first()
+        if not entry:
+            return None
+        created = entry.created_at
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=timezone.utc)
+        age = (datetime.now(timezone.utc) - created).total_seconds()
+        if age > LLM_CACHE_TTL:
+            db.delete(entry)
+            db.commit()
+            return None
+        return entry.session_id, entry.response, age
+    finally:
+        db.close()
+
+
+def cache_store_db(key, session_id, analysis):
+    db = SessionLocal()
+    try:
+        db.merge(LLMCacheEntry(key=key, session_id=session_id, response=analysis, created_at=datetime.now(timezone.utc)))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def cache_get(key):
+    hit = llm_cache.get(key)
+    if hit is not None:
+        return hit["response"], "memory"
+    row = await run_in_threadpool(cache_lookup_db, key)
+    if row is None:
+        return None, None
+    session_id, response, age = row
+    llm_cache.set(key, {"session_id": session_id, "response": response}, ttl=LLM_CACHE_TTL - age)
+    return response, "database"
+
+
+async def cache_put(key, session_id, analysis):
+    llm_cache.set(key, {"session_id": session_id, "response": analysis})
+    try:
+        await run_in_threadpool(cache_store_db, key, session_id, analysis)
+    except Exception as e:
+        logger.warning(f"LLM cache write failed: {e}")
+
+
+# Per-session prompt context, keyed by (session id, dataset fingerprint)
+context_cache = TTLCache(maxsize=int(os.environ.get('CONTEXT_CACHE_SIZE', 256)), ttl=24 * 3600)
+
+
+def invalidate_session_cache(db, session_id):
+    db.query(LLMCacheEntry).filter(LLMCacheEntry.session_id == session_id).delete()
+    llm_cache.discard_where(lambda v: v["session_id"] == session_id)
+    context_cache.discard_where(lambda v: v["session_id"] == session_id)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -208,404 +624,1212 @@ def get_db():
         db.close()
 
 
+def timed_json(timer, payload):
+    with timer.stage("serialize"):
+        body = json.dumps(payload, default=str).encode()
+    PAYLOAD_BYTES.observe(len(body), operation=timer.operation, kind="response")
+    timer.observe()
+    headers = {"Server-Timing": timer.header()} if SERVER_TIMING else None
+    return Response(body, media_type="application/json", headers=headers)
+
+
 # --- Endpoints ---
 @api_router.get("/")
 async def root():
     return {"message": "AI Data Analyst Agent API", "version": "1.0.0"}
 
 
-@api_router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    db = SessionLocal()
-    try:
-        filename = file.filename or "unknown.csv"
-        
-        # Extension-based validation (Windows-friendly)
-        ext = filename.lower().split('.')[-1] if '.' in filename else ''
-        if ext not in ('csv', 'xlsx', 'xls'):
-            raise HTTPException(status_code=400, detail="Unsupported format. Use .csv or .xlsx files only.")
-        
-        content = await file.read()
-
-        if ext == 'csv':
-            df = pd.read_csv(io.BytesIO(content))
-        else:
-            df = pd.read_excel(io.BytesIO(content))
+def ping_database():
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
 
-        initial_rows = len(df)
-        df = df.drop_duplicates()
-        dups_removed = initial_rows - len(df)
 
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                try:
-                    parsed = pd.to_datetime(df[col], format='mixed', dayfirst=False)
-                    if parsed.notna().sum() > len(df) * 0.5:
-                        df[col] = parsed
-                except Exception:
-                    pass
+@api_router.get("/ready")
+async def ready(warm: bool = False):
+    """Readiness check: 503 until the schema is set up and the database
+    answers. With ``warm=true`` it also waits for the deferred imports."""
+    checks = {"schema": startup["schema"], "database": False, "warm": startup["warm"]}
+    if checks["schema"]:
+        try:
+            await run_in_threadpool(ping_database)
+            checks["database"] = True
+        except Exception as e:
+            logger.warning(f"Readiness database check failed: {e}")
+    if warm and not checks["warm"]:
+        start_warm_up()
+    ok = checks["schema"] and checks["database"] and (checks["warm"] or not warm)
+    return JSONResponse({"status": "ready" if ok else "starting", **checks}, status_code=200 if ok else 503)
 
-        columns_info, date_range, quality = profile_dataframe(df)
-        quality["duplicates_removed"] = dups_removed
 
-        session_id = str(uuid.uuid4())
-        records = df_to_records(df)
+@api_router.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
-        # Create session in PostgreSQL
+
+def save_session(session_id, filename, row_count, column_count, columns_info, date_range, quality, content_hash=None):
+    db = SessionLocal()
+    try:
+        now = datetime.now(timezone.utc)
         session_obj = FileSession(
             id=session_id,
             filename=filename,
-            uploaded_at=datetime.now(timezone.utc),
-            row_count=len(df),
-            column_count=len(df.columns),
+            uploaded_at=now,
+            last_accessed_at=now,
+            row_count=row_count,
+            column_count=column_count,
             columns=columns_info,
             date_range=date_range,
             data_quality=quality,
-            data=records
+            content_hash=content_hash,
+            data=None
         )
         db.add(session_obj)
         db.commit()
+        return session_obj.uploaded_at
+    finally:
+        db.close()
+
+
+def discard_session(session_id):
+    db = SessionLocal()
+    try:
+        purge_session(db, session_id)
+    finally:
+        db.close()
 
-        return {
-            "id": session_id,
-            "filename": filename,
-            "uploaded_at": session_obj.uploaded_at.isoformat(),
-            "row_count": len(df),
-            "column_count": len(df.columns),
-            "columns": columns_info,
-            "date_range": date_range,
-            "data_quality": quality
-        }
+
+def upload_extension(filename):
+    # Extension-based validation (Windows-friendly)
+    ext = filename.lower().split('.')[-1] if '.' in filename else ''
+    if ext not in ('csv', 'xlsx', 'xls'):
+        raise HTTPException(status_code=400, detail="Unsupported format. Use .csv or .xlsx files only.")
+    return ext
+
+
+def reuse_stored_upload(content_hash, session_id):
+    """Links the dataset of an earlier upload with the same content to
+    ``session_id`` and returns that upload's profile, or None."""
+    db = SessionLocal()
+    try:
+        candidates = db.query(FileSession.id, FileSession.row_count, FileSession.column_count, FileSession.columns,
+                              FileSession.date_range, FileSession.data_quality).filter(
+            FileSession.content_hash == content_hash
+        ).order_by(FileSession.uploaded_at.desc()).limit(5).all()
+    finally:
+        db.close()
+    for source_id, *profile in candidates:
+        try:
+            dataset_store.link(source_id, session_id)
+        except FileNotFoundError:
+            # Deleted since the lookup
+            continue
+        return profile
+    return None
+
+
+async def process_upload(path, ext, filename, timer, progress=None, content_hash=None):
+    """Ingests a spooled upload and saves its session; removes ``path``.
+    With ``content_hash``, an identical earlier upload is reused instead.
+    A failed or cancelled upload leaves no dataset files behind."""
+    session_id = str(uuid.uuid4())
+    content_hash = f"{ext}-{content_hash}" if content_hash else None
+    saved = False
+    try:
+        try:
+            PAYLOAD_BYTES.observe(os.path.getsize(path), operation=timer.operation, kind="file")
+            reused = None
+            if content_hash:
+                with timer.stage("reuse_lookup"):
+                    reused = await run_to_completion(run_in_threadpool(reuse_stored_upload, content_hash, session_id))
+                CACHE_REQUESTS.inc(cache="upload", result="hit" if reused else "miss")
+            if reused:
+                row_count, column_count, columns_info, date_range, quality = reused
+                if progress is not None:
+                    progress("reused", row_count)
+            else:
+                async with limits["upload"]:
+                    if progress is not None:
+                        progress("parsing", 0)
+                    row_count, column_count, columns_info, date_range, quality, stages = await run_blocking(ingest_upload, path, ext, session_id, progress)
+                timer.merge(stages)
+                ROWS_INGESTED.inc(row_count)
+        finally:
+            os.unlink(path)
+
+        # Create session in PostgreSQL
+        if progress is not None:
+            progress("saving")
+        with timer.stage("db_commit"):
+            uploaded_at = await run_to_completion(run_in_threadpool(
+                save_session, session_id, filename, row_count, column_count, columns_info, date_range, quality, content_hash
+            ))
+        saved = True
+        # A job cancelled while the session was being saved is rolled back
+        if progress is not None:
+            progress("saved")
+    except BaseException:
+        if saved:
+            await run_in_threadpool(discard_session, session_id)
+        # Also the files linked from a reused upload, which retention would
+        # never find without a session row
+        dataset_store.delete(session_id)
+        raise
+
+    session = {
+        "id": session_id,
+        "filename": filename,
+        "uploaded_at": uploaded_at.isoformat(),
+        "row_count": row_count,
+        "column_count": column_count,
+        "columns": columns_info,
+        "date_range": date_range,
+        "data_quality": quality
+    }
+    # Build the prompt context now so the first query does not wait
+    spawn(get_data_context(session))
+    return session
+
+
+@api_router.post("/upload")
+async def upload_file(file: UploadFile = File(...)):
+    try:
+        filename = file.filename or "unknown.csv"
+        ext = upload_extension(filename)
+
+        timer = StageTimer("upload")
+        with timer.stage("spool"):
+            path, content_hash = await spool_upload(file, suffix=f".{ext}")
+        session = await process_upload(path, ext, filename, timer, content_hash=content_hash)
+        return timed_json(timer, session)
 
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Upload error: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to parse file: {str(e)}")
+
+
+def update_session_profile(session_id, row_count, columns_info, date_range, quality):
+    db = SessionLocal()
+    try:
+        session = db.query(FileSession).filter(FileSession.id == session_id).first()
+        if not session:
+            # Deleted while the rows were being appended
+            return None
+        session.row_count = row_count
+        session.column_count = len(columns_info)
+        session.columns = columns_info
+        session.date_range = date_range
+        session.data_quality = quality
+        # The dataset no longer matches the uploaded file
+        session.content_hash = None
+        # Cached answers and contexts describe the old rows
+        invalidate_session_cache(db, session_id)
+        db.commit()
+        return session_summary(session)
     finally:
         db.close()
 
 
-@api_router.post("/query")
-async def process_query(request: QueryRequest):
-    db = SessionLocal()
+# How often a waiting append retries the session's dataset lock
+APPEND_LOCK_POLL = 0.05
+
+
+@api_router.post("/session/{session_id}/append")
+async def append_to_session(session_id: str, file: UploadFile = File(...)):
     try:
-        session = db.query(FileSession).filter(FileSession.id == request.session_id).first()
+        ext = upload_extension(file.filename or "unknown.csv")
+        timer = StageTimer("append")
+        with timer.stage("db_fetch"):
+            session = await run_in_threadpool(fetch_session, session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
 
-        data = session.data or []
-        df = pd.DataFrame(data)
+        with timer.stage("spool"):
+            path, _ = await spool_upload(file, suffix=f".{ext}")
+        try:
+            PAYLOAD_BYTES.observe(os.path.getsize(path), operation="append", kind="file")
+            # One append at a time per session, in any worker process, since
+            # each rewrites the dataset file; polled so no thread waits on it
+            lock = dataset_store.lock(session_id)
+            with timer.stage("lock"):
+                while not lock.acquire(blocking=False):
+                    await asyncio.sleep(APPEND_LOCK_POLL)
+            try:
+                async with limits["upload"]:
+                    # Re-read under the lock so a concurrent append is not undone
+                    session = await run_in_threadpool(fetch_session, session_id)
+                    if not session:
+                        raise HTTPException(status_code=404, detail="Session not found")
+                    added, removed, row_count, columns_info, date_range, quality, stages = await run_to_completion(run_blocking(
+                        ingest_append, path, ext, session_id, session["data_quality"]))
+                    timer.merge(stages)
+                    with timer.stage("db_commit"):
+                        session = await run_to_completion(run_in_threadpool(
+                            update_session_profile, session_id, row_count, columns_info, date_range, quality))
+                    if not session:
+                        raise HTTPException(status_code=404, detail="Session not found")
+            finally:
+                lock.release()
+        except SchemaMismatch as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            os.unlink(path)
+        ROWS_INGESTED.inc(added)
+
+        spawn(get_data_context(session))
+        return timed_json(timer, {**session, "appended": {"rows_added": added, "duplicates_removed": removed}})
 
-        stats = ""
-        for ci in session.columns:
-            stats += f"\n- {ci['name']} ({ci['type']}): "
-            if "min" in ci and ci.get("min") is not None:
-                stats += f"min={ci['min']}, max={ci['max']}, mean={ci.get('mean','N/A')}, median={ci.get('median','N/A')}"
-            if "top_values" in ci:
-                stats += f"top values={ci['top_values']}"
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Append error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to append file: {str(e)}")
 
-        sample = df.head(50).to_string(index=False, max_cols=15)
 
-        prompt = f"""DATA CONTEXT:
-File: {session.filename}
-Rows: {session.row_count} | Columns: {session.column_count}
-Date Range: {json.dumps(session.date_range)}
-Data Quality: {json.dumps(session.data_quality)}
+# --- Upload jobs ---
+# Jobs live in this worker's memory, so status requests must reach the
+# worker that accepted the upload
+upload_jobs = JobRegistry(ttl=int(os.environ.get('UPLOAD_JOB_TTL', 3600)))
+JOB_POLL_INTERVAL = 0.25
+# How long a cancel request waits for the job to stop
+JOB_CANCEL_WAIT = 10
 
-COLUMN STATISTICS:{stats}
 
-SAMPLE DATA (first 50 rows):
-{sample}
+async def run_upload_job(job, path, ext, content_hash=None):
+    timer = StageTimer("upload_job")
+    try:
+        session = await process_upload(path, ext, job.filename, timer, job.progress, content_hash)
+        timer.observe()
+        upload_jobs.finish(job, "done", session=session)
+    except (JobCancelled, asyncio.CancelledError):
+        upload_jobs.finish(job, "cancelled")
+    except Exception as e:
+        logger.error(f"Upload job {job.id} failed: {e}")
+        upload_jobs.finish(job, "failed", error=f"Failed to parse file: {str(e)}")
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def get_upload_job(job_id):
+    job = upload_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job
+
+
+@api_router.post("/upload/jobs", status_code=202)
+async def create_upload_job(file: UploadFile = File(...)):
+    try:
+        filename = file.filename or "unknown.csv"
+        ext = upload_extension(filename)
+        path, content_hash = await spool_upload(file, suffix=f".{ext}")
+        job = upload_jobs.create(str(uuid.uuid4()), filename, os.path.getsize(path), shared=WORKER_POOL == 'process')
+        job.task = spawn(run_upload_job(job, path, ext, content_hash))
+        return job.to_dict()
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Upload job error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to start upload: {str(e)}")
+
+
+@api_router.get("/upload/jobs/{job_id}")
+def get_upload_job_status(job_id: str):
+    return get_upload_job(job_id).to_dict()
+
+
+async def upload_job_events(job):
+    last = None
+    while True:
+        status = job.to_dict()
+        current = (status["status"], status["stage"], status["rows_parsed"])
+        if current != last:
+            last = current
+            if status["status"] in TERMINAL:
+                yield sse_event(status["status"], status)
+                return
+            yield sse_event("progress", status)
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+@api_router.get("/upload/jobs/{job_id}/events")
+def stream_upload_job(job_id: str):
+    return StreamingResponse(
+        upload_job_events(get_upload_job(job_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@api_router.delete("/upload/jobs/{job_id}")
+async def cancel_upload_job(job_id: str):
+    # Runs on the event loop, so the flag cannot be set between the job's
+    # last check and it finishing
+    job = get_upload_job(job_id)
+    if job.status in TERMINAL:
+        raise HTTPException(status_code=409, detail=f"Upload job already {job.status}")
+    # The worker stops at its next chunk, or rolls back a session it has
+    # just saved; a job still waiting for a slot is cancelled outright
+    job.state["cancelled"] = True
+    if job.state.get("stage") is None:
+        job.task.cancel()
+    await asyncio.wait([job.task], timeout=JOB_CANCEL_WAIT)
+    if job.status in ("done", "failed"):
+        raise HTTPException(status_code=409, detail=f"Upload job already {job.status}")
+    # 202 while the worker is still winding down
+    return JSONResponse(job.to_dict(), status_code=200 if job.status == "cancelled" else 202)
+
+
+def fetch_session(session_id):
+    db = SessionLocal()
+    try:
+        session = db.query(FileSession).filter(FileSession.id == session_id).first()
+        if not session:
+            return None
+        open_session_payload(db, session)
+        return session_summary(session)
+    finally:
+        db.close()
 
-USER QUERY: {request.query}
+
+def session_frame_source(session):
+    table = dataset_store.read_table(session["id"])
+
+    def frame(columns, indices=None):
+        t = table.select(columns)
+        return (t if indices is None else t.take(indices)).to_pandas()
+    return table.num_rows, frame
+
+
+def build_session_context(session):
+    n_rows, frame = session_frame_source(session)
+    return build_data_context(session, n_rows, frame)
+
+
+async def get_data_context(session):
+    key = (session["id"], dataset_fingerprint(session))
+    hit = context_cache.get(key)
+    CACHE_REQUESTS.inc(cache="context", result="miss" if hit is None else "hit")
+    if hit is not None:
+        return hit["text"]
+    text = await run_blocking(build_session_context, session)
+    context_cache.set(key, {"session_id": session["id"], "text": text})
+    return text
+
+
+def execute_visualization(session, visualization):
+    if not isinstance(visualization, dict):
+        return visualization
+    if "plan" in visualization:
+        visualization = dict(visualization)
+        try:
+            plan = validate_plan(visualization["plan"], session["columns"])
+            n_rows, frame = session_frame_source(session)
+            visualization.update(execute_plan(plan, n_rows, frame, visualization.get("chart_type")))
+        except (PlanError, TypeError) as e:
+            logger.warning(f"Chart plan rejected: {e}")
+            visualization["plan_error"] = str(e)
+            visualization.setdefault("data", [])
+    return downsample_chart(visualization, CHART_MAX_POINTS)
+
+
+def build_prompt(context, query):
+    # The data context leads so the prompt prefix stays identical across
+    # queries on the same session
+    return f"""{context}
+
+USER QUERY: {query}
 
 Analyze the data thoroughly and respond with the structured JSON format as specified."""
 
-        query_id = str(uuid.uuid4())
-        
-        # Use OpenAI API
-        client = get_openai_client()
-        completion = client.chat.completions.create(
-            model="gpt-4o",
+
+async def query_prompt(session, query):
+    return build_prompt(await get_data_context(session), query)
+
+
+def llm_retryable(e):
+    import openai
+    return isinstance(e, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError))
+
+
+def log_llm_retry(e, attempt, delay):
+    LLM_REQUESTS.inc(model=LLM_MODEL, outcome="retried")
+    logger.warning(f"OpenAI call failed ({e}); retry {attempt} of {LLM_MAX_RETRIES} in {delay:.1f}s")
+
+
+async def llm_create(prompt, **kwargs):
+    """Starts a chat completion for ``prompt`` once the rate limiter allows
+    it, retrying rate-limit, timeout and server errors with backoff."""
+    client = get_openai_client()
+    prompt_tokens = estimate_tokens(ANALYSIS_SYSTEM_PROMPT + prompt) if llm_token_bucket.rate else 0
+
+    async def call():
+        await llm_request_bucket.acquire()
+        await llm_token_bucket.acquire(prompt_tokens)
+        return await client.chat.completions.create(
+            model=LLM_MODEL,
             messages=[
                 {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.3
+            temperature=LLM_TEMPERATURE,
+            **kwargs
         )
-        
-        response_text = completion.choices[0].message.content
-
-        # Parse JSON
-        analysis = None
-        cleaned = response_text.strip()
-        if cleaned.startswith("```"):
-            parts = cleaned.split("```")
-            if len(parts) >= 2:
-                cleaned = parts[1]
-                if cleaned.startswith("json"):
-                    cleaned = cleaned[4:]
-            cleaned = cleaned.strip()
+    return await with_retries(call, llm_retryable, attempts=LLM_MAX_RETRIES + 1, on_retry=log_llm_retry)
 
-        try:
-            analysis = json.loads(cleaned)
-        except json.JSONDecodeError:
-            match = re.search(r'\{[\s\S]*\}', cleaned)
-            if match:
-                try:
-                    analysis = json.loads(match.group())
-                except json.JSONDecodeError:
-                    pass
-
-        if not analysis:
-            analysis = {
-                "query_understood": request.query,
-                "analysis_type": "descriptive",
-                "visualization": {"chart_type": "bar", "reason": "Default fallback", "title": "Analysis", "x_key": "name", "y_keys": ["value"], "data": []},
-                "analysis_summary": [response_text[:500] if response_text else "Analysis could not be parsed"],
-                "forecast": {"available": False},
-                "agent_insight": response_text[:300] if response_text else "Unable to generate insight",
-                "recommendations": []
-            }
+
+def parse_analysis(response_text):
+    analysis = None
+    cleaned = (response_text or "").strip()
+    if cleaned.startswith("```"):
+        parts = cleaned.split("```")
+        if len(parts) >= 2:
+            cleaned = parts[1]
+            if cleaned.startswith("json"):
+                cleaned = cleaned[4:]
+        cleaned = cleaned.strip()
+
+    try:
+        analysis = json.loads(cleaned)
+    except json.JSONDecodeError:
+        match = re.search(r'\{[\s\S]*\}', cleaned)
+        if match:
+            try:
+                analysis = json.loads(match.group())
+            except json.JSONDecodeError:
+                pass
+
+    return analysis or None
+
+
+def fallback_analysis(response_text, query):
+    return {
+        "query_understood": query,
+        "analysis_type": "descriptive",
+        "visualization": {"chart_type": "bar", "reason": "Default fallback", "title": "Analysis", "x_key": "name", "y_keys": ["value"], "data": []},
+        "analysis_summary": [response_text[:500] if response_text else "Analysis could not be parsed"],
+        "forecast": {"available": False},
+        "agent_insight": response_text[:300] if response_text else "Unable to generate insight",
+        "recommendations": []
+    }
+
+
+def save_query_records(records):
+    # One executemany for any number of (query_id, session_id, query, analysis)
+    timestamp = datetime.now(timezone.utc)
+    rows = [{"id": qid, "session_id": sid, "query": q, "timestamp": timestamp, "response": a}
+            for qid, sid, q, a in records]
+    db = SessionLocal()
+    try:
+        if rows:
+            db.execute(insert(QueryRecord), rows)
+            db.commit()
+        return timestamp
+    finally:
+        db.close()
+
+
+def save_query_record(query_id, session_id, query, analysis):
+    return save_query_records([(query_id, session_id, query, analysis)])
+
+
+@api_router.post("/query")
+async def process_query(request: QueryRequest):
+    try:
+        timer = StageTimer("query")
+        with timer.stage("db_fetch"):
+            session = await run_in_threadpool(fetch_session, request.session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+
+        query_id = str(uuid.uuid4())
+        cache_key = query_cache_key(session, request.query)
+        with timer.stage("cache_lookup"):
+            analysis, cache_layer = await cache_get(cache_key)
+        CACHE_REQUESTS.inc(cache="llm", result=cache_layer or "miss")
+
+        if analysis is None:
+            with timer.stage("context"):
+                prompt = await query_prompt(session, request.query)
+            PAYLOAD_BYTES.observe(len(prompt.encode()), operation="query", kind="prompt")
+
+            # Use OpenAI API
+            async with limits["llm"]:
+                with timer.stage("llm"):
+                    completion = await llm_create(prompt)
+            record_usage(LLM_MODEL, getattr(completion, "usage", None))
+
+            response_text = completion.choices[0].message.content
+            with timer.stage("parse"):
+                analysis = parse_analysis(response_text)
+            LLM_REQUESTS.inc(model=LLM_MODEL, outcome="parsed" if analysis is not None else "unparsed")
+            if analysis is not None:
+                with timer.stage("plan"):
+                    analysis["visualization"] = await run_blocking(execute_visualization, session, analysis.get("visualization"))
+                with timer.stage("cache_store"):
+                    await cache_put(cache_key, request.session_id, analysis)
+            else:
+                analysis = fallback_analysis(response_text, request.query)
 
         # Save query to PostgreSQL
-        query_obj = QueryRecord(
-            id=query_id,
-            session_id=request.session_id,
-            query=request.query,
-            timestamp=datetime.now(timezone.utc),
-            response=analysis
-        )
-        db.add(query_obj)
-        db.commit()
+        with timer.stage("db_commit"):
+            timestamp = await run_in_threadpool(save_query_record, query_id, request.session_id, request.query, analysis)
+        if REPORT_PRERENDER:
+            spawn(prerender_report(query_id))
 
-        return {
+        return timed_json(timer, {
             "id": query_id,
             "session_id": request.session_id,
             "query": request.query,
-            "timestamp": query_obj.timestamp.isoformat(),
-            "response": analysis
-        }
+            "timestamp": timestamp.isoformat(),
+            "response": analysis,
+            "cache": {"hit": cache_layer is not None, "layer": cache_layer}
+        })
 
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Query error: {e}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+
+async def query_events(request, session, cache_key, analysis, cache_layer, prompt, timer):
+    try:
+        if analysis is None:
+            visualization = None
+            parser = SectionParser()
+            parts = []
+            async with limits["llm"]:
+                stream = await llm_create(prompt, stream=True, stream_options={"include_usage": True})
+                started = time.perf_counter()
+                async for chunk in stream:
+                    record_usage(LLM_MODEL, getattr(chunk, "usage", None))
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    parts.append(chunk.choices[0].delta.content)
+                    for event, data in parser.feed(parts[-1]):
+                        if event == "visualization":
+                            data = visualization = await run_blocking(execute_visualization, session, data)
+                        yield sse_event(event, data)
+                timer.add("llm", time.perf_counter() - started)
+
+            response_text = "".join(parts)
+            analysis = parse_analysis(response_text)
+            LLM_REQUESTS.inc(model=LLM_MODEL, outcome="parsed" if analysis is not None else "unparsed")
+            if analysis is not None:
+                if visualization is None:
+                    visualization = await run_blocking(execute_visualization, session, analysis.get("visualization"))
+                analysis["visualization"] = visualization
+                await cache_put(cache_key, request.session_id, analysis)
+            else:
+                analysis = fallback_analysis(response_text, request.query)
+                for event, data in iter_sections(analysis):
+                    yield sse_event(event, data)
+        else:
+            for event, data in iter_sections(analysis):
+                yield sse_event(event, data)
+
+        query_id = str(uuid.uuid4())
+        timestamp = await run_in_threadpool(save_query_record, query_id, request.session_id, request.query, analysis)
+        if REPORT_PRERENDER:
+            spawn(prerender_report(query_id))
+        timer.observe()
+        yield sse_event("done", {
+            "id": query_id,
+            "session_id": request.session_id,
+            "query": request.query,
+            "timestamp": timestamp.isoformat(),
+            "response": analysis,
+            "cache": {"hit": cache_layer is not None, "layer": cache_layer}
+        })
+    except Exception as e:
+        logger.error(f"Query stream error: {e}")
+        yield sse_event("error", {"detail": f"Analysis failed: {str(e)}"})
+
+
+@api_router.post("/query/stream")
+async def stream_query(request: QueryRequest):
+    timer = StageTimer("query_stream")
+    with timer.stage("db_fetch"):
+        session = await run_in_threadpool(fetch_session, request.session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    cache_key = query_cache_key(session, request.query)
+    with timer.stage("cache_lookup"):
+        analysis, cache_layer = await cache_get(cache_key)
+    CACHE_REQUESTS.inc(cache="llm", result=cache_layer or "miss")
+    prompt = None
+    if analysis is None:
+        with timer.stage("context"):
+            prompt = await query_prompt(session, request.query)
+        PAYLOAD_BYTES.observe(len(prompt.encode()), operation="query_stream", kind="prompt")
+
+    return StreamingResponse(
+        query_events(request, session, cache_key, analysis, cache_layer, prompt, timer),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def answer_batch_query(session, context, query):
+    """One query of a batch: cached analysis or a fresh completion.
+    Returns ``(analysis, cache_layer)``."""
+    cache_key = query_cache_key(session, query)
+    analysis, cache_layer = await cache_get(cache_key)
+    CACHE_REQUESTS.inc(cache="llm", result=cache_layer or "miss")
+    if analysis is not None:
+        return analysis, cache_layer
+
+    prompt = build_prompt(context, query)
+    async with limits["llm"]:
+        completion = await llm_create(prompt)
+    record_usage(LLM_MODEL, getattr(completion, "usage", None))
+    response_text = completion.choices[0].message.content
+    analysis = parse_analysis(response_text)
+    LLM_REQUESTS.inc(model=LLM_MODEL, outcome="parsed" if analysis is not None else "unparsed")
+    if analysis is None:
+        return fallback_analysis(response_text, query), None
+    analysis["visualization"] = await run_blocking(execute_visualization, session, analysis.get("visualization"))
+    await cache_put(cache_key, session["id"], analysis)
+    return analysis, None
+
+
+async def batch_events(session, groups, context, timer):
+    async def run(indices, query):
+        try:
+            return indices, query, await answer_batch_query(session, context, query), None
+        except Exception as e:
+            logger.error(f"Batch query error: {e}")
+            return indices, query, None, e
+
+    tasks = [asyncio.ensure_future(run(indices, query)) for query, indices in groups]
+    records = []
+    saved = False
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            indices, query, result, error = await next_done
+            if error is not None:
+                yield sse_event("error", {"indices": indices, "query": query, "detail": f"Analysis failed: {str(error)}"})
+                continue
+            analysis, cache_layer = result
+            query_id = str(uuid.uuid4())
+            records.append((query_id, session["id"], query, analysis))
+            yield sse_event("result", {
+                "id": query_id,
+                "indices": indices,
+                "query": query,
+                "response": analysis,
+                "cache": {"hit": cache_layer is not None, "layer": cache_layer}
+            })
+
+        # Every answer goes into the history with a single insert
+        timestamp = await run_in_threadpool(save_query_records, records)
+        saved = True
+        if REPORT_PRERENDER:
+            for query_id, *_ in records:
+                spawn(prerender_report(query_id))
+        timer.observe()
+        yield sse_event("done", {
+            "session_id": session["id"],
+            "timestamp": timestamp.isoformat(),
+            "ids": [r[0] for r in records],
+            "failed": len(groups) - len(records)
+        })
     finally:
-        db.close()
+        for task in tasks:
+            task.cancel()
+        if records and not saved:
+            # The client went away; keep the answers it was already sent
+            spawn(run_in_threadpool(save_query_records, records))
+
+
+@api_router.post("/query/batch")
+async def batch_query(request: BatchQueryRequest):
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries given")
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+
+    timer = StageTimer("query_batch")
+    with timer.stage("db_fetch"):
+        session = await run_in_threadpool(fetch_session, request.session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    # Queries that normalize alike are answered once; the result lists the
+    # positions of every copy
+    groups = {}
+    for i, query in enumerate(request.queries):
+        if not normalize_query(query):
+            raise HTTPException(status_code=400, detail=f"Query {i} is empty")
+        groups.setdefault(normalize_query(query), (query, []))[1].append(i)
+
+    with timer.stage("context"):
+        context = await get_data_context(session)
+
+    return StreamingResponse(
+        batch_events(session, list(groups.values()), context, timer),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def session_summary(s):
+    return {
+        "id": s.id,
+        "filename": s.filename,
+        "uploaded_at": s.uploaded_at.isoformat() if s.uploaded_at else None,
+        "row_count": s.row_count,
+        "column_count": s.column_count,
+        "columns": s.columns,
+        "date_range": s.date_range,
+        "data_quality": s.data_quality
+    }
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("if-none-match", "")
+    return if_none_match.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+
+
+def etag_response(request, payload, headers=None):
+    body = json.dumps(payload, default=str).encode()
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 @api_router.get("/sessions")
-async def list_sessions():
-    db = SessionLocal()
+def list_sessions(request: Request, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    limit = max(1, min(limit, 500))
+    q = db.query(FileSession)
+    if cursor:
+        try:
+            token = decode_token(cursor)
+            last_at, last_id = datetime.fromisoformat(token["t"]), token["id"]
+        except (PageError, KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        q = q.filter(or_(FileSession.uploaded_at < last_at,
+                         and_(FileSession.uploaded_at == last_at, FileSession.id < last_id)))
+    sessions = q.order_by(FileSession.uploaded_at.desc(), FileSession.id.desc()).limit(limit + 1).all()
+
+    headers = {}
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        last = sessions[-1]
+        headers["X-Next-Cursor"] = encode_token({"t": last.uploaded_at.isoformat(), "id": last.id})
+    return etag_response(request, [session_summary(s) for s in sessions], headers)
+
+
+@api_router.get("/session/{session_id}")
+def get_session(session_id: str, request: Request, db: Session = Depends(get_db)):
+    session = db.query(FileSession).filter(FileSession.id == session_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return etag_response(request, session_summary(session))
+
+
+def load_session_table(db, session_id):
+    session = db.query(FileSession).filter(FileSession.id == session_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    open_session_payload(db, session)
+    return dataset_store.read_table(session_id)
+
+
+def ndjson_rows(table, positions, columns):
+    for page in iter_pages(table, positions, columns):
+        for record in df_to_records(page.to_pandas(), max_rows=page.num_rows):
+            yield json.dumps(record, default=str) + "\n"
+
+
+def arrow_stream(table, positions, columns):
+    buf = io.BytesIO()
+    schema = table.schema if columns is None else table.select(columns).schema
+    with pa.ipc.new_stream(buf, schema) as writer:
+        for page in iter_pages(table, positions, columns):
+            writer.write_table(page)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+@api_router.get("/session/{session_id}/data")
+def get_session_data(
+    session_id: str,
+    limit: int = 100,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    columns: Optional[str] = None,
+    sort: Optional[str] = None,
+    order: str = "asc",
+    filter: Optional[List[str]] = Query(None),
+    format: str = "json",
+    db: Session = Depends(get_db),
+):
+    if format not in ("json", "ndjson", "arrow"):
+        raise HTTPException(status_code=400, detail="format must be json, ndjson or arrow")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    if limit < 0 or offset < 0:
+        raise HTTPException(status_code=400, detail="limit and offset must not be negative")
+    # Streamed formats can return every remaining row with limit=0
+    if format == "json":
+        limit = min(limit, MAX_PAGE_ROWS)
+    elif limit == 0:
+        limit = None
+
+    table = load_session_table(db, session_id)
+    selected = None
+    if columns:
+        selected = [c.strip() for c in columns.split(",") if c.strip()]
+        unknown = [c for c in selected if c not in table.schema.names]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+    try:
+        filters = parse_filters(filter, table.schema)
+        positions, next_cursor = select_rows(table, filters, sort, order == "desc", cursor, offset, limit)
+    except PageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {"X-Total-Rows": str(table.num_rows)}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if format == "ndjson":
+        return StreamingResponse(ndjson_rows(table, positions, selected), media_type="application/x-ndjson", headers=headers)
+    if format == "arrow":
+        return StreamingResponse(arrow_stream(table, positions, selected), media_type="application/vnd.apache.arrow.stream", headers=headers)
+
+    data = []
+    for page in iter_pages(table, positions, selected):
+        data.extend(df_to_records(page.to_pandas(), max_rows=page.num_rows))
+    return {
+        "data": data,
+        "columns": selected or table.schema.names,
+        "next_cursor": next_cursor,
+        "total_rows": table.num_rows
+    }
+
+
+@api_router.get("/session/{session_id}/queries")
+def get_session_queries(session_id: str, db: Session = Depends(get_db)):
+    queries = db.query(QueryRecord).filter(
+        QueryRecord.session_id == session_id
+    ).order_by(QueryRecord.timestamp.desc()).limit(100).all()
+    return [
+        {
+            "id": q.id,
+            "session_id": q.session_id,
+            "query": q.query,
+            "timestamp": q.timestamp.isoformat() if q.timestamp else None,
+            "response": q.response
+        }
+        for q in queries
+    ]
+
+
+@api_router.get("/queries/search")
+def search_query_history(q: str, session_id: Optional[str] = None, limit: int = 20, cursor: Optional[str] = None,
+                         db: Session = Depends(get_db)):
+    limit = max(1, min(limit, 100))
+    after = None
+    if cursor:
+        try:
+            token = decode_token(cursor)
+            after = {"s": float(token["s"]), "k": token["k"]}
+        except (PageError, KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     try:
-        sessions = db.query(FileSession).order_by(FileSession.uploaded_at.desc()).limit(100).all()
-        return [
+        hits = search_queries(db.connection(), engine.dialect.name, q, session_id, limit + 1, after)
+    except SearchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_cursor = encode_token({"s": hits[-1]["score"], "k": hits[-1]["key"]})
+    return {
+        "results": [
             {
-                "id": s.id,
-                "filename": s.filename,
-                "uploaded_at": s.uploaded_at.isoformat() if s.uploaded_at else None,
-                "row_count": s.row_count,
-                "column_count": s.column_count,
-                "columns": s.columns,
-                "date_range": s.date_range,
-                "data_quality": s.data_quality
+                "id": h["id"],
+                "session_id": h["session_id"],
+                "snippet": h["snippet"],
+                "timestamp": h["timestamp"].isoformat() if h["timestamp"] else None,
+                "score": -h["score"],
             }
-            for s in sessions
-        ]
+            for h in hits
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+def fetch_report_inputs(query_id):
+    db = SessionLocal()
+    try:
+        query_doc = db.query(QueryRecord).filter(QueryRecord.id == query_id).first()
+        if not query_doc:
+            return None
+        session = db.query(FileSession).filter(FileSession.id == query_doc.session_id).first()
+        session_info = None
+        if session:
+            session_info = {
+                "filename": session.filename,
+                "row_count": session.row_count,
+                "column_count": session.column_count,
+                "date_range": session.date_range,
+            }
+        return query_doc.query, query_doc.response or {}, session_info
     finally:
         db.close()
 
 
-@api_router.get("/session/{session_id}")
-async def get_session(session_id: str):
+def fetch_session_report_inputs(session_id):
     db = SessionLocal()
     try:
         session = db.query(FileSession).filter(FileSession.id == session_id).first()
         if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-        return {
-            "id": session.id,
+            return None
+        session_info = {
             "filename": session.filename,
-            "uploaded_at": session.uploaded_at.isoformat() if session.uploaded_at else None,
             "row_count": session.row_count,
             "column_count": session.column_count,
-            "columns": session.columns,
             "date_range": session.date_range,
-            "data_quality": session.data_quality
         }
+        rows = db.query(QueryRecord.query, QueryRecord.response).filter(
+            QueryRecord.session_id == session_id
+        ).order_by(QueryRecord.timestamp.asc()).all()
+        return session_info, [(q, r or {}) for q, r in rows]
     finally:
         db.close()
 
 
-@api_router.get("/session/{session_id}/data")
-async def get_session_data(session_id: str, limit: int = 100):
-    db = SessionLocal()
+# Renders in flight, so concurrent downloads of one report share the work
+report_renders = {}
+async def ensure_report(key, digest, render, *args):
+    path = report_cache.get(key, digest)
+    CACHE_REQUESTS.inc(cache="report", result="hit" if path else "miss")
+    if path:
+        return path
+    task = report_renders.get((key, digest))
+    if task is None:
+        async def run():
+            async with limits["report"]:
+                return await run_blocking(report_cache.put, key, digest, render, *args)
+        task = asyncio.ensure_future(run())
+        report_renders[(key, digest)] = task
+        task.add_done_callback(lambda _: report_renders.pop((key, digest), None))
+    # A client going away must not cancel a render others may be waiting on
+    return await asyncio.shield(task)
+
+
+async def prerender_report(query_id):
     try:
-        session = db.query(FileSession).filter(FileSession.id == session_id).first()
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-        return {"data": (session.data or [])[:limit]}
-    finally:
-        db.close()
+        inputs = await run_in_threadpool(fetch_report_inputs, query_id)
+        if inputs:
+            await ensure_report(query_id, report_digest(*inputs), render_report_pdf, *inputs)
+    except Exception as e:
+        logger.warning(f"Background report render failed for {query_id}: {e}")
 
 
-@api_router.get("/session/{session_id}/queries")
-async def get_session_queries(session_id: str):
-    db = SessionLocal()
-    try:
-        queries = db.query(QueryRecord).filter(
-            QueryRecord.session_id == session_id
-        ).order_by(QueryRecord.timestamp.desc()).limit(100).all()
-        return [
-            {
-                "id": q.id,
-                "session_id": q.session_id,
-                "query": q.query,
-                "timestamp": q.timestamp.isoformat() if q.timestamp else None,
-                "response": q.response
-            }
-            for q in queries
-        ]
-    finally:
-        db.close()
+async def serve_report(request, timer, key, digest, filename, render, *args):
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "no-cache"}
+    if etag_matches(request, headers["ETag"]):
+        timer.observe()
+        return Response(status_code=304, headers=headers)
+    with timer.stage("render"):
+        path = await ensure_report(key, digest, render, *args)
+    PAYLOAD_BYTES.observe(path.stat().st_size, operation=timer.operation, kind="response")
+    timer.observe()
+    headers["Content-Disposition"] = f"attachment; filename={filename}"
+    if SERVER_TIMING:
+        headers["Server-Timing"] = timer.header()
+    return FileResponse(path, media_type="application/pdf", headers=headers)
 
 
 @api_router.get("/report/{query_id}/download")
-async def download_report(query_id: str):
-    db = SessionLocal()
+async def download_report(query_id: str, request: Request):
     try:
-        query_doc = db.query(QueryRecord).filter(QueryRecord.id == query_id).first()
-        if not query_doc:
+        timer = StageTimer("report")
+        with timer.stage("db_fetch"):
+            inputs = await run_in_threadpool(fetch_report_inputs, query_id)
+        if not inputs:
             raise HTTPException(status_code=404, detail="Query not found")
 
-        session = db.query(FileSession).filter(FileSession.id == query_doc.session_id).first()
-
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.75*inch, bottomMargin=0.75*inch, leftMargin=0.75*inch, rightMargin=0.75*inch)
-
-        styles = getSampleStyleSheet()
-        title_s = ParagraphStyle('Title2', parent=styles['Title'], fontSize=22, textColor=rl_colors.HexColor('#0284C7'), spaceAfter=20)
-        heading_s = ParagraphStyle('H2', parent=styles['Heading2'], fontSize=13, textColor=rl_colors.HexColor('#0369A1'), spaceBefore=14, spaceAfter=8)
-        body_s = ParagraphStyle('Body2', parent=styles['Normal'], fontSize=10, textColor=rl_colors.HexColor('#1E293B'), leading=14)
-        insight_s = ParagraphStyle('Insight2', parent=styles['Normal'], fontSize=11, textColor=rl_colors.HexColor('#0F172A'), backColor=rl_colors.HexColor('#E0F2FE'), borderPadding=10, leading=16)
-        meta_s = ParagraphStyle('Meta', parent=styles['Normal'], fontSize=9, textColor=rl_colors.HexColor('#64748B'))
-
-        elements = []
-        resp = query_doc.response or {}
+        return await serve_report(request, timer, query_id, report_digest(*inputs), f"analysis_report_{query_id[:8]}.pdf",
+                                  render_report_pdf, *inputs)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Report error: {e}")
+        raise HTTPException(status_code=500, detail=f"Report generation failed: {str(e)}")
 
-        elements.append(Paragraph("AI Data Analyst Report", title_s))
-        elements.append(Paragraph(f"Generated: {datetime.now(timezone.utc).strftime('%B %d, %Y at %H:%M UTC')}", meta_s))
-        elements.append(Spacer(1, 20))
 
-        elements.append(Paragraph("Executive Summary", heading_s))
-        elements.append(Paragraph(f"<b>Query:</b> {resp.get('query_understood', query_doc.query or '')}", body_s))
-        elements.append(Paragraph(f"<b>Analysis Type:</b> {resp.get('analysis_type', 'N/A').title()}", body_s))
-        elements.append(Spacer(1, 10))
+@api_router.get("/session/{session_id}/report/download")
+async def download_session_report(session_id: str, request: Request):
+    try:
+        timer = StageTimer("session_report")
+        with timer.stage("db_fetch"):
+            inputs = await run_in_threadpool(fetch_session_report_inputs, session_id)
+        if not inputs:
+            raise HTTPException(status_code=404, detail="Session not found")
 
-        if session:
-            elements.append(Paragraph("Data Overview", heading_s))
-            elements.append(Paragraph(f"<b>File:</b> {session.filename or 'N/A'}", body_s))
-            elements.append(Paragraph(f"<b>Dimensions:</b> {session.row_count or 0} rows x {session.column_count or 0} columns", body_s))
-            dr = session.date_range
-            if dr:
-                elements.append(Paragraph(f"<b>Date Range:</b> {dr.get('start', '')} to {dr.get('end', '')}", body_s))
-            elements.append(Spacer(1, 10))
-
-        elements.append(Paragraph("Analysis Findings", heading_s))
-        for i, finding in enumerate(resp.get("analysis_summary", []), 1):
-            elements.append(Paragraph(f"{i}. {finding}", body_s))
-        elements.append(Spacer(1, 10))
-
-        viz = resp.get("visualization", {})
-        if viz.get("data"):
-            elements.append(Paragraph(f"Visualization: {viz.get('title', 'Chart')}", heading_s))
-            elements.append(Paragraph(f"<i>Chart Type: {viz.get('chart_type', 'bar')} - {viz.get('reason', '')}</i>", meta_s))
-            chart_data = viz["data"]
-            if chart_data and len(chart_data) > 0:
-                headers = list(chart_data[0].keys())
-                tdata = [headers] + [[str(row.get(h, ''))[:30] for h in headers] for row in chart_data[:25]]
-                t = Table(tdata, repeatRows=1)
-                t.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), rl_colors.HexColor('#0284C7')),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), rl_colors.white),
-                    ('FONTSIZE', (0, 0), (-1, -1), 8),
-                    ('GRID', (0, 0), (-1, -1), 0.5, rl_colors.HexColor('#CBD5E1')),
-                    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [rl_colors.HexColor('#F8FAFC'), rl_colors.white]),
-                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ]))
-                elements.append(t)
-            elements.append(Spacer(1, 10))
-
-        forecast = resp.get("forecast", {})
-        if forecast.get("available"):
-            elements.append(Paragraph("Forecast", heading_s))
-            elements.append(Paragraph(f"<b>Horizon:</b> {forecast.get('time_horizon', 'N/A')} | <b>Confidence:</b> {forecast.get('confidence', 'N/A')}", body_s))
-            if forecast.get("data"):
-                fh = ["Period", "Forecast", "Lower", "Upper"]
-                fd = [fh] + [[str(fp.get("period", "")), str(fp.get("value", "")), str(fp.get("lower", "")), str(fp.get("upper", ""))] for fp in forecast["data"]]
-                ft = Table(fd, repeatRows=1)
-                ft.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), rl_colors.HexColor('#059669')),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), rl_colors.white),
-                    ('FONTSIZE', (0, 0), (-1, -1), 8),
-                    ('GRID', (0, 0), (-1, -1), 0.5, rl_colors.HexColor('#CBD5E1')),
-                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ]))
-                elements.append(ft)
-            if forecast.get("signals"):
-                elements.append(Spacer(1, 5))
-                elements.append(Paragraph("<b>External Signals Applied:</b>", body_s))
-                for sig in forecast["signals"]:
-                    impact_color = '#059669' if sig.get('impact') == 'positive' else '#DC2626' if sig.get('impact') == 'negative' else '#64748B'
-                    elements.append(Paragraph(f"<font color='{impact_color}'>{sig.get('name', '')}</font>: {sig.get('value', '')} - <i>{sig.get('source', '')}</i>", body_s))
-            elements.append(Spacer(1, 10))
-
-        elements.append(Paragraph("Agent Insight", heading_s))
-        elements.append(Paragraph(resp.get("agent_insight", "N/A"), insight_s))
-        elements.append(Spacer(1, 10))
-
-        if resp.get("recommendations"):
-            elements.append(Paragraph("Recommendations", heading_s))
-            for i, rec in enumerate(resp.get("recommendations", []), 1):
-                elements.append(Paragraph(f"{i}. {rec}", body_s))
-
-        doc.build(elements)
-        buffer.seek(0)
-
-        return StreamingResponse(
-            buffer,
-            media_type="application/pdf",
-            headers={"Content-Disposition": f"attachment; filename=analysis_report_{query_id[:8]}.pdf"}
-        )
+        return await serve_report(request, timer, f"session-{session_id}", report_digest(*inputs),
+                                  f"session_report_{session_id[:8]}.pdf", render_session_report_pdf, *inputs)
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Report error: {e}")
+        logger.error(f"Session report error: {e}")
         raise HTTPException(status_code=500, detail=f"Report generation failed: {str(e)}")
-    finally:
-        db.close()
+
+
+def purge_session(db, session_id):
+    # Delete queries and cached responses first
+    query_ids = [q for (q,) in db.query(QueryRecord.id).filter(QueryRecord.session_id == session_id)]
+    db.query(QueryRecord).filter(QueryRecord.session_id == session_id).delete()
+    invalidate_session_cache(db, session_id)
+    # Delete session
+    db.query(FileSession).filter(FileSession.id == session_id).delete()
+    db.commit()
+    dataset_store.delete(session_id)
+    for query_id in query_ids:
+        report_cache.delete(query_id)
+    report_cache.delete(f"session-{session_id}")
 
 
 @api_router.delete("/session/{session_id}")
-async def delete_session(session_id: str):
+def delete_session(session_id: str, db: Session = Depends(get_db)):
+    session = db.query(FileSession.id).filter(FileSession.id == session_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    purge_session(db, session_id)
+    return {"message": "Session deleted"}
+
+
+# --- Retention ---
+retention_status = {"last_run": None, "last_compaction": None}
+
+
+def storage_usage(db):
+    sessions = [(sid, as_utc(accessed or uploaded)) for sid, accessed, uploaded in
+                db.query(FileSession.id, FileSession.last_accessed_at, FileSession.uploaded_at)]
+    return sessions, {sid: dataset_store.usage(sid) for sid, _ in sessions}
+
+
+def run_retention():
+    """One retention pass: moves legacy inline payloads out of the database,
+    expires and evicts sessions, freezes idle datasets and drops expired
+    LLM cache rows."""
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    result = {"legacy_moved": 0, "expired": 0, "evicted": 0, "frozen": 0, "frozen_bytes": 0}
     db = SessionLocal()
     try:
-        session = db.query(FileSession).filter(FileSession.id == session_id).first()
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-        
-        # Delete queries first
-        db.query(QueryRecord).filter(QueryRecord.session_id == session_id).delete()
-        # Delete session
-        db.delete(session)
+        # A cleared payload is stored as JSON null rather than SQL NULL
+        legacy = db.query(FileSession).filter(FileSession.data.isnot(None), cast(FileSession.data, Text) != 'null')
+        for session in legacy.limit(100).all():
+            if dataset_store.exists(session.id):
+                db.query(FileSession).filter(FileSession.id == session.id).update({"data": None}, synchronize_session=False)
+                db.commit()
+            else:
+                migrate_legacy_payload(db, session)
+            result["legacy_moved"] += 1
+
+        sessions, usage = storage_usage(db)
+        expire, evict, freeze = plan_retention(sessions, usage, retention_policy, now)
+        for action, ids in (("expired", expire), ("evicted", evict)):
+            for sid in ids:
+                purge_session(db, sid)
+                result[action] += 1
+                RETENTION_SESSIONS.inc(action=action)
+        for sid in freeze:
+            size = dataset_store.freeze(sid)
+            if size is not None:
+                result["frozen"] += 1
+                result["frozen_bytes"] += size
+                RETENTION_SESSIONS.inc(action="frozen")
+
+        cutoff = now - timedelta(seconds=LLM_CACHE_TTL)
+        result["cache_rows_expired"] = db.query(LLMCacheEntry).filter(LLMCacheEntry.created_at < cutoff).delete()
         db.commit()
-        
-        return {"message": "Session deleted"}
     finally:
         db.close()
+    result["finished_at"] = datetime.now(timezone.utc).isoformat()
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    retention_status["last_run"] = result
+    logger.info(f"Retention pass: {result}")
+    return result
+
+
+def compact_database():
+    # VACUUM cannot run inside a transaction
+    started = time.perf_counter()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if IS_SQLITE:
+            conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+            conn.execute(text("VACUUM"))
+            conn.execute(text("PRAGMA optimize"))
+        elif engine.dialect.name == "postgresql":
+            conn.execute(text("VACUUM (ANALYZE) " + ", ".join(t.name for t in Base.metadata.sorted_tables)))
+    retention_status["last_compaction"] = {
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+async def retention_loop():
+    last_compaction = time.monotonic()
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL)
+        try:
+            await run_in_threadpool(run_retention)
+            if COMPACT_INTERVAL and time.monotonic() - last_compaction >= COMPACT_INTERVAL:
+                await run_in_threadpool(compact_database)
+                last_compaction = time.monotonic()
+        except Exception as e:
+            logger.error(f"Retention pass failed: {e}")
+
+
+def storage_report():
+    db = SessionLocal()
+    try:
+        sessions, usage = storage_usage(db)
+    finally:
+        db.close()
+    hot = {file_id: size for files, _ in usage.values() for file_id, size in files}
+    return {
+        "sessions": len(sessions),
+        "hot_sessions": sum(1 for files, _ in usage.values() if files),
+        "cold_sessions": sum(1 for files, cold in usage.values() if cold and not files),
+        "hot_bytes": sum(hot.values()),
+        "cold_bytes": sum(cold for _, cold in usage.values()),
+        "policy": retention_policy.to_dict(),
+        "retention_interval_seconds": RETENTION_INTERVAL,
+        **retention_status,
+    }
+
+
+@api_router.get("/storage")
+async def get_storage():
+    return await run_in_threadpool(storage_report)
+
+
+@api_router.post("/storage/retention")
+async def run_retention_now(compact: bool = False):
+    try:
+        result = await run_in_threadpool(run_retention)
+        if compact:
+            await run_in_threadpool(compact_database)
+        return {**result, "compaction": retention_status["last_compaction"] if compact else None}
+    except Exception as e:
+        logger.error(f"Retention error: {e}")
+        raise HTTPException(status_code=500, detail=f"Retention failed: {str(e)}")
 
 
 app.include_router(api_router)
@@ -616,4 +1840,5 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Rows", "ETag"],
 )
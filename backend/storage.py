@@ -0,0 +1,464 @@
+"""Columnar on-disk storage for session datasets (Arrow IPC, memory-mapped),
+with a compressed cold tier for datasets that are not in use."""
+from pathlib import Path
+import fcntl, os, pickle, shutil, threading, uuid
+
+from lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+pa = LazyModule('pyarrow')
+pc = LazyModule('pyarrow.compute')
+
+
+COLD_CODEC, COLD_SUFFIX = "zstd", ".zst"
+COPY_BLOCK_BYTES = 1 << 20
+
+
+def _arrow_safe(df):
+    # Arrow needs string column names and one type per column; mixed object
+    # columns (e.g. ints and text from Excel) are stored as text.
+    df = df.copy(deep=False)
+    df.columns = [str(c) for c in df.columns]
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            if not pd.api.types.is_string_dtype(df[col].cat.categories.dtype):
+                df[col] = df[col].astype(df[col].cat.categories.dtype)
+        elif df[col].dtype == 'object':
+            try:
+                pa.array(df[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def _widen_type(a, b):
+    if pa.types.is_null(a):
+        return b
+    if pa.types.is_null(b) or a.equals(b):
+        return a
+    if pa.types.is_integer(a) and pa.types.is_integer(b):
+        if pa.types.is_signed_integer(a) == pa.types.is_signed_integer(b):
+            return a if a.bit_width >= b.bit_width else b
+        return pa.int64()
+    if pa.types.is_floating(a) and pa.types.is_floating(b):
+        return a if a.bit_width >= b.bit_width else b
+    if (pa.types.is_integer(a) or pa.types.is_floating(a)) and (pa.types.is_integer(b) or pa.types.is_floating(b)):
+        return pa.float64()
+    if pa.types.is_timestamp(a) and pa.types.is_timestamp(b):
+        return a
+    return pa.string()
+
+
+def _plain(type_):
+    return pa.string() if pa.types.is_dictionary(type_) else type_
+
+
+def _fits(column, type_):
+    # Whether every value of ``column`` survives a cast to ``type_``
+    if not pa.types.is_floating(type_) or column.type.equals(type_):
+        return True
+    if not (pa.types.is_floating(column.type) or pa.types.is_integer(column.type)):
+        return True
+    before = column.cast(pa.float64()).to_numpy()
+    after = column.cast(type_).cast(pa.float64()).to_numpy()
+    return np.array_equal(before, after, equal_nan=True)
+
+
+def _cast_exact(table, schema):
+    # Arrow's safe cast narrows float64 to float32 without an error, so a
+    # float column is checked to survive the round trip; ArrowInvalid sends
+    # the chunk through widening instead
+    for field in schema:
+        if field.name in table.schema.names and not _fits(table.column(field.name), field.type):
+            raise pa.ArrowInvalid(f"Values of '{field.name}' do not fit {field.type}")
+    return table.cast(schema)
+
+
+class DatasetWriter:
+    """Appends DataFrame chunks to one IPC file, widening column types when
+    a later chunk does not fit the schema picked from the first one.
+
+    Dictionary-encoded (categorical) columns share one dictionary per file
+    that only grows, so each batch adds a dictionary delta."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        self.schema = None
+        self.rows = 0
+        self._sink = None
+        self._writer = None
+        self._dictionaries = {}
+
+    def _open(self, schema):
+        self.schema = schema
+        self._sink = pa.OSFile(str(self.tmp), 'wb')
+        options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+        self._writer = pa.ipc.new_file(self._sink, schema, options=options)
+
+    def _encode(self, table):
+        # Re-encode categorical columns against the file's dictionary,
+        # appending values it has not seen yet
+        target = self.schema if self.schema is not None else table.schema
+        for i, field in enumerate(table.schema):
+            if field.name not in target.names or not pa.types.is_dictionary(target.field(field.name).type):
+                continue
+            values = table.column(i).cast(pa.string())
+            dictionary = self._dictionaries.get(field.name, pa.array([], pa.string()))
+            present = values.drop_null()
+            new = pc.unique(present.filter(pc.invert(pc.is_in(present, value_set=dictionary))))
+            if len(new):
+                dictionary = pa.concat_arrays([dictionary, new])
+                self._dictionaries[field.name] = dictionary
+            indices = pc.index_in(values, value_set=dictionary).cast(pa.int32())
+            chunks = [pa.DictionaryArray.from_arrays(c, dictionary) for c in indices.chunks]
+            type_ = pa.dictionary(pa.int32(), pa.string())
+            table = table.set_column(i, pa.field(field.name, type_), pa.chunked_array(chunks, type_))
+        return table
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer = self._sink = None
+
+    def _widen(self, incoming):
+        schema = pa.schema([
+            pa.field(f.name, _widen_type(f.type, incoming.field(f.name).type))
+            for f in self.schema
+        ])
+        for f in schema:
+            if not pa.types.is_dictionary(f.type):
+                self._dictionaries.pop(f.name, None)
+        self._close_writer()
+        old = self.tmp
+        self.tmp = self.path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with pa.memory_map(str(old), 'r') as source:
+            reader = pa.ipc.open_file(source)
+            self._open(schema)
+            for i in range(reader.num_record_batches):
+                self._writer.write_batch(reader.get_batch(i).cast(schema))
+        os.remove(old)
+
+    def copy_from(self, path):
+        # IPC files cannot be appended in place, so an append starts by
+        # copying the existing batches into the new file
+        with pa.memory_map(str(path), 'r') as source:
+            reader = pa.ipc.open_file(source)
+            self._open(reader.schema)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                self._writer.write_batch(batch)
+                self.rows += batch.num_rows
+                for name, column in zip(batch.schema.names, batch.columns):
+                    if pa.types.is_dictionary(column.type):
+                        self._dictionaries[name] = column.dictionary
+        return self
+
+    def write(self, df):
+        table = self._encode(pa.Table.from_pandas(_arrow_safe(df), preserve_index=False))
+        if self.schema is None:
+            self._open(table.schema)
+        elif not table.schema.equals(self.schema):
+            try:
+                table = _cast_exact(table, self.schema)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                self._widen(table.schema)
+                table = table.cast(self.schema)
+        self._writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self):
+        if self.schema is None:
+            self._open(pa.schema([]))
+        self._close_writer()
+        os.replace(self.tmp, self.path)
+        return self.path.stat().st_size
+
+    def abort(self):
+        self._close_writer()
+        try:
+            self.tmp.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class DatasetLock:
+    """Exclusive lock on one session's files, held by an append from the
+    copy of the dataset to its replacement. It is an ``flock`` on a
+    ``<session>.lock`` file, so it also excludes other worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, flags)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            except BaseException:
+                os.close(fd)
+                raise
+            # delete() removes the file once it holds the lock; a lock taken
+            # on the removed file would not exclude the next opener
+            try:
+                current = os.stat(self.path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                self._fd = fd
+                return True
+            os.close(fd)
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def _copy_stream(source, sink):
+    while True:
+        block = source.read(COPY_BLOCK_BYTES)
+        if not block:
+            break
+        sink.write(block)
+
+
+class DatasetStore:
+    """Session files live in ``root`` while hot. ``freeze`` moves them to
+    ``cold_root`` as compressed copies; reading a frozen session moves it
+    back first."""
+
+    def __init__(self, root, cold_root=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.cold_root = Path(cold_root) if cold_root else self.root / "cold"
+        self.cold_root.mkdir(parents=True, exist_ok=True)
+        self._tier_lock = threading.Lock()
+
+    def path_for(self, session_id):
+        return self.root / f"{session_id}.arrow"
+
+    def exists(self, session_id):
+        return self.path_for(session_id).exists() or self.is_cold(session_id)
+
+    def _cold_path(self, path):
+        return self.cold_root / f"{path.name}{COLD_SUFFIX}"
+
+    def is_cold(self, session_id):
+        return self._cold_path(self.path_for(session_id)).exists()
+
+    def _compress(self, path):
+        # False when the file was replaced while it was being compressed
+        before = path.stat()
+        cold = self._cold_path(path)
+        tmp = cold.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            with pa.OSFile(str(path), 'rb') as source, pa.CompressedOutputStream(str(tmp), COLD_CODEC) as sink:
+                _copy_stream(source, sink)
+            after = path.stat()
+            if (before.st_ino, before.st_mtime_ns) != (after.st_ino, after.st_mtime_ns):
+                tmp.unlink()
+                return False
+            os.replace(tmp, cold)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return True
+
+    def freeze(self, session_id):
+        """Moves a session's files to cold storage. Returns the compressed
+        size, or None when the session is not hot, an append holds its lock
+        or it changed meanwhile."""
+        if not self.path_for(session_id).exists():
+            return None
+        # An append replaces the files, possibly after they were compressed;
+        # the lock also keeps other workers' retention passes out
+        lock = self.lock(session_id)
+        if not lock.acquire(blocking=False):
+            return None
+        try:
+            with self._tier_lock:
+                return self._freeze(session_id)
+        finally:
+            lock.release()
+
+    def _freeze(self, session_id):
+        if not self.path_for(session_id).exists():
+            return None
+        hot = [p for p in self._files(session_id) if p.exists()]
+        written = []
+        try:
+            for path in hot:
+                if not self._compress(path):
+                    break
+                written.append(self._cold_path(path))
+        finally:
+            if len(written) < len(hot):
+                for cold in written:
+                    cold.unlink(missing_ok=True)
+        if len(written) < len(hot):
+            # Replaced meanwhile; the session stays hot
+            return None
+        # Readers that already mapped a file keep their view of it
+        for path in hot:
+            path.unlink(missing_ok=True)
+        return sum(cold.stat().st_size for cold in written)
+
+    def thaw(self, session_id):
+        """Moves a frozen session back to hot storage; returns whether it
+        was frozen."""
+        if self.path_for(session_id).exists():
+            return False
+        with self._tier_lock:
+            if self.path_for(session_id).exists() or not self.is_cold(session_id):
+                return False
+            # The Arrow file goes last so a hot .arrow always has its sidecars
+            for path in reversed(self._files(session_id)):
+                cold = self._cold_path(path)
+                if not cold.exists():
+                    continue
+                tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+                try:
+                    with pa.CompressedInputStream(pa.OSFile(str(cold), 'rb'), COLD_CODEC) as source, pa.OSFile(str(tmp), 'wb') as sink:
+                        _copy_stream(source, sink)
+                    os.replace(tmp, path)
+                except BaseException:
+                    tmp.unlink(missing_ok=True)
+                    raise
+            for path in self._files(session_id):
+                self._cold_path(path).unlink(missing_ok=True)
+            return True
+
+    def usage(self, session_id):
+        """Returns ``(hot, cold_bytes)``: ``hot`` lists ``(file_id, size)``
+        per hot file, where ``file_id`` is the same for hard-linked copies."""
+        hot, cold_bytes = [], 0
+        for path in self._files(session_id):
+            try:
+                st = path.stat()
+                hot.append(((st.st_dev, st.st_ino), st.st_size))
+            except FileNotFoundError:
+                pass
+            try:
+                cold_bytes += self._cold_path(path).stat().st_size
+            except FileNotFoundError:
+                pass
+        return hot, cold_bytes
+
+    def save(self, session_id, df):
+        table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+        path = self.path_for(session_id)
+        tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        # Uncompressed IPC so reads can map the file instead of decoding it
+        with pa.OSFile(str(tmp), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+        return path.stat().st_size
+
+    def writer(self, session_id):
+        return DatasetWriter(self.path_for(session_id))
+
+    def _files(self, session_id):
+        return (self.path_for(session_id), self.root / f"{session_id}.rowhash.npy",
+                self.root / f"{session_id}.profile.pkl")
+
+    def link(self, source_id, session_id):
+        """Makes ``session_id`` share the stored files of ``source_id``.
+        Hard links count the references: deleting one session only drops
+        its names, and the data goes when the last session does. Appends
+        replace a session's files, so they never change the shared copy."""
+        self.thaw(source_id)
+        linked = []
+        try:
+            for src, dst in zip(self._files(source_id), self._files(session_id)):
+                if src.suffix != ".arrow" and not src.exists():
+                    continue
+                try:
+                    os.link(src, dst)
+                except FileNotFoundError:
+                    raise
+                except OSError:
+                    # No hard links on this filesystem; fall back to a copy
+                    shutil.copyfile(src, dst)
+                linked.append(dst)
+        except BaseException:
+            for path in linked:
+                path.unlink(missing_ok=True)
+            raise
+
+    def lock(self, session_id):
+        return DatasetLock(self.root / f"{session_id}.lock")
+
+    def appender(self, session_id):
+        self.thaw(session_id)
+        path = self.path_for(session_id)
+        return DatasetWriter(path).copy_from(path)
+
+    def save_state(self, session_id, types, hashes, profiler):
+        """Keeps what an append needs to continue an upload: the column type
+        plan, the sorted row-hash index and the profile accumulator."""
+        for suffix, dump in (
+            (".rowhash.npy", lambda f: np.save(f, hashes)),
+            (".profile.pkl", lambda f: pickle.dump({"types": types, "profiler": profiler}, f, pickle.HIGHEST_PROTOCOL)),
+        ):
+            path = self.root / f"{session_id}{suffix}"
+            tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            with open(tmp, 'wb') as f:
+                dump(f)
+            os.replace(tmp, path)
+
+    def load_state(self, session_id):
+        """Returns ``(types, hashes, profiler)``, or None for sessions stored
+        before the state was kept."""
+        self.thaw(session_id)
+        try:
+            hashes = np.load(self.root / f"{session_id}.rowhash.npy")
+            with open(self.root / f"{session_id}.profile.pkl", 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        return state["types"], hashes, state["profiler"]
+
+    def read_table(self, session_id, columns=None):
+        self.thaw(session_id)
+        source = pa.memory_map(str(self.path_for(session_id)), 'r')
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        return table
+
+    def load(self, session_id, columns=None):
+        return self.read_table(session_id, columns).to_pandas()
+
+    def delete(self, session_id):
+        # Waits for a running append, which would otherwise put the
+        # dataset file back after it was removed
+        with self.lock(session_id) as lock:
+            for path in self._files(session_id):
+                path.unlink(missing_ok=True)
+                self._cold_path(path).unlink(missing_ok=True)
+            lock.path.unlink(missing_ok=True)
@@ -0,0 +1,114 @@
+"""Incremental parsing of the analysis JSON as it streams from the model."""
+import json
+
+ITEM_SECTIONS = ("analysis_summary",)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _section_events(key, value):
+    if key in ITEM_SECTIONS and isinstance(value, list):
+        return [(f"{key}_item", {"index": i, "value": v}) for i, v in enumerate(value)]
+    return [(key, value)]
+
+
+def iter_sections(analysis):
+    for key, value in analysis.items():
+        yield from _section_events(key, value)
+
+
+class SectionParser:
+    """Feed it text as it arrives; it returns ``(event, data)`` pairs for
+    every top-level member of the object that has been closed, and for
+    each finished item of the list sections in ITEM_SECTIONS."""
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.done = False
+        self.member_start = None
+        self.key = None
+        self.key_start = None
+        self.item_start = None
+        self.item_index = 0
+
+    def feed(self, text):
+        events = []
+        self.buf += text
+        while self.pos < len(self.buf) and not self.done:
+            ch = self.buf[self.pos]
+            i = self.pos
+            self.pos += 1
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.key is None and self.key_start is not None:
+                        self.key = json.loads(self.buf[self.key_start:i + 1])
+                continue
+            if ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self.key is None:
+                    self.key_start = i
+            elif ch in '{[':
+                if self.depth == 0:
+                    if ch == '{':
+                        self.depth = 1
+                        self.member_start = i + 1
+                    continue
+                self.depth += 1
+                if self.depth == 2 and ch == '[' and self.key in ITEM_SECTIONS:
+                    self.item_start = i + 1
+                    self.item_index = 0
+            elif ch in '}]':
+                if self.depth == 0:
+                    continue
+                if self.depth == 2 and ch == ']' and self.item_start is not None:
+                    self._emit_item(events, i)
+                    self.item_start = None
+                self.depth -= 1
+                if self.depth == 0:
+                    self._emit_member(events, i)
+                    self.done = True
+            elif ch == ',':
+                if self.depth == 1:
+                    self._emit_member(events, i)
+                    self.member_start = i + 1
+                elif self.depth == 2 and self.item_start is not None:
+                    self._emit_item(events, i)
+                    self.item_start = i + 1
+        return events
+
+    def _emit_member(self, events, end):
+        text = self.buf[self.member_start:end].strip()
+        self.key = self.key_start = None
+        if not text:
+            return
+        try:
+            member = json.loads("{" + text + "}")
+        except json.JSONDecodeError:
+            return
+        for key, value in member.items():
+            if key in ITEM_SECTIONS:
+                # Items were already emitted one by one
+                continue
+            events.extend(_section_events(key, value))
+
+    def _emit_item(self, events, end):
+        text = self.buf[self.item_start:end].strip()
+        if not text:
+            return
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            return
+        events.append((f"{self.key}_item", {"index": self.item_index, "value": value}))
+        self.item_index += 1
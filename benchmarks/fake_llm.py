@@ -0,0 +1,68 @@
+"""A deterministic stand-in for the AsyncOpenAI client.
+
+It answers every chat completion with the same analysis for a given
+dataset shape, optionally after a fixed delay, so benchmark runs measure
+the server and not the network.
+"""
+import asyncio, json
+from types import SimpleNamespace
+
+
+def fake_analysis(columns):
+    plan = {"metrics": [{"column": columns["metric"], "agg": "sum", "as": "total"}]}
+    chart_type = "bar"
+    if columns.get("time"):
+        plan["time"] = {"column": columns["time"], "freq": "month"}
+        chart_type = "line"
+    if columns.get("group"):
+        plan["group_by"] = [columns["group"]]
+        plan["limit"] = 10
+    return {
+        "query_understood": "Benchmark query",
+        "analysis_type": "descriptive",
+        "visualization": {"chart_type": chart_type, "reason": "benchmark", "title": "Benchmark chart", "plan": plan},
+        "analysis_summary": ["Finding one", "Finding two", "Finding three"],
+        "forecast": {"available": False},
+        "agent_insight": "Deterministic benchmark insight.",
+        "recommendations": ["Recommendation one", "Recommendation two"],
+    }
+
+
+class _Stream:
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage = usage
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for i in range(0, len(self.text), 64):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.text[i:i + 64]))], usage=None)
+        if self.usage is not None:
+            yield SimpleNamespace(choices=[], usage=self.usage)
+
+
+class _Completions:
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, model=None, messages=(), temperature=None, stream=False, **kwargs):
+        self.client.calls += 1
+        if self.client.latency:
+            await asyncio.sleep(self.client.latency)
+        text = json.dumps(fake_analysis(self.client.columns))
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(text) // 4,
+                                total_tokens=prompt_tokens + len(text) // 4)
+        if stream:
+            return _Stream(text, usage if (kwargs.get("stream_options") or {}).get("include_usage") else None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+
+
+class FakeOpenAI:
+    def __init__(self, columns, latency=0.0):
+        self.columns = columns
+        self.latency = latency
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=_Completions(self))
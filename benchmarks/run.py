@@ -0,0 +1,237 @@
+"""Offline benchmarks for the upload, profiling, query, data and report paths.
+
+The FastAPI app runs in-process against a throwaway database and dataset
+directory, with a deterministic fake OpenAI client. For each operation the
+run records latency percentiles, throughput and peak RSS, and compares them
+with benchmarks/baselines.json.
+
+    python benchmarks/run.py                        # default suite, fails on regression
+    python benchmarks/run.py --sizes 1m,10m --shapes narrow --formats csv
+    python benchmarks/run.py --update-baselines     # record the current numbers
+"""
+from pathlib import Path
+import argparse, json, os, platform, resource, shutil, sys, tempfile, time
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent / "backend"
+sys.path.insert(0, str(BENCH_DIR))
+
+from synthetic import SHAPES, PLAN_COLUMNS, XLSX_MAX_ROWS, dataset_path, parse_rows
+from fake_llm import FakeOpenAI
+
+BASELINES = BENCH_DIR / "baselines.json"
+
+
+def read_status_kb(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class PeakRSS:
+    """Peak resident memory while an operation runs. On Linux the kernel's
+    high-water mark is reset first; elsewhere this falls back to the
+    process-lifetime maximum."""
+
+    def reset(self):
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+    def peak_mb(self):
+        hwm = read_status_kb("VmHWM")
+        if hwm is None:
+            hwm = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform == "darwin":
+                hwm //= 1024
+        return hwm / 1024
+
+
+def measure(fn, repeat, units=1):
+    """Calls ``fn(i)`` ``repeat`` times; ``units`` is what one call processes
+    (rows or requests) for the throughput figure."""
+    rss = PeakRSS()
+    rss.reset()
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - start)
+    ms = np.array(latencies) * 1000
+    return {
+        "runs": repeat,
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "throughput_per_s": round(units * repeat / max(sum(latencies), 1e-9), 2),
+        "peak_rss_mb": round(rss.peak_mb(), 1),
+    }
+
+
+def check(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.request.method} {response.request.url} -> {response.status_code}: {response.text[:300]}")
+    return response
+
+
+def wait_ready(client, timeout=60):
+    # Measure a warmed-up replica, the state a load balancer routes to
+    deadline = time.monotonic() + timeout
+    while client.get("/api/ready", params={"warm": "true"}).status_code != 200:
+        if time.monotonic() > deadline:
+            raise RuntimeError("/api/ready did not report a warm server")
+        time.sleep(0.05)
+
+
+def bench_dataset(server, client, path, shape, rows, repeat, upload_repeat):
+    results = {}
+    content_type = "text/csv" if path.suffix == ".csv" else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    sessions = []
+
+    def upload(i):
+        with open(path, "rb") as f:
+            r = check(client.post("/api/upload", files={"file": (path.name, f, content_type)}))
+        sessions.append(r.json()["id"])
+    # Every run uploads the same bytes, which would take the reuse path
+    # after the first; switch it off so upload_file measures ingestion
+    reuse = server.reuse_stored_upload
+    server.reuse_stored_upload = lambda content_hash, session_id: None
+    try:
+        results["upload_file"] = measure(upload, upload_repeat, units=rows)
+    finally:
+        server.reuse_stored_upload = reuse
+    results["upload_reused"] = measure(upload, upload_repeat, units=rows)
+    session_id = sessions[-1]
+
+    df = server.dataset_store.load(session_id)
+    results["profile_dataframe"] = measure(lambda i: server.profile_dataframe(df), upload_repeat, units=len(df))
+    del df
+
+    server.openai_client = FakeOpenAI(PLAN_COLUMNS[shape])
+    query_ids = []
+
+    def query(i):
+        r = check(client.post("/api/query", json={"session_id": session_id, "query": f"benchmark question {i}"}))
+        query_ids.append(r.json()["id"])
+    results["process_query"] = measure(query, repeat)
+
+    metric = PLAN_COLUMNS[shape]["metric"]
+    cursors = {}
+
+    def page(i):
+        # Alternate file-order and sorted pages, each following its own cursor
+        params = {"limit": 500} if i % 2 == 0 else {"limit": 500, "sort": metric, "order": "desc"}
+        key = i % 2
+        if cursors.get(key):
+            params["cursor"] = cursors[key]
+        r = check(client.get(f"/api/session/{session_id}/data", params=params))
+        cursors[key] = r.json()["next_cursor"]
+    results["get_session_data"] = measure(page, repeat)
+
+    results["download_report"] = measure(lambda i: check(client.get(f"/api/report/{query_ids[i]}/download")), repeat)
+
+    for sid in sessions:
+        client.delete(f"/api/session/{sid}")
+    return results
+
+
+def compare(results, baselines, tolerance, rss_tolerance, min_ms):
+    regressions = []
+    for key, r in results.items():
+        base = baselines.get(key)
+        if not base:
+            continue
+        if r["p95_ms"] > base["p95_ms"] * (1 + tolerance) and r["p95_ms"] - base["p95_ms"] > min_ms:
+            regressions.append(f"{key}: p95 {r['p95_ms']} ms vs baseline {base['p95_ms']} ms")
+        if r["peak_rss_mb"] > base["peak_rss_mb"] * (1 + rss_tolerance):
+            regressions.append(f"{key}: peak RSS {r['peak_rss_mb']} MB vs baseline {base['peak_rss_mb']} MB")
+    return regressions
+
+
+def run_suite(server, client, args):
+    results = {}
+    for rows in [parse_rows(s) for s in args.sizes.split(",")]:
+        for shape in args.shapes.split(","):
+            for ext in args.formats.split(","):
+                if ext == "xlsx" and rows > min(args.xlsx_max_rows, XLSX_MAX_ROWS):
+                    continue
+                path = dataset_path(args.data_dir, shape, rows, ext)
+                label = f"{shape}-{rows}.{ext}"
+                print(f"-- {label} ({path.stat().st_size / 2**20:.1f} MB)", flush=True)
+                upload_repeat = 1 if rows >= 1_000_000 else args.upload_repeat
+                for op, r in bench_dataset(server, client, path, shape, rows, args.repeat, upload_repeat).items():
+                    results[f"{op}/{label}"] = r
+                    print(f"   {op:<18} p50 {r['p50_ms']:>10.2f} ms  p95 {r['p95_ms']:>10.2f} ms  "
+                          f"{r['throughput_per_s']:>12.2f}/s  peak {r['peak_rss_mb']:>8.1f} MB", flush=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10k,100k", help="comma-separated row counts, e.g. 10k,1m,10m")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help="any of " + ", ".join(SHAPES))
+    parser.add_argument("--formats", default="csv,xlsx")
+    parser.add_argument("--xlsx-max-rows", type=parse_rows, default=10_000, help="largest size also run as xlsx")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of the query, data and report operations")
+    parser.add_argument("--upload-repeat", type=int, default=3, help="uploads per dataset (1 from 1M rows up)")
+    parser.add_argument("--data-dir", default=str(BENCH_DIR / ".data"), help="where generated datasets are kept")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baselines", default=str(BASELINES))
+    parser.add_argument("--update-baselines", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed p95 latency increase (0.5 = +50%%)")
+    parser.add_argument("--rss-tolerance", type=float, default=0.25, help="allowed peak RSS increase")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="ignore latency regressions smaller than this")
+    args = parser.parse_args(argv)
+
+    # The app reads its configuration at import time
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ["DATASET_DIR"] = f"{workdir}/datasets"
+    os.environ["REPORT_DIR"] = f"{workdir}/reports"
+    os.environ["REPORT_PRERENDER"] = "false"
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    from fastapi.testclient import TestClient
+
+    try:
+        with TestClient(server.app) as client:
+            wait_ready(client)
+            results = run_suite(server, client, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "results": results,
+        }, indent=2))
+
+    baselines_path = Path(args.baselines)
+    baselines = json.loads(baselines_path.read_text()) if baselines_path.exists() else {}
+    if args.update_baselines:
+        baselines.update({k: {"p95_ms": r["p95_ms"], "peak_rss_mb": r["peak_rss_mb"]} for k, r in results.items()})
+        baselines_path.write_text(json.dumps(dict(sorted(baselines.items())), indent=2) + "\n")
+        print(f"Updated {len(results)} baselines in {baselines_path}")
+        return 0
+
+    regressions = compare(results, baselines, args.tolerance, args.rss_tolerance, args.min_ms)
+    for line in regressions:
+        print("REGRESSION", line)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
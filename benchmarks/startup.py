@@ -0,0 +1,76 @@
+"""Cold-start budget for the backend.
+
+Each run starts a fresh interpreter that imports ``server``, runs the
+lifespan startup against a throwaway database and calls ``/api/ready``.
+It reports the median import time and time to the first ready response,
+and fails when either is over budget or when a module meant to load
+lazily (pandas, NumPy, PyArrow, the OpenAI SDK, ReportLab) was imported
+on the startup path.
+
+    python benchmarks/startup.py                     # 5 runs, default budgets
+    python benchmarks/startup.py --import-budget 0.5 --ready-budget 0.6
+"""
+from pathlib import Path
+import argparse, json, os, statistics, subprocess, sys, tempfile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+DEFERRED_MODULES = ("pandas", "numpy", "pyarrow", "openai", "reportlab")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+loaded = sorted(m for m in %r if m in sys.modules)
+from fastapi.testclient import TestClient
+with TestClient(server.app) as client:
+    status = client.get("/api/ready").status_code
+    ready = time.perf_counter()
+print(json.dumps({"import_s": imported - started, "ready_s": ready - started, "status": status, "loaded": loaded}))
+"""
+
+
+def probe():
+    workdir = tempfile.mkdtemp(prefix="startup-")
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{workdir}/startup.db",
+               DATASET_DIR=f"{workdir}/datasets",
+               REPORT_DIR=f"{workdir}/reports",
+               # Warm-up would import the deferred modules in the background
+               WARMUP="false")
+    env.setdefault("OPENAI_API_KEY", "startup")
+    out = subprocess.run([sys.executable, "-c", PROBE % (DEFERRED_MODULES,)], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=1.4, help="seconds to import server (median)")
+    parser.add_argument("--ready-budget", type=float, default=1.6, help="seconds from start to a 200 from /api/ready (median)")
+    args = parser.parse_args(argv)
+
+    runs = [probe() for _ in range(args.runs)]
+    import_s = statistics.median(r["import_s"] for r in runs)
+    ready_s = statistics.median(r["ready_s"] for r in runs)
+    print(f"import server   median {import_s * 1000:8.1f} ms  (budget {args.import_budget * 1000:.0f} ms)")
+    print(f"first ready     median {ready_s * 1000:8.1f} ms  (budget {args.ready_budget * 1000:.0f} ms)")
+
+    failures = []
+    if import_s > args.import_budget:
+        failures.append(f"import took {import_s:.3f}s")
+    if ready_s > args.ready_budget:
+        failures.append(f"readiness took {ready_s:.3f}s")
+    if any(r["status"] != 200 for r in runs):
+        failures.append("/api/ready did not return 200")
+    loaded = sorted({m for r in runs for m in r["loaded"]})
+    if loaded:
+        failures.append(f"imported on the startup path: {', '.join(loaded)}")
+    for line in failures:
+        print("OVER BUDGET", line)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Deterministic synthetic datasets for the benchmarks.
+
+Every shape is generated in fixed-size blocks from a seeded generator, so
+a 10M-row file never has to exist in memory and reruns produce the same
+bytes.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BLOCK_ROWS = 250_000
+# openpyxl is slow and a sheet holds at most 1,048,576 rows
+XLSX_MAX_ROWS = 200_000
+
+REGIONS = np.array(["North", "South", "East", "West", "Central", "Pacific", "Mountain", "Atlantic"])
+WORDS = np.array("revenue growth churn customer order shipment delayed returned premium basic "
+                 "upgrade refund review excellent poor average support ticket renewal discount "
+                 "invoice payment overdue loyal new region channel online retail partner".split())
+
+
+def _dates(rng, n, start="2020-01-01", days=1825):
+    return pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days, n), unit="D")
+
+
+def narrow_block(rng, start, n):
+    units = rng.integers(1, 500, n)
+    price = rng.gamma(2.0, 25.0, n).round(2)
+    return pd.DataFrame({
+        "order_date": _dates(rng, n).strftime("%Y-%m-%d"),
+        "region": REGIONS[rng.integers(0, len(REGIONS), n)],
+        "product": np.char.add("SKU-", rng.integers(0, 50, n).astype(str)),
+        "units": units,
+        "price": price,
+        "revenue": (units * price).round(2),
+    })
+
+
+def wide_block(rng, start, n, numeric=96):
+    df = pd.DataFrame(rng.normal(100, 15, (n, numeric)).round(3), columns=[f"m{i:03d}" for i in range(numeric)])
+    df.insert(0, "id", np.arange(start, start + n))
+    for i in range(4):
+        df[f"segment_{i}"] = REGIONS[rng.integers(0, len(REGIONS), n)]
+    return df
+
+
+def text_block(rng, start, n):
+    lengths = rng.integers(5, 20, n)
+    words = WORDS[rng.integers(0, len(WORDS), lengths.sum())]
+    comments = [" ".join(w) for w in np.split(words, np.cumsum(lengths)[:-1])]
+    return pd.DataFrame({
+        "ticket_id": np.char.add("T", np.arange(start, start + n).astype(str)),
+        "customer": np.char.add("customer_", rng.integers(0, max(n // 3, 1), n).astype(str)),
+        "email": np.char.add(np.char.add("user", rng.integers(0, 10**6, n).astype(str)), "@example.com"),
+        "category": WORDS[rng.integers(0, 12, n)],
+        "comment": comments,
+        "score": rng.integers(1, 6, n),
+    })
+
+
+def dates_block(rng, start, n):
+    base = _dates(rng, n)
+    return pd.DataFrame({
+        "created": base.strftime("%Y-%m-%d"),
+        "updated": (base + pd.to_timedelta(rng.integers(0, 86400, n), unit="s")).strftime("%Y-%m-%d %H:%M:%S"),
+        "shipped": (base + pd.to_timedelta(rng.integers(1, 30, n), unit="D")).strftime("%m/%d/%Y"),
+        "due": (base + pd.to_timedelta(rng.integers(30, 90, n), unit="D")).strftime("%d %b %Y"),
+        "amount": rng.gamma(2.0, 50.0, n).round(2),
+    })
+
+
+SHAPES = {"narrow": narrow_block, "wide": wide_block, "text": text_block, "dates": dates_block}
+
+# Columns the fake model plans its chart over, per shape
+PLAN_COLUMNS = {
+    "narrow": {"group": "region", "metric": "revenue", "time": "order_date"},
+    "wide": {"group": "segment_0", "metric": "m000", "time": None},
+    "text": {"group": "category", "metric": "score", "time": None},
+    "dates": {"group": None, "metric": "amount", "time": "created"},
+}
+
+
+def parse_rows(text):
+    text = text.lower()
+    for suffix, scale in (("m", 1_000_000), ("k", 1_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * scale)
+    return int(text)
+
+
+def dataset_path(data_dir, shape, rows, ext, seed=0):
+    """Returns the file for ``shape`` at ``rows`` rows, generating it once."""
+    if ext == "xlsx" and rows > XLSX_MAX_ROWS:
+        raise ValueError(f"xlsx datasets are limited to {XLSX_MAX_ROWS} rows")
+    path = Path(data_dir) / f"{shape}-{rows}-s{seed}.{ext}"
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    blocks = (SHAPES[shape](rng, start, min(BLOCK_ROWS, rows - start)) for start in range(0, rows, BLOCK_ROWS))
+    tmp = path.with_suffix(f".tmp.{ext}")
+    if ext == "csv":
+        with open(tmp, "w", newline="") as out:
+            for i, block in enumerate(blocks):
+                block.to_csv(out, index=False, header=i == 0)
+    else:
+        pd.concat(blocks, ignore_index=True).to_excel(tmp, index=False)
+    tmp.replace(path)
+    return path
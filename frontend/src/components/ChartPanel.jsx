@@ -166,6 +166,11 @@ export const ChartPanel = ({ visualization, forecast }) => {
       {visualization?.reason && (
         <p className="text-xs text-slate-500 mt-3 italic">{visualization.reason}</p>
       )}
+      {visualization?.original_points > chartData.length && (
+        <p className="text-xs text-slate-500 mt-1" data-testid="chart-sampling">
+          Showing {chartData.length.toLocaleString()} of {visualization.original_points.toLocaleString()} points
+        </p>
+      )}
     </GlassCard>
   );
 };
@@ -0,0 +1,42 @@
+"""Shared fixtures. The backend reads its configuration when ``server`` is
+imported, so the environment points at a throwaway directory first."""
+from pathlib import Path
+import os, sys, tempfile
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+WORKDIR = tempfile.mkdtemp(prefix="analyst-tests-")
+
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{WORKDIR}/test.db",
+    DATASET_DIR=f"{WORKDIR}/datasets",
+    REPORT_DIR=f"{WORKDIR}/reports",
+    OPENAI_API_KEY="test",
+    WARMUP="false",
+    REPORT_PRERENDER="false",
+)
+sys.path[:0] = [str(ROOT / "backend"), str(ROOT / "benchmarks")]
+
+
+@pytest.fixture(scope="session")
+def server():
+    import server
+    return server
+
+
+@pytest.fixture(scope="session")
+def client(server):
+    from fastapi.testclient import TestClient
+    with TestClient(server.app) as c:
+        yield c
+
+
+@pytest.fixture
+def upload(client):
+    """Uploads CSV text and returns the session."""
+    def _upload(text, filename="data.csv"):
+        response = client.post("/api/upload", files={"file": (filename, text.encode(), "text/csv")})
+        assert response.status_code == 200, response.text
+        return response.json()
+    return _upload
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from downsample import downsample_chart, lttb_indices, minmax_indices
+
+
+def wave(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.sin(np.linspace(0, 20, n)) + rng.normal(scale=0.05, size=n)
+
+
+@pytest.mark.parametrize("n_out", [3, 10, 500])
+def test_lttb_keeps_both_ends_in_order(n_out):
+    y = wave(10_000)
+    picked = lttb_indices(np.arange(10_000, dtype=float), y, n_out)
+    assert len(picked) == n_out
+    assert picked[0] == 0 and picked[-1] == 9_999
+    assert (np.diff(picked) > 0).all()
+
+
+def test_lttb_keeps_peaks():
+    y = wave(10_000)
+    y[[1_234, 7_001]] = [40.0, -40.0]
+    picked = lttb_indices(np.arange(10_000, dtype=float), y, 200)
+    assert {1_234, 7_001} <= set(picked.tolist())
+
+
+def test_lttb_leaves_short_series_alone():
+    assert lttb_indices(np.arange(5, dtype=float), np.ones(5), 10).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_minmax_keeps_extremes_and_ends():
+    rng = np.random.default_rng(1)
+    x = rng.uniform(0, 100, size=5_000)
+    y = rng.normal(size=5_000)
+    y[[42, 4_321]] = [25.0, -25.0]
+    order = np.argsort(x, kind="stable")
+    picked = minmax_indices(order, y, 100)
+    assert len(picked) <= 100
+    assert {42, 4_321, order[0], order[-1]} <= set(picked.tolist())
+
+
+def line_chart(n, y_keys, chart_type="line"):
+    y = {key: wave(n, seed) for seed, key in enumerate(y_keys)}
+    data = [{"t": i, **{key: float(y[key][i]) for key in y_keys}} for i in range(n)]
+    return {"chart_type": chart_type, "x_key": "t", "y_keys": list(y_keys), "data": data}
+
+
+def test_chart_is_reduced_and_reports_its_size():
+    chart = line_chart(5_000, ["v"])
+    chart["data"][2_500]["v"] = 99.0
+    reduced = downsample_chart(chart, 400)
+    assert len(reduced["data"]) == 400
+    assert reduced["original_points"] == 5_000 and reduced["sampling"] == "lttb"
+    assert reduced["data"][0] == chart["data"][0] and reduced["data"][-1] == chart["data"][-1]
+    assert {"t": 2_500, "v": 99.0} in reduced["data"]
+    assert len(chart["data"]) == 5_000
+
+
+def test_every_series_shares_the_budget():
+    chart = line_chart(6_000, ["a", "b", "c"])
+    chart["data"][100]["a"] = 50.0
+    chart["data"][3_000]["b"] = -50.0
+    chart["data"][5_900]["c"] = 50.0
+    reduced = downsample_chart(chart, 300)
+    assert len(reduced["data"]) <= 300
+    assert {row["t"] for row in reduced["data"]} >= {0, 100, 3_000, 5_900, 5_999}
+    assert reduced["original_points"] == 6_000
+
+
+def test_scatter_uses_minmax():
+    chart = line_chart(3_000, ["v"], chart_type="scatter")
+    reduced = downsample_chart(chart, 200)
+    assert reduced["sampling"] == "minmax" and len(reduced["data"]) <= 200
+
+
+@pytest.mark.parametrize("chart", [
+    line_chart(100, ["v"]),
+    line_chart(5_000, ["v"], chart_type="bar"),
+    {"chart_type": "line", "data": None},
+])
+def test_other_charts_are_untouched(chart):
+    assert downsample_chart(chart, 400) is chart
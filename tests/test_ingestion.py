@@ -0,0 +1,113 @@
+from functools import partial
+import random
+
+import pandas as pd
+import pytest
+
+import ingestion
+
+
+def column(session, name):
+    return next(c for c in session["columns"] if c["name"] == name)
+
+
+def test_upload_with_utc_timestamps(client, upload):
+    session = upload("ts,sales\n"
+                     "2024-01-01T00:00:00Z,1\n"
+                     "2024-01-02T12:30:00Z,2\n"
+                     "2024-01-03T00:00:00Z,3\n")
+    ts = column(session, "ts")
+    assert "datetime64" in ts["type"] and "UTC" in ts["type"]
+    assert ts["unique_count"] == 3
+    assert ts["min"].startswith("2024-01-01 00:00:00")
+    assert ts["max"].startswith("2024-01-03 00:00:00")
+    assert session["date_range"]["column"] == "ts"
+
+    data = client.get(f"/api/session/{session['id']}/data").json()
+    assert data["total_rows"] == 3
+
+
+@pytest.fixture
+def small_chunks(server, monkeypatch):
+    monkeypatch.setattr(server, "read_chunks", partial(ingestion.read_chunks, chunk_rows=1000))
+
+
+def test_stray_labels_keep_a_column_as_text(client, upload):
+    values = [str(i) for i in range(5000)]
+    values[100] = values[2500] = values[4900] = "unknown"
+    session = upload("x\n" + "\n".join(values) + "\n")
+    assert column(session, "x")["type"] in ("str", "string", "category", "object")
+    assert column(session, "x")["null_count"] == 0
+    assert session["data_quality"]["coerced_values"] == {}
+
+
+def test_dates_outside_the_sampled_format_are_kept(client, upload):
+    rng = random.Random(0)
+    values = [f"{i % 12 + 1:02d}/{i % 28 + 1:02d}/2023" + (" 10:30" if rng.random() < 0.035 else "") for i in range(5000)]
+    session = upload("d\n" + "\n".join(values) + "\n")
+    assert "datetime64" in column(session, "d")["type"]
+    assert column(session, "d")["null_count"] == 0
+
+
+def test_format_change_after_the_first_chunk(client, upload, small_chunks):
+    values = ([f"{i % 12 + 1:02d}/{i % 28 + 1:02d}/2023" for i in range(1000)]
+              + [f"2023-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in range(1000)])
+    session = upload("d,n\n" + "\n".join(f"{v},{i}" for i, v in enumerate(values)) + "\n")
+    assert "datetime64" in column(session, "d")["type"]
+    assert column(session, "d")["null_count"] == 0
+    assert session["data_quality"]["coerced_values"] == {}
+
+
+def test_values_coerced_in_later_chunks_are_reported(client, upload, small_chunks):
+    values = [f"2023-01-{i % 28 + 1:02d}" for i in range(2000)]
+    values[1500] = "not a date"
+    session = upload("d\n" + "\n".join(values) + "\n")
+    assert "datetime64" in column(session, "d")["type"]
+    assert column(session, "d")["null_count"] == 1
+    assert session["data_quality"]["coerced_values"] == {"d": 1}
+
+
+def test_mixed_utc_offsets_parse_as_utc(client, upload):
+    session = upload("ts,v\n2024-01-01T00:00:00Z,1\n2024-01-02T05:00:00+02:00,2\n2024-01-03T00:00:00-05:00,3\n")
+    ts = column(session, "ts")
+    assert "UTC" in ts["type"] and ts["null_count"] == 0
+    assert ts["max"].startswith("2024-01-03 05:00:00")
+
+
+def test_fractional_values_after_round_chunks_are_kept(client, upload, small_chunks):
+    # Integer-like floats with blanks fit float32; the later chunk does not
+    first = ["" if i % 10 == 0 else str(i) for i in range(1000)]
+    later = ["123456789.123", "0.1"] * 500
+    session = upload("n,price\n" + "".join(f"{i},{v}\n" for i, v in enumerate(first + later)))
+    assert column(session, "price")["type"] == "float64"
+    assert column(session, "price")["null_count"] == 100
+    data = client.get(f"/api/session/{session['id']}/data",
+                      params={"filter": "n:ge:1000", "limit": 2}).json()["data"]
+    assert [row["price"] for row in data] == [123456789.123, 0.1]
+
+
+def test_compact_frame_dtypes():
+    df = pd.DataFrame({
+        "small": [1, 2, 3, 4],
+        "exact": [0.5, 1.0, None, 2.25],
+        "inexact": [0.1, 0.2, 0.3, None],
+        "city": ["Oslo", "Oslo", "Lima", "Oslo"],
+        "ids": ["a", "b", "c", "d"],
+    })
+    compact = ingestion.compact_frame(df)
+    assert str(compact["small"].dtype) == "int8"
+    assert str(compact["exact"].dtype) == "float32"
+    assert str(compact["inexact"].dtype) == "float64"
+    assert isinstance(compact["city"].dtype, pd.CategoricalDtype)
+    assert not isinstance(compact["ids"].dtype, pd.CategoricalDtype)
+    for col in df.columns:
+        assert compact[col].astype(object).where(compact[col].notna(), None).tolist() == \
+            df[col].astype(object).where(df[col].notna(), None).tolist()
+    assert ingestion.memory_bytes(compact) < ingestion.memory_bytes(df)
+
+
+def test_compaction_is_reported(upload):
+    session = upload("city,v\n" + "".join(f"{['Oslo', 'Lima'][i % 2]},{i % 100}\n" for i in range(2000)))
+    quality = session["data_quality"]
+    assert quality["memory_compact_bytes"] < quality["memory_default_bytes"]
+    assert quality["memory_saved_bytes"] == quality["memory_default_bytes"] - quality["memory_compact_bytes"]
@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+import random
+import uuid
+
+import pyarrow as pa
+import pytest
+
+from paging import PageError, decode_cursor, encode_cursor, encode_token, decode_token, parse_filters, select_rows
+
+ROWS = 60
+
+
+def make_table():
+    rng = random.Random(0)
+    # Few distinct values, so every page boundary falls inside a run of ties
+    score = [rng.choice([1, 2, 3, None]) for _ in range(ROWS)]
+    price = [rng.choice([0.5, 1.25, 2.0, None]) for _ in range(ROWS)]
+    day = [datetime(2024, 1, 1) + timedelta(days=rng.randrange(4)) if i % 7 else None for i in range(ROWS)]
+    city = pa.array([rng.choice(["Oslo", "Lima", "Pune", None]) for _ in range(ROWS)]).dictionary_encode()
+    return pa.table({"score": pa.array(score, pa.int64()), "price": price,
+                     "day": pa.array(day, pa.timestamp("us")), "city": city})
+
+
+TABLE = make_table()
+
+
+def expected(table, sort=None, descending=False, keep=lambda row: True):
+    rows = [i for i, row in enumerate(table.to_pylist()) if keep(row)]
+    if sort is None:
+        return rows
+    values = table.column(sort).to_pylist()
+    # Ties keep file order in both directions, and nulls come last
+    present = sorted((i for i in rows if values[i] is not None),
+                     key=lambda i: (values[i], -i if descending else i), reverse=descending)
+    return present + [i for i in rows if values[i] is None]
+
+
+def walk(table, limit, **kwargs):
+    served, cursor = [], None
+    while True:
+        positions, cursor = select_rows(table, cursor=cursor, limit=limit, **kwargs)
+        served.extend(int(p) for p in positions)
+        if cursor is None:
+            return served
+        assert len(positions) == limit
+        assert len(served) <= table.num_rows
+
+
+@pytest.mark.parametrize("limit", [1, 4, 7, ROWS - 1, ROWS, 1000])
+def test_unsorted_pages_follow_file_order(limit):
+    assert walk(TABLE, limit) == expected(TABLE)
+
+
+@pytest.mark.parametrize("limit", [1, 3, 7, 25])
+@pytest.mark.parametrize("sort", ["score", "price", "day", "city"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_sorted_pages_cover_every_row_once(sort, descending, limit):
+    served = walk(TABLE, limit, sort=sort, descending=descending)
+    assert served == expected(TABLE, sort, descending)
+
+
+@pytest.mark.parametrize("sort", [None, "score", "day"])
+def test_filtered_pages(sort):
+    filters = parse_filters(["city:in:Oslo|Lima", "price:notnull"], TABLE.schema)
+    served = walk(TABLE, 3, filters=filters, sort=sort, descending=True)
+    keep = lambda row: row["city"] in ("Oslo", "Lima") and row["price"] is not None
+    assert served == expected(TABLE, sort, True, keep)
+
+
+def test_all_null_and_all_tied_columns():
+    table = pa.table({"a": pa.array([None] * 9, pa.int64()), "b": [5] * 9})
+    assert walk(table, 2, sort="a") == list(range(9))
+    assert walk(table, 2, sort="b", descending=True) == list(range(9))
+
+
+def test_offset_within_a_cursor_page():
+    positions, cursor = select_rows(TABLE, sort="score", limit=5)
+    skipped, _ = select_rows(TABLE, sort="score", cursor=cursor, offset=2, limit=3)
+    full = expected(TABLE, "score")
+    assert list(positions) == full[:5]
+    assert list(skipped) == full[7:10]
+
+
+def test_cursor_round_trip():
+    for args in [(4,), (12, 3, "score"), (5, "2024-01-03 00:00:00", "day"), (59, None, "city")]:
+        row, value, sort = decode_cursor(encode_cursor(*args))
+        assert (row, value, sort) == (args + (None, None))[:3]
+    assert decode_token(encode_token({"t": "2024-01-01T00:00:00", "id": "x"})) == {"t": "2024-01-01T00:00:00", "id": "x"}
+
+
+@pytest.mark.parametrize("cursor", ["!!!", encode_token([1, 2]), encode_token({"v": 1}), encode_token({"r": "x"})])
+def test_invalid_cursors(cursor):
+    with pytest.raises(PageError):
+        select_rows(TABLE, cursor=cursor)
+
+
+def test_cursor_from_another_sort_is_rejected():
+    _, cursor = select_rows(TABLE, sort="score", limit=5)
+    with pytest.raises(PageError):
+        select_rows(TABLE, sort="price", cursor=cursor)
+    with pytest.raises(PageError):
+        select_rows(TABLE, cursor=cursor)
+
+
+def test_paging_over_http(client, upload):
+    lines = ["n,grade"] + [f"{i},{'' if i % 5 == 0 else i % 3}" for i in range(50)]
+    session = upload("\n".join(lines) + "\n")
+    url = f"/api/session/{session['id']}/data"
+    served, cursor = [], None
+    while True:
+        params = {"sort": "grade", "order": "desc", "limit": 6, **({"cursor": cursor} if cursor else {})}
+        body = client.get(url, params=params).json()
+        served.extend(row["n"] for row in body["data"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    grades = {i: None if i % 5 == 0 else i % 3 for i in range(50)}
+    assert served == (sorted((i for i in grades if grades[i] is not None), key=lambda i: (-grades[i], i))
+                      + [i for i in grades if grades[i] is None])
+    assert client.get(url, params={"cursor": "bogus"}).status_code == 400
+
+
+def test_session_list_pages_and_etag(client, upload):
+    mine = [upload(f"a,b\n{i},{uuid.uuid4().hex}\n", filename=f"{uuid.uuid4().hex}.csv")["id"] for i in range(5)]
+    served, cursor = [], None
+    while True:
+        response = client.get("/api/sessions", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        served += [s["id"] for s in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        assert len(response.json()) == 2
+    assert len(served) == len(set(served))
+    # Newest first
+    assert [sid for sid in served if sid in mine] == mine[::-1]
+
+    first = client.get("/api/sessions", params={"limit": 2})
+    again = client.get("/api/sessions", params={"limit": 2}, headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+    assert client.get("/api/sessions", params={"cursor": "bogus"}).status_code == 400
+
+
+def test_cursor_headers_are_exposed_cross_origin(client, upload):
+    session = upload("n\n" + "".join(f"{i}\n" for i in range(10)))
+    response = client.get(f"/api/session/{session['id']}/data", params={"limit": 3, "format": "ndjson"},
+                          headers={"Origin": "https://app.example"})
+    exposed = {h.strip().lower() for h in response.headers["Access-Control-Expose-Headers"].split(",")}
+    assert {"x-next-cursor", "x-total-rows", "etag"} <= exposed
+    assert response.headers["X-Total-Rows"] == "10" and response.headers["X-Next-Cursor"]
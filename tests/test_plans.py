@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+from plans import PlanError, execute_plan, validate_plan
+
+
+@pytest.mark.parametrize("suffix", ["Z", ""])
+@pytest.mark.parametrize("flt, matched", [
+    ({"op": ">=", "value": "2024-02-01"}, 2),
+    ({"op": ">=", "value": "2024-02-03T01:00:00+01:00"}, 2),
+    ({"op": "between", "value": ["2024-01-01", "2024-02-04"]}, 2),
+    ({"op": "in", "value": ["2024-01-01"]}, 1),
+])
+def test_date_filters_on_naive_and_utc_columns(suffix, flt, matched):
+    stamps = [f"2024-01-01T00:00:00{suffix}", f"2024-02-03T00:00:00{suffix}", f"2024-02-05T00:00:00{suffix}"]
+    df = pd.DataFrame({"ts": pd.to_datetime(stamps, format="ISO8601"), "v": [1.0, 2.0, 3.0]})
+    columns_info = [{"name": c, "type": str(df[c].dtype)} for c in df.columns]
+    plan = validate_plan({"filters": [{"column": "ts", **flt}],
+                          "metrics": [{"column": None, "agg": "count", "as": "n"}]}, columns_info)
+    result = execute_plan(plan, len(df), lambda columns, indices=None: df[columns])
+    assert result["rows_matched"] == matched
+
+
+COLUMNS_INFO = [{"name": "region", "type": "object"}, {"name": "sales", "type": "float64"},
+                {"name": "day", "type": "datetime64[ns]"}]
+
+
+@pytest.mark.parametrize("plan", [
+    {"group_by": ["region"], "metrics": [{"column": "sales", "agg": "sum", "as": "region"}]},
+    {"time": {"column": "day"}, "metrics": [{"column": "sales", "agg": "sum", "as": "day"}]},
+    {"time": {"column": "day"}, "group_by": ["region"], "metrics": [{"column": None, "agg": "count", "as": "region"}]},
+])
+def test_metric_names_must_not_shadow_grouping_columns(plan):
+    with pytest.raises(PlanError, match="grouping column"):
+        validate_plan(plan, COLUMNS_INFO)
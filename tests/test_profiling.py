@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from profiling import HyperLogLog, ProfileAccumulator, QuantileSketch, TopK, _hash_values
+
+# HyperLogLog's standard error is 1.04 / sqrt(2**p): 0.8% at p=14
+HLL_TOLERANCE = 0.03
+# Rank error of a quantile estimate, as a fraction of the rows
+RANK_TOLERANCE = 0.01
+
+
+def chunks(values, size):
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def hll_of(values, p=14):
+    hll = HyperLogLog(p)
+    for chunk in chunks(values, 10_000):
+        hll.add_hashes(_hash_values(chunk))
+    return hll
+
+
+def test_hll_is_exact_below_the_register_count():
+    values = np.arange(10_000) % 7_000
+    assert hll_of(values).count() == 7_000
+
+
+@pytest.mark.parametrize("distinct", [20_000, 100_000, 1_000_000])
+def test_hll_count_within_error_bound(distinct):
+    rng = np.random.default_rng(distinct)
+    values = rng.permutation(np.repeat(np.arange(distinct), 2))
+    assert hll_of(values).registers is not None
+    assert abs(hll_of(values).count() - distinct) <= HLL_TOLERANCE * distinct
+
+
+def test_hll_merge_matches_a_single_pass():
+    values = np.arange(200_000)
+    left, right = hll_of(values[:120_000]), hll_of(values[80_000:])
+    merged = left.merge(right)
+    assert merged.count() == hll_of(values).count()
+    assert abs(merged.count() - 200_000) <= HLL_TOLERANCE * 200_000
+
+
+def rank(sorted_values, estimate):
+    return np.searchsorted(sorted_values, estimate, side="right") / len(sorted_values)
+
+
+@pytest.mark.parametrize("dist", ["normal", "lognormal", "integers"])
+def test_quantile_rank_error_within_bound(dist):
+    rng = np.random.default_rng(1)
+    values = {"normal": lambda: rng.normal(size=500_000),
+              "lognormal": lambda: rng.lognormal(sigma=2, size=500_000),
+              "integers": lambda: rng.integers(0, 1_000, size=500_000).astype(float)}[dist]()
+    sketch = QuantileSketch()
+    for chunk in chunks(values, 50_000):
+        sketch.update(chunk)
+    exact = np.sort(values)
+    for q in (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99):
+        estimate = sketch.quantile(q)
+        # With ties the estimate may cover a range of ranks; q must be in it
+        low = np.searchsorted(exact, estimate, side="left") / len(exact)
+        assert low - RANK_TOLERANCE <= q <= rank(exact, estimate) + RANK_TOLERANCE, (q, estimate)
+
+
+def test_quantile_sketch_stays_bounded_and_merges():
+    rng = np.random.default_rng(2)
+    values = rng.normal(size=400_000)
+    left, right = QuantileSketch(seed=1), QuantileSketch(seed=2)
+    for chunk in chunks(values[:200_000], 25_000):
+        left.update(chunk)
+    for chunk in chunks(values[200_000:], 25_000):
+        right.update(chunk)
+    merged = left.merge(right)
+    assert sum(len(level) for level in merged.levels) <= merged.k * len(merged.levels)
+    exact = np.sort(values)
+    for q in (0.05, 0.5, 0.95):
+        assert abs(rank(exact, merged.quantile(q)) - q) <= RANK_TOLERANCE
+
+
+def test_topk_reports_heavy_hitters_with_guaranteed_counts():
+    rng = np.random.default_rng(3)
+    values = pd.Series(rng.zipf(1.5, size=300_000) % 5_000).astype(str)
+    top = TopK(capacity=64)
+    for chunk in chunks(values, 20_000):
+        top.update(chunk.value_counts())
+    exact = values.value_counts()
+
+    reported = top.top(5)
+    assert set(reported) == set(exact.index[:5])
+    for value, count in reported.items():
+        # Never more than the true count, and short by at most the floor
+        assert count <= exact[value]
+        assert exact[value] - count <= top.floor
+
+
+def test_topk_late_heavy_hitter_is_not_overcounted():
+    rng = np.random.default_rng(6)
+    early = pd.Series(rng.integers(0, 1_000, size=50_000)).astype(str)
+    late = pd.Series(["late"] * 400 + list(rng.integers(0, 1_000, size=1_000).astype(str)))
+    top = TopK(capacity=16)
+    for chunk in chunks(early, 5_000) + [late]:
+        top.update(chunk.value_counts())
+    exact = pd.concat([early, late]).value_counts()
+
+    assert top.floor > 0
+    reported = top.top(3)
+    # Counted from when it was first tracked, the floor is not added
+    assert reported["late"] == 400
+    for value, count in reported.items():
+        assert count <= exact[value]
+
+
+def test_topk_merge_keeps_the_bounds():
+    rng = np.random.default_rng(4)
+    values = pd.Series(rng.zipf(1.3, size=200_000) % 2_000).astype(str)
+    parts = []
+    for chunk in chunks(values, 50_000):
+        parts.append(TopK(capacity=32).update(chunk.value_counts()))
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+    exact = values.value_counts()
+    for value, count in merged.top(3).items():
+        assert count <= exact[value] <= count + merged.floor
+    assert set(merged.top(3)) == set(exact.index[:3])
+
+
+def test_sketch_profile_matches_the_exact_profile():
+    rng = np.random.default_rng(5)
+    n = 200_000
+    df = pd.DataFrame({
+        "id": np.arange(n),
+        "amount": rng.lognormal(3, 1, size=n),
+        "city": pd.Series(rng.zipf(1.4, size=n) % 300).map(lambda v: f"city-{v}"),
+    })
+    df.loc[df.sample(frac=0.05, random_state=0).index, "amount"] = np.nan
+
+    sketched, exact = ProfileAccumulator(exact=False), ProfileAccumulator(exact=True)
+    for start in range(0, n, 30_000):
+        sketched.update(df.iloc[start:start + 30_000])
+        exact.update(df.iloc[start:start + 30_000])
+    approx = {c["name"]: c for c in sketched.finalize()[0]}
+    truth = {c["name"]: c for c in exact.finalize()[0]}
+
+    for col in df.columns:
+        assert approx[col]["null_count"] == truth[col]["null_count"]
+        assert abs(approx[col]["unique_count"] - truth[col]["unique_count"]) <= HLL_TOLERANCE * truth[col]["unique_count"]
+    for stat in ("min", "max", "mean", "std"):
+        assert approx["amount"][stat] == pytest.approx(truth["amount"][stat], rel=1e-9)
+    amounts = np.sort(df["amount"].dropna().to_numpy())
+    assert abs(rank(amounts, approx["amount"]["median"]) - 0.5) <= RANK_TOLERANCE
+    assert list(approx["city"]["top_values"]) == list(truth["city"]["top_values"])
+    for value, count in approx["city"]["top_values"].items():
+        assert count <= truth["city"]["top_values"][value]
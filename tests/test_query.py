@@ -0,0 +1,233 @@
+import asyncio, json, time, uuid
+
+import httpx
+import openai
+import pytest
+
+import ratelimit
+from fake_llm import FakeOpenAI
+
+CSV = "region,sales\nN,10\nS,20\nN,5\nE,1\n"
+COLUMNS = {"group": "region", "metric": "sales", "time": None}
+
+
+@pytest.fixture
+def llm(server, monkeypatch):
+    fake = FakeOpenAI(COLUMNS)
+    monkeypatch.setattr(server, "openai_client", fake)
+    return fake
+
+
+@pytest.fixture
+def session(upload):
+    # A distinct file per test, so cached answers never carry over
+    return upload(CSV, filename=f"{uuid.uuid4().hex}.csv")
+
+
+def ask(client, session, query="Total sales by region"):
+    response = client.post("/api/query", json={"session_id": session["id"], "query": query})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def events(response):
+    out = []
+    for block in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        out.append((lines["event"], json.loads(lines["data"])))
+    return out
+
+
+def test_query_runs_the_plan(client, llm, session):
+    body = ask(client, session)
+    assert llm.calls == 1
+    assert body["cache"] == {"hit": False, "layer": None}
+    chart = body["response"]["visualization"]
+    assert {row[chart["x_key"]]: row["total"] for row in chart["data"]} == {"N": 15, "S": 20, "E": 1}
+
+
+def test_repeated_query_is_served_from_cache(client, server, llm, session):
+    ask(client, session, "Total sales by region?")
+    body = ask(client, session, "  total SALES by region ")
+    assert llm.calls == 1
+    assert body["cache"] == {"hit": True, "layer": "memory"}
+
+    # A restart empties the memory cache; the database copy still answers
+    server.llm_cache.clear()
+    body = ask(client, session, "Total sales by region")
+    assert llm.calls == 1
+    assert body["cache"] == {"hit": True, "layer": "database"}
+
+
+def test_new_upload_misses_the_cache(client, llm, session, upload):
+    ask(client, session)
+    other = upload(CSV + "W,7\n", filename=f"{uuid.uuid4().hex}.csv")
+    assert ask(client, other)["cache"]["hit"] is False
+    assert llm.calls == 2
+
+
+def test_stream_sends_sections_then_done(client, llm, session):
+    response = client.post("/api/query/stream", json={"session_id": session["id"], "query": "Sales by region"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    sent = events(response)
+    names = [name for name, _ in sent]
+    assert names[0] == "query_understood"
+    assert {"visualization", "agent_insight", "recommendations"} <= set(names)
+    assert names[-1] == "done" and names.count("done") == 1
+    visualization = dict(sent)["visualization"]
+    assert len(visualization["data"]) == 3
+    done = sent[-1][1]
+    assert done["cache"]["hit"] is False
+    assert done["response"]["visualization"] == visualization
+
+    # The streamed answer was cached and replays without another call
+    again = events(client.post("/api/query/stream", json={"session_id": session["id"], "query": "Sales by region"}))
+    assert llm.calls == 1
+    assert again[-1][1]["cache"]["hit"] is True
+    assert [name for name, _ in again] == names
+
+
+def test_unknown_session(client, llm):
+    assert client.post("/api/query", json={"session_id": "missing", "query": "x"}).status_code == 404
+    assert client.post("/api/query/stream", json={"session_id": "missing", "query": "x"}).status_code == 404
+    assert llm.calls == 0
+
+
+def rate_limited():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, request=request, headers={"retry-after": "0"})
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class Flaky(FakeOpenAI):
+    """Fails the first ``failures`` calls with ``error()``."""
+
+    def __init__(self, error, failures):
+        super().__init__(COLUMNS)
+        self.attempts = 0
+        create = self.chat.completions.create
+
+        async def flaky_create(**kwargs):
+            self.attempts += 1
+            if self.attempts <= failures:
+                raise error()
+            return await create(**kwargs)
+        self.chat.completions.create = flaky_create
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ratelimit, "backoff_delay", lambda attempt, base, cap: 0)
+
+
+def test_rate_limited_call_is_retried(client, server, session, monkeypatch, no_backoff):
+    flaky = Flaky(rate_limited, failures=2)
+    monkeypatch.setattr(server, "openai_client", flaky)
+    body = ask(client, session)
+    assert flaky.attempts == 3 and flaky.calls == 1
+    assert body["response"]["agent_insight"] == "Deterministic benchmark insight."
+
+
+def test_retries_give_up_after_the_limit(client, server, session, monkeypatch, no_backoff):
+    flaky = Flaky(rate_limited, failures=10)
+    monkeypatch.setattr(server, "openai_client", flaky)
+    response = client.post("/api/query", json={"session_id": session["id"], "query": "Sales"})
+    assert response.status_code == 500
+    assert flaky.attempts == server.LLM_MAX_RETRIES + 1
+
+
+def test_other_errors_are_not_retried(client, server, session, monkeypatch, no_backoff):
+    flaky = Flaky(lambda: ValueError("bad request"), failures=1)
+    monkeypatch.setattr(server, "openai_client", flaky)
+    response = client.post("/api/query", json={"session_id": session["id"], "query": "Sales"})
+    assert response.status_code == 500
+    assert flaky.attempts == 1
+
+
+def test_token_bucket_paces_requests():
+    async def burst():
+        bucket = ratelimit.TokenBucket(rate=50, capacity=2)
+        started = time.monotonic()
+        for _ in range(7):
+            await bucket.acquire()
+        return time.monotonic() - started
+    # Two from the full bucket, then five at 50 per second
+    assert asyncio.run(burst()) >= 0.09
+
+
+class Scripted(FakeOpenAI):
+    """Fails queries mentioning "broken"; stalls on ones mentioning "slow"."""
+
+    def __init__(self):
+        super().__init__(COLUMNS)
+        create = self.chat.completions.create
+
+        async def scripted_create(messages=(), **kwargs):
+            query = messages[-1]["content"].rsplit("USER QUERY:", 1)[-1]
+            if "broken" in query:
+                raise ValueError("model refused")
+            if "slow" in query:
+                await asyncio.sleep(30)
+            return await create(messages=messages, **kwargs)
+        self.chat.completions.create = scripted_create
+
+
+def batch(client, session, queries):
+    response = client.post("/api/query/batch", json={"session_id": session["id"], "queries": queries})
+    assert response.status_code == 200, response.text
+    return events(response)
+
+
+def history(client, session):
+    return {q["id"]: q["query"] for q in client.get(f"/api/session/{session['id']}/queries").json()}
+
+
+def test_batch_answers_each_normalized_query_once(client, llm, session):
+    sent = batch(client, session, ["Total sales by region", "Sales by month", "  total SALES by region?"])
+    assert llm.calls == 2
+    results = {tuple(data["indices"]): data for name, data in sent if name == "result"}
+    assert set(results) == {(0, 2), (1,)}
+    assert results[(0, 2)]["query"] == "Total sales by region"
+    name, done = sent[-1]
+    assert name == "done" and done["failed"] == 0
+    assert sorted(done["ids"]) == sorted(data["id"] for data in results.values())
+    assert history(client, session) == {data["id"]: data["query"] for data in results.values()}
+
+
+def test_batch_reports_failures_next_to_results(client, server, session, monkeypatch):
+    monkeypatch.setattr(server, "openai_client", Scripted())
+    sent = batch(client, session, ["Sales by region", "A broken question", "Sales by month"])
+    errors = [data for name, data in sent if name == "error"]
+    assert len(errors) == 1
+    assert errors[0]["indices"] == [1] and errors[0]["query"] == "A broken question"
+    assert "model refused" in errors[0]["detail"]
+    assert sorted(data["indices"][0] for name, data in sent if name == "result") == [0, 2]
+    name, done = sent[-1]
+    assert name == "done" and done["failed"] == 1 and len(done["ids"]) == 2
+    assert sorted(history(client, session).values()) == ["Sales by month", "Sales by region"]
+
+
+@pytest.mark.parametrize("queries", [[], ["ok", "  "]])
+def test_batch_rejects_empty_input(client, session, queries):
+    assert client.post("/api/query/batch", json={"session_id": session["id"], "queries": queries}).status_code == 400
+
+
+def test_batch_keeps_sent_answers_when_the_client_leaves(client, server, session, monkeypatch):
+    monkeypatch.setattr(server, "openai_client", Scripted())
+
+    async def leave_after_first_result():
+        info = await asyncio.to_thread(server.fetch_session, session["id"])
+        context = await server.get_data_context(info)
+        groups = [("Sales by region", [0]), ("A slow question", [1])]
+        stream = server.batch_events(info, groups, context, server.StageTimer("query_batch"))
+        first = await stream.__anext__()
+        running = set(server.background_tasks)
+        await stream.aclose()
+        # Wait for the save that closing the stream left behind
+        await asyncio.gather(*(server.background_tasks - running))
+        return first
+
+    first = client.portal.call(leave_after_first_result)
+    assert first.startswith("event: result")
+    assert list(history(client, session).values()) == ["Sales by region"]
@@ -0,0 +1,124 @@
+import asyncio, time, uuid
+
+import pytest
+
+from fake_llm import FakeOpenAI
+from reports import ReportCache
+
+COLUMNS = {"group": "region", "metric": "sales", "time": None}
+
+
+def write(path, text="pdf"):
+    path.write_text(text)
+
+
+def test_put_replaces_older_digests_of_a_key(tmp_path):
+    cache = ReportCache(tmp_path)
+    first = cache.put("q1", "aaa", write)
+    other = cache.put("q2", "aaa", write)
+    assert cache.get("q1", "aaa") == first
+    second = cache.put("q1", "bbb", write, "new")
+    assert second.read_text() == "new"
+    assert not first.exists() and cache.get("q1", "aaa") is None
+    assert other.exists()
+
+
+def test_failed_render_leaves_nothing_behind(tmp_path):
+    cache = ReportCache(tmp_path)
+    kept = cache.put("q1", "aaa", write)
+
+    def broken(path):
+        path.write_text("half")
+        raise RuntimeError("render failed")
+    with pytest.raises(RuntimeError):
+        cache.put("q1", "bbb", broken)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [kept.name]
+
+
+def test_delete_removes_only_that_key(tmp_path):
+    cache = ReportCache(tmp_path)
+    cache.put("q1", "aaa", write)
+    kept = cache.put("q2", "aaa", write)
+    cache.delete("q1")
+    assert [p.name for p in tmp_path.iterdir()] == [kept.name]
+
+
+@pytest.fixture
+def answered(client, server, upload, monkeypatch):
+    """A fresh session with one answered query; returns (session, query_id)."""
+    monkeypatch.setattr(server, "openai_client", FakeOpenAI(COLUMNS))
+    session = upload("region,sales\nN,10\nS,20\nN,5\n", filename=f"{uuid.uuid4().hex}.csv")
+    response = client.post("/api/query", json={"session_id": session["id"], "query": "Sales by region"})
+    assert response.status_code == 200, response.text
+    return session, response.json()["id"]
+
+
+def reports_for(server, key):
+    return sorted(server.report_cache.root.glob(f"{key}-*.pdf"))
+
+
+def test_report_is_cached_until_its_inputs_change(client, server, answered):
+    _, query_id = answered
+    url = f"/api/report/{query_id}/download"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/pdf" and response.content.startswith(b"%PDF")
+    etag = response.headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert len(reports_for(server, query_id)) == 1
+
+    db = server.SessionLocal()
+    try:
+        row = db.get(server.QueryRecord, query_id)
+        row.response = {**row.response, "agent_insight": "Revised insight"}
+        db.commit()
+    finally:
+        db.close()
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+    # The stale render was replaced
+    digest = response.headers["ETag"].strip('"')
+    assert [p.name for p in reports_for(server, query_id)] == [f"{query_id}-{digest}.pdf"]
+
+
+def test_concurrent_requests_share_one_render(client, server):
+    renders = []
+
+    def slow(path):
+        renders.append(path)
+        time.sleep(0.2)
+        path.write_text("pdf")
+
+    async def both():
+        key = uuid.uuid4().hex
+        return await asyncio.gather(server.ensure_report(key, "d1", slow), server.ensure_report(key, "d1", slow))
+
+    first, second = client.portal.call(both)
+    assert first == second and first.exists()
+    assert len(renders) == 1
+    assert not server.report_renders
+
+
+def test_session_report_export(client, server, answered):
+    session, query_id = answered
+    url = f"/api/session/{session['id']}/report/download"
+    response = client.get(url)
+    assert response.status_code == 200 and response.content.startswith(b"%PDF")
+    assert response.headers["content-disposition"].startswith("attachment; filename=session_report_")
+    assert client.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+    # A new answer changes the report
+    client.post("/api/query", json={"session_id": session["id"], "query": "Average sales"})
+    assert client.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code == 200
+    assert client.get("/api/session/missing/report/download").status_code == 404
+
+
+def test_deleting_a_session_removes_its_reports(client, server, answered):
+    session, query_id = answered
+    assert client.get(f"/api/report/{query_id}/download").status_code == 200
+    assert client.get(f"/api/session/{session['id']}/report/download").status_code == 200
+    assert reports_for(server, query_id) and reports_for(server, f"session-{session['id']}")
+
+    assert client.delete(f"/api/session/{session['id']}").status_code == 200
+    assert reports_for(server, query_id) == [] and reports_for(server, f"session-{session['id']}") == []
+    assert client.get(f"/api/report/{query_id}/download").status_code == 404
@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta, timezone
+import uuid
+
+import pandas as pd
+import pytest
+
+from retention import RetentionPolicy, plan_retention
+import storage
+from storage import DatasetStore
+
+NOW = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+def ago(**kwargs):
+    return NOW - timedelta(**kwargs)
+
+
+def hot(*files):
+    # ``DatasetStore.usage`` shape: ([(file_id, size)], cold_bytes)
+    return ([(f, size) for f, size in files], 0)
+
+
+def test_ttl_expires_old_sessions():
+    sessions = [("old", ago(days=10)), ("new", ago(hours=1))]
+    usage = {"old": hot(("a", 10)), "new": hot(("b", 10))}
+    assert plan_retention(sessions, usage, RetentionPolicy(ttl=86400), NOW) == (["old"], [], [])
+
+
+def test_quota_evicts_least_recently_used_first():
+    sessions = [("b", ago(days=2)), ("newest", ago(hours=1)), ("a", ago(days=3)), ("c", ago(days=1))]
+    usage = {sid: hot((sid, 100)) for sid, _ in sessions}
+    expire, evict, freeze = plan_retention(sessions, usage, RetentionPolicy(quota=250), NOW)
+    assert (expire, evict, freeze) == ([], ["a", "b"], [])
+
+
+def test_quota_never_evicts_the_newest_session():
+    sessions = [("old", ago(days=2)), ("newest", ago(hours=1))]
+    usage = {"old": hot(("o", 100)), "newest": hot(("n", 1000))}
+    assert plan_retention(sessions, usage, RetentionPolicy(quota=10), NOW)[1] == ["old"]
+
+
+def test_shared_files_are_freed_with_their_last_session():
+    # "a" and "b" hard-link one upload; evicting "a" frees nothing
+    sessions = [("a", ago(days=3)), ("b", ago(days=2)), ("c", ago(days=1)), ("newest", ago(hours=1))]
+    usage = {"a": hot(("shared", 100)), "b": hot(("shared", 100)), "c": hot(("c", 100)), "newest": hot(("n", 10))}
+    assert plan_retention(sessions, usage, RetentionPolicy(quota=150), NOW)[1] == ["a", "b"]
+
+
+def test_idle_and_over_quota_sessions_are_frozen():
+    sessions = [("idle", ago(days=9)), ("busy", ago(days=1)), ("cold", ago(days=20)), ("newest", ago(hours=1))]
+    usage = {"idle": hot(("i", 100)), "busy": hot(("b", 100)), "cold": ([], 40), "newest": hot(("n", 100))}
+    policy = RetentionPolicy(cold_after=7 * 86400)
+    assert plan_retention(sessions, usage, policy, NOW)[2] == ["idle"]
+    policy = RetentionPolicy(hot_quota=150)
+    assert plan_retention(sessions, usage, policy, NOW)[2] == ["idle", "busy"]
+
+
+def test_evicted_sessions_are_not_also_frozen():
+    sessions = [("old", ago(days=30)), ("newest", ago(hours=1))]
+    usage = {"old": hot(("o", 100)), "newest": hot(("n", 10))}
+    policy = RetentionPolicy(cold_after=86400, quota=50)
+    assert plan_retention(sessions, usage, policy, NOW) == ([], ["old"], [])
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = DatasetStore(tmp_path / "hot", tmp_path / "cold")
+    store.save("s", pd.DataFrame({"a": range(1000), "b": ["x", "y"] * 500}))
+    store.save_state("s", {"a": ("numeric", None)}, pd.Series([1, 2], dtype="uint64").to_numpy(), "profile")
+    return store
+
+
+def test_freeze_and_thaw_round_trip(store):
+    before = store.read_table("s")
+    size = store.freeze("s")
+    assert size and not store.path_for("s").exists()
+    assert store.is_cold("s") and store.exists("s")
+    hot_files, cold_bytes = store.usage("s")
+    assert hot_files == [] and cold_bytes == size
+    assert store.freeze("s") is None
+
+    assert store.read_table("s").equals(before)
+    assert not store.is_cold("s")
+    types, hashes, profile = store.load_state("s")
+    assert types == {"a": ("numeric", None)} and list(hashes) == [1, 2] and profile == "profile"
+
+
+def test_freeze_skips_a_session_being_appended_to(store):
+    with store.lock("s"):
+        assert store.freeze("s") is None
+    assert store.path_for("s").exists() and not store.is_cold("s")
+    assert store.freeze("s")
+
+
+def test_freeze_keeps_files_replaced_while_compressing(store, monkeypatch):
+    copy = storage._copy_stream
+
+    def replaced_meanwhile(source, sink):
+        store.save("s", pd.DataFrame({"a": [1]}))
+        copy(source, sink)
+    monkeypatch.setattr(storage, "_copy_stream", replaced_meanwhile)
+    assert store.freeze("s") is None
+    monkeypatch.undo()
+    assert store.read_table("s").num_rows == 1
+    assert not store.is_cold("s")
+
+
+@pytest.fixture
+def only(server, monkeypatch):
+    """Limits retention passes to the given sessions, so other tests'
+    sessions are left alone."""
+    usage = server.storage_usage
+
+    def _only(*ids):
+        def scoped(db):
+            sessions, stored = usage(db)
+            return [s for s in sessions if s[0] in ids], {sid: stored[sid] for sid in ids}
+        monkeypatch.setattr(server, "storage_usage", scoped)
+    return _only
+
+
+def set_last_used(server, session_id, when):
+    db = server.SessionLocal()
+    try:
+        db.query(server.FileSession).filter(server.FileSession.id == session_id).update({"last_accessed_at": when})
+        db.commit()
+    finally:
+        db.close()
+
+
+def sessions_of(upload, n):
+    return [upload("k,v\n" + "".join(f"{j},{uuid.uuid4().hex}\n" for j in range(50)), filename=f"{uuid.uuid4().hex}.csv")
+            for _ in range(n)]
+
+
+def test_retention_pass_evicts_over_quota(client, server, upload, only, monkeypatch):
+    old, mid, new = sessions_of(upload, 3)
+    for i, s in enumerate((old, mid, new)):
+        set_last_used(server, s["id"], datetime.now(timezone.utc) - timedelta(days=3 - i))
+    only(old["id"], mid["id"], new["id"])
+    sizes = {s["id"]: sum(size for _, size in server.dataset_store.usage(s["id"])[0]) for s in (old, mid, new)}
+    # Room for all but the oldest
+    monkeypatch.setattr(server, "retention_policy", RetentionPolicy(quota=sum(sizes.values()) - sizes[old["id"]]))
+
+    result = server.run_retention()
+    assert result["evicted"] == 1
+    assert client.get(f"/api/session/{old['id']}").status_code == 404
+    assert not server.dataset_store.exists(old["id"])
+    for s in (mid, new):
+        assert client.get(f"/api/session/{s['id']}/data").json()["total_rows"] == 50
+
+
+def test_retention_pass_freezes_idle_sessions(client, server, upload, only, monkeypatch):
+    idle, busy = sessions_of(upload, 2)
+    set_last_used(server, idle["id"], datetime.now(timezone.utc) - timedelta(days=30))
+    only(idle["id"], busy["id"])
+    monkeypatch.setattr(server, "retention_policy", RetentionPolicy(cold_after=86400))
+
+    # Not while an append holds the session
+    with server.dataset_store.lock(idle["id"]):
+        assert server.run_retention()["frozen"] == 0
+    assert server.run_retention()["frozen"] == 1
+    assert server.dataset_store.is_cold(idle["id"])
+    assert not server.dataset_store.is_cold(busy["id"])
+
+    # Reading the rows brings the dataset back
+    data = client.get(f"/api/session/{idle['id']}/data").json()
+    assert data["total_rows"] == 50
+    assert not server.dataset_store.is_cold(idle["id"])
@@ -0,0 +1,125 @@
+import uuid
+
+import pytest
+
+
+def analysis(insight="", summary=()):
+    return {"agent_insight": insight, "analysis_summary": list(summary)}
+
+
+@pytest.fixture
+def record(server):
+    """Saves a query record in a fresh session; returns its id."""
+    session_id = str(uuid.uuid4())
+
+    def _record(query, insight="", summary=(), session=None):
+        query_id = str(uuid.uuid4())
+        server.save_query_record(query_id, session or session_id, query, analysis(insight, summary))
+        return query_id
+    _record.session_id = session_id
+    return _record
+
+
+def search(client, q, session_id=None, **params):
+    response = client.get("/api/queries/search", params={"q": q, **({"session_id": session_id} if session_id else {}), **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def ids(body):
+    return [hit["id"] for hit in body["results"]]
+
+
+def test_query_text_outranks_insight_and_summary(client, record):
+    in_summary = record("Monthly totals", summary=["Churn is flat"])
+    in_query = record("Why did churn rise", insight="Prices went up")
+    in_insight = record("Quarterly revenue", insight="Churn rose in March")
+    body = search(client, "churn", record.session_id)
+    assert ids(body) == [in_query, in_insight, in_summary]
+    scores = [hit["score"] for hit in body["results"]]
+    assert scores == sorted(scores, reverse=True)
+    assert "<mark>" in body["results"][0]["snippet"]
+
+
+def test_stemming_and_prefix_match(client, record):
+    hit = record("Forecast shipments for next quarter")
+    assert ids(search(client, "shipment", record.session_id)) == [hit]
+    assert ids(search(client, "forec", record.session_id)) == [hit]
+    assert ids(search(client, "quarterly widgets", record.session_id)) == []
+
+
+def test_search_is_scoped_to_a_session(client, record):
+    mine = record("Inventory turnover by warehouse")
+    other = record("Inventory turnover by region", session=str(uuid.uuid4()))
+    assert ids(search(client, "inventory turnover", record.session_id)) == [mine]
+    assert {mine, other} <= set(ids(search(client, "inventory turnover", limit=100)))
+
+
+def test_pages_cover_every_match_once(client, record):
+    # Repeats make scores differ; equal repeats make ties the cursor must split
+    saved = {record("Latency report " + "latency " * (i % 4), summary=[f"Run {i}"]) for i in range(23)}
+    served, cursor, scores = [], None, []
+    while True:
+        body = search(client, "latency", record.session_id, limit=4, **({"cursor": cursor} if cursor else {}))
+        served += ids(body)
+        scores += [hit["score"] for hit in body["results"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+        assert len(body["results"]) == 4
+    assert len(served) == len(set(served)) and set(served) == saved
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_index_follows_updates(client, server, record):
+    query_id = record("Sales by region", insight="Walrus sightings doubled")
+    assert ids(search(client, "walrus", record.session_id)) == [query_id]
+
+    db = server.SessionLocal()
+    try:
+        row = db.get(server.QueryRecord, query_id)
+        row.response = analysis("Penguin counts fell", ["Seals steady"])
+        db.commit()
+        assert ids(search(client, "walrus", record.session_id)) == []
+        assert ids(search(client, "penguin", record.session_id)) == [query_id]
+        assert ids(search(client, "seals", record.session_id)) == [query_id]
+
+        row.query = "Otter population by month"
+        db.commit()
+        assert ids(search(client, "otter", record.session_id)) == [query_id]
+        assert ids(search(client, "sales region", record.session_id)) == []
+        # The untouched response is still indexed
+        assert ids(search(client, "penguin", record.session_id)) == [query_id]
+    finally:
+        db.close()
+
+
+def test_index_follows_deletes(client, server, record):
+    kept = record("Warehouse backlog", insight="Pallet count grew")
+    gone = record("Warehouse staffing", insight="Pallet moves per hour")
+    db = server.SessionLocal()
+    try:
+        db.query(server.QueryRecord).filter(server.QueryRecord.id == gone).delete()
+        db.commit()
+    finally:
+        db.close()
+    assert ids(search(client, "pallet", record.session_id)) == [kept]
+
+
+def test_deleting_a_session_removes_its_queries(client, server, upload, record):
+    session = upload("a,b\n1,2\n", filename=f"{uuid.uuid4().hex}.csv")
+    record("Narwhal tusk lengths", session=session["id"])
+    assert len(search(client, "narwhal", session["id"])["results"]) == 1
+    assert client.delete(f"/api/session/{session['id']}").status_code == 200
+    assert search(client, "narwhal", session["id"])["results"] == []
+    assert search(client, "narwhal")["results"] == []
+
+
+@pytest.mark.parametrize("params", [{"q": "?!"}, {"q": "sales", "cursor": "bogus"}])
+def test_bad_requests(client, params):
+    assert client.get("/api/queries/search", params=params).status_code == 400
+
+
+def test_query_syntax_is_treated_as_text(client, record):
+    hit = record('Revenue "NEAR" cost OR margin')
+    assert ids(search(client, 'near(revenue cost) OR "', record.session_id)) == [hit]
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+import subprocess, sys, threading, time
+
+import pandas as pd
+import pyarrow as pa
+
+from ingestion import compact_frame
+from storage import DatasetLock, DatasetStore, DatasetWriter
+
+HOLD = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from storage import DatasetLock
+with DatasetLock(__import__("pathlib").Path(sys.argv[2])):
+    print("held", flush=True)
+    sys.stdin.read()
+"""
+
+
+def test_lock_excludes_other_processes(tmp_path, server):
+    path = tmp_path / "s.lock"
+    backend = str(server.ROOT_DIR)
+    holder = subprocess.Popen([sys.executable, "-c", HOLD, backend, str(path)],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == "held"
+        assert DatasetLock(path).acquire(blocking=False) is False
+    finally:
+        holder.stdin.close()
+        holder.wait(10)
+    lock = DatasetLock(path)
+    assert lock.acquire(blocking=False) is True
+    lock.release()
+
+
+def test_lock_excludes_other_threads(tmp_path):
+    first, second = DatasetLock(tmp_path / "s.lock"), DatasetLock(tmp_path / "s.lock")
+    with first:
+        assert second.acquire(blocking=False) is False
+    assert second.acquire(blocking=False) is True
+    second.release()
+
+
+def test_delete_waits_for_the_lock_and_removes_it(tmp_path):
+    store = DatasetStore(tmp_path)
+    store.path_for("s").write_bytes(b"rows")
+    lock = store.lock("s")
+    lock.acquire()
+    deleter = threading.Thread(target=store.delete, args=("s",))
+    deleter.start()
+    time.sleep(0.1)
+    assert store.path_for("s").exists()
+    lock.release()
+    deleter.join(5)
+    assert not deleter.is_alive()
+    assert list(tmp_path.iterdir()) == [tmp_path / "cold"]
+
+    # A waiter that locked the removed file tries again on a new one
+    assert store.lock("s").acquire(blocking=False)
+
+
+def test_concurrent_appends_keep_every_row(client, upload, server):
+    session = upload("id,v\n" + "".join(f"{i},0\n" for i in range(10)))
+
+    def append(n):
+        rows = "".join(f"{n * 1000 + i},{n}\n" for i in range(50))
+        return client.post(f"/api/session/{session['id']}/append",
+                           files={"file": ("more.csv", f"id,v\n{rows}".encode(), "text/csv")})
+
+    with ThreadPoolExecutor(6) as pool:
+        responses = list(pool.map(append, range(1, 7)))
+    assert [r.status_code for r in responses] == [200] * 6
+    assert max(r.json()["row_count"] for r in responses) == 310
+    stored = client.get(f"/api/session/{session['id']}/data", params={"limit": 1000}).json()
+    assert stored["total_rows"] == 310
+
+    # Deleting the session removes its lock file with the dataset
+    assert client.delete(f"/api/session/{session['id']}").status_code == 200
+    assert not list(server.dataset_store.root.glob(f"{session['id']}*"))
+
+
+def read_back(path):
+    return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+
+def test_writer_never_narrows_floats(tmp_path):
+    with DatasetWriter(tmp_path / "x.arrow") as writer:
+        # Round values first, so the file starts out float32
+        writer.write(compact_frame(pd.DataFrame({"price": [1.0, 2.5, None]})))
+        assert writer.schema.field("price").type == pa.float32()
+        writer.write(compact_frame(pd.DataFrame({"price": [123456789.123, 0.1, None]})))
+        writer.write(compact_frame(pd.DataFrame({"price": [7.0, 0.5, 2.0]})))
+    table = read_back(tmp_path / "x.arrow")
+    assert table.schema.field("price").type == pa.float64()
+    assert table.column("price").to_pylist() == [1.0, 2.5, None, 123456789.123, 0.1, None, 7.0, 0.5, 2.0]
+
+
+def test_writer_widens_integers_into_a_float32_column(tmp_path):
+    with DatasetWriter(tmp_path / "x.arrow") as writer:
+        writer.write(compact_frame(pd.DataFrame({"v": [0.5, None]})))
+        writer.write(compact_frame(pd.DataFrame({"v": [3, 2 ** 30 + 1]})))
+    assert read_back(tmp_path / "x.arrow").column("v").to_pylist() == [0.5, None, 3.0, 2 ** 30 + 1.0]
+
+
+def test_writer_keeps_float32_while_values_fit(tmp_path):
+    with DatasetWriter(tmp_path / "x.arrow") as writer:
+        writer.write(compact_frame(pd.DataFrame({"v": [1.0, 2.5]})))
+        writer.write(pd.DataFrame({"v": [0.25, None, 1e6]}))
+    table = read_back(tmp_path / "x.arrow")
+    assert table.schema.field("v").type == pa.float32()
+    assert table.column("v").to_pylist() == [1.0, 2.5, 0.25, None, 1e6]
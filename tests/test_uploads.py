@@ -0,0 +1,97 @@
+import asyncio, hashlib, os, tempfile, threading, time
+
+import pytest
+
+from jobs import JobCancelled
+from metrics import StageTimer
+
+CSV = "region,sales\nN,1\nS,2\nE,3\n"
+
+
+def spooled(text):
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    return path, hashlib.sha256(text.encode()).hexdigest()
+
+
+def stored_files(server):
+    return sorted(p.name for p in server.dataset_store.root.iterdir() if p.is_file())
+
+
+def test_cancelled_reuse_leaves_no_files(server, upload):
+    upload(CSV)
+    before = stored_files(server)
+
+    def progress(stage, rows=None):
+        if stage == "reused":
+            raise JobCancelled()
+
+    path, digest = spooled(CSV)
+    with pytest.raises(JobCancelled):
+        asyncio.run(server.process_upload(path, "csv", "copy.csv", StageTimer("upload"), progress, digest))
+    assert stored_files(server) == before
+    assert not os.path.exists(path)
+
+
+def test_reuse_cancelled_during_lookup_leaves_no_files(server, upload, monkeypatch):
+    upload(CSV)
+    before = stored_files(server)
+    lookup = server.reuse_stored_upload
+
+    def slow_lookup(*args):
+        time.sleep(0.2)
+        return lookup(*args)
+    monkeypatch.setattr(server, "reuse_stored_upload", slow_lookup)
+
+    async def cancel_midway():
+        path, digest = spooled(CSV)
+        task = asyncio.ensure_future(server.process_upload(path, "csv", "copy.csv", StageTimer("upload"), None, digest))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_midway())
+    # Give a lookup thread that outlived the task time to link its files
+    time.sleep(0.3)
+    assert stored_files(server) == before
+
+
+def session_files(client):
+    return {s["filename"] for s in client.get("/api/sessions", params={"limit": 500}).json()}
+
+
+def test_cancel_while_saving_rolls_the_session_back(client, server, monkeypatch):
+    save = server.save_session
+    saving = threading.Event()
+
+    def slow_save(*args):
+        saving.set()
+        time.sleep(0.3)
+        return save(*args)
+    monkeypatch.setattr(server, "save_session", slow_save)
+
+    before = stored_files(server)
+    job = client.post("/api/upload/jobs", files={"file": ("saving.csv", b"a,b\n1,saving\n", "text/csv")}).json()
+    assert saving.wait(5)
+    response = client.delete(f"/api/upload/jobs/{job['id']}")
+    assert response.status_code == 200
+    assert response.json()["status"] == "cancelled"
+    assert "saving.csv" not in session_files(client)
+    assert stored_files(server) == before
+
+
+def test_cancel_outcome_matches_the_job(client, server):
+    for i in range(10):
+        body = ("a,b\n" + "\n".join(f"{j},{i}" for j in range(2000))).encode()
+        job = client.post("/api/upload/jobs", files={"file": (f"race-{i}.csv", body, "text/csv")}).json()
+        time.sleep(0.003 * i)
+        response = client.delete(f"/api/upload/jobs/{job['id']}")
+        status = client.get(f"/api/upload/jobs/{job['id']}").json()["status"]
+        if response.status_code == 200:
+            assert status == "cancelled"
+            assert f"race-{i}.csv" not in session_files(client)
+        else:
+            assert response.status_code == 409 and status == "done"
+            assert f"race-{i}.csv" in session_files(client)